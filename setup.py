@@ -77,7 +77,9 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    # install_requires=['caenvme', 'numpy'],
+    # caenvme is optional (see vme.modules.caenvme_ctypes), PyQt4 is only
+    # needed by the vme_suite widgets
+    install_requires=['numpy'],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
@@ -109,5 +111,9 @@ setup(
         'gui_scripts': [
             'vme_suite=vme.widgets:main',
         ],
+        'console_scripts': [
+            'vme_bridge_server=vme.modules.remote:main',
+            'vme_daq=vme.daq.cli:main',
+        ],
     },
 )
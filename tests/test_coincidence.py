@@ -0,0 +1,63 @@
+import numpy as np
+
+from vme.analysis.coincidence import find_coincidences, CoincidenceFinder
+
+
+def incremental(readouts, window, multiplicity=2, ends=None):
+    finder = CoincidenceFinder(len(readouts[0]), window, multiplicity)
+    ends = ends or [None] * len(readouts)
+    tables = [finder.add(r, end) for r, end in zip(readouts, ends)]
+    tables.append(finder.flush())
+
+    return np.concatenate(tables)
+
+
+def combined(readouts):
+    return [np.concatenate([r[k] for r in readouts])
+            for k in range(len(readouts[0]))]
+
+
+def test_stream_without_hits():
+    readouts = [[[100, 200], []], [[300], [105, 205, 305]]]
+
+    table = incremental(readouts, 10)
+
+    np.testing.assert_array_equal(table, [[0, 0], [1, 1], [2, 2]])
+    np.testing.assert_array_equal(
+        table, find_coincidences(combined(readouts), 10))
+
+
+def test_dead_stream():
+    finder = CoincidenceFinder(3, 10)
+
+    table = finder.add([[100, 200], [], [105, 205]], end=300)
+
+    # the silent stream does not hold back groups before its end
+    np.testing.assert_array_equal(table, [[0, -1, 0], [1, -1, 1]])
+    assert len(finder.flush()) == 0
+
+
+def test_random_readouts():
+    rng = np.random.RandomState(0)
+
+    for trial in range(20):
+        n_streams = rng.randint(2, 5)
+        times = [np.sort(rng.randint(0, 10000, rng.randint(0, 200)))
+                 for k in range(n_streams)]
+
+        # split every stream at the same times into readouts
+        cuts = np.sort(rng.randint(0, 10000, 5))
+        bounds = list(zip(np.concatenate([[0], cuts]),
+                          np.concatenate([cuts, [10000]])))
+        readouts = [[t[(t >= lo) & (t < hi)] for t in times]
+                    for lo, hi in bounds]
+        ends = [hi - 1 for lo, hi in bounds]
+
+        for multiplicity in range(2, n_streams + 1):
+            expected = find_coincidences(times, 20, multiplicity)
+
+            for e in [None, ends]:
+                table = incremental(readouts, 20, multiplicity, e)
+
+                np.testing.assert_array_equal(
+                    table.reshape(-1, n_streams), expected)
@@ -0,0 +1,71 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+QtGui = pytest.importorskip('PyQt4.QtGui')
+
+if sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+    pytest.skip('no display', allow_module_level=True)
+
+from vme.modules.bridge import LockedBridge
+from vme.modules.simulator import (SimulatedBridge, SimulatedSIS3302,
+                                   SimulatedCAEN895)
+from vme.widgets import VMESuite, CrateView, MODULES
+
+SIS3302_BASE = 0x10000000
+CAEN895_BASE = 0xEE0000
+
+
+@pytest.fixture
+def suite():
+    app = QtGui.QApplication.instance() or VMESuite([])
+
+    bridge = SimulatedBridge()
+    bridge.addModule(SIS3302_BASE, SimulatedSIS3302())
+    bridge.addModule(CAEN895_BASE, SimulatedCAEN895())
+
+    app.controller = LockedBridge(bridge)
+    app.crateView = CrateView(app.controller, list(MODULES))
+
+    yield app
+
+    app.crateView.close()
+
+
+def test_scan_crate(suite):
+    suite.scanCrate()
+
+    assert sorted(suite.crateView.widgets) == [
+        'sis3302@10000000', 'v895@00EE0000']
+
+
+def test_attach_shown_module(suite):
+    suite.addModule('sis3302', SIS3302_BASE, attach=True)
+    widget = suite.crateView.widgets['sis3302@10000000']
+
+    # a module shown already gets no new driver and widget
+    suite.addModule('sis3302', SIS3302_BASE, attach=True)
+    suite.addModule('sis3302', SIS3302_BASE)
+
+    assert suite.crateView.widgets['sis3302@10000000'] is widget
+    assert suite.crateView.tabs.count() == 1
+
+
+def test_close_tab_stops_threads(suite):
+    suite.addModule('v895', CAEN895_BASE)
+    writer = suite.crateView.widgets['v895@00EE0000'].writer
+
+    suite.crateView.closeTab(0)
+
+    assert suite.crateView.widgets == {}
+    assert writer.isFinished()
+
+
+def test_polyline():
+    from vme.widgets.sis3302 import polyline
+
+    polygon = polyline(np.arange(3), np.array([5., 7., 6.]))
+
+    assert [(p.x(), p.y()) for p in polygon] == [(0, 5), (1, 7), (2, 6)]
@@ -0,0 +1,244 @@
+'''
+vme/analysis/coincidence.py
+---------------------------
+
+Coincidences between timestamp streams (ADC channels or boards).
+
+All functions work on sorted timestamp arrays as returned by
+readTimestampDirectory and run in O(n log n) using searchsorted and
+a merge of the streams, without per-event Python loops.
+'''
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# horizon of a stream without hits
+_NO_HIT = np.iinfo(np.int64).min
+
+
+def find_pairs(a, b, window):
+    '''
+    Finds all pairs of timestamps of a and b at most window apart.
+
+    Parameters
+    ----------
+    a, b : array_like
+        Sorted timestamps (clock ticks).
+    window : int
+        Coincidence window (clock ticks).
+
+    Returns
+    -------
+    i, j : ndarray
+        Indices into a and b of the coincident pairs.
+    '''
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+
+    lo = np.searchsorted(b, a - window, side='left')
+    hi = np.searchsorted(b, a + window, side='right')
+    counts = hi - lo
+
+    i = np.repeat(np.arange(len(a)), counts)
+
+    # position of each pair within the range of its timestamp in a
+    first = np.cumsum(counts) - counts
+    j = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(first,
+                                                                   counts)
+
+    return i, j
+
+
+def _merge(streams):
+    '''
+    Merges streams, returns times, stream ids and indices in the stream.
+    '''
+    times = np.concatenate([np.asarray(s, dtype=np.int64) for s in streams])
+    ids = np.concatenate([np.full(len(s), k, dtype=np.int64)
+                          for k, s in enumerate(streams)])
+    index = np.concatenate([np.arange(len(s)) for s in streams])
+
+    order = np.argsort(times, kind='mergesort')
+
+    return times[order], ids[order], index[order]
+
+
+def _groups(times, ids, index, n_streams, window, multiplicity):
+    '''
+    Groups merged hits and selects groups with enough streams.
+
+    Returns group number per hit and the coincidence table.
+    '''
+    if len(times) == 0:
+        return (np.zeros(0, dtype=np.int64),
+                np.zeros((0, n_streams), dtype=np.int64))
+
+    group = np.concatenate([[0], np.cumsum(np.diff(times) > window)])
+    n_groups = group[-1] + 1
+
+    # first hit of every stream in every group
+    table = np.full((n_groups, n_streams), -1, dtype=np.int64)
+    _, first = np.unique(group * n_streams + ids, return_index=True)
+
+    table[group[first], ids[first]] = index[first]
+
+    selected = (table >= 0).sum(axis=1) >= multiplicity
+
+    return group, table[selected]
+
+
+def find_coincidences(streams, window, multiplicity=2):
+    '''
+    Finds coincidences of at least multiplicity streams.
+
+    Hits of all streams are merged in time and grouped, a new group
+    starts wherever the gap to the previous hit exceeds window.
+
+    Parameters
+    ----------
+    streams : list
+        Sorted timestamp arrays, one per channel or board.
+    window : int
+        Maximum gap (clock ticks) between hits of a group.
+    multiplicity : int
+        Minimum number of different streams in a group.
+
+    Returns
+    -------
+    table : ndarray
+        One row per coincidence with the index of the first hit of
+        every stream in the group (-1 if the stream has no hit).
+    '''
+    times, ids, index = _merge(streams)
+    group, table = _groups(times, ids, index, len(streams), window,
+                           multiplicity)
+
+    return table
+
+
+class CoincidenceFinder(object):
+    '''
+    Finds coincidences incrementally across successive readouts.
+
+    Hits which might still form a group with hits of later readouts
+    (closer than window to the latest time all streams have reached)
+    are kept until the next call. Indices count from the first hit of
+    each stream ever added.
+
+    The time a stream has reached is its last hit, or the end of the
+    readout if given to add. Without end a stream with few hits holds
+    back the hits of all streams, and nothing is returned before every
+    stream has had a hit.
+    '''
+
+    def __init__(self, n_streams, window, multiplicity=2):
+        self.n_streams = n_streams
+        self.window = window
+        self.multiplicity = multiplicity
+
+        self.reset()
+
+    def reset(self):
+        self.n_hits = np.zeros(self.n_streams, dtype=np.int64)
+        self.horizon = np.full(self.n_streams, _NO_HIT, dtype=np.int64)
+        self._times = np.zeros(0, dtype=np.int64)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._index = np.zeros(0, dtype=np.int64)
+
+    def _insert(self, times, ids, index):
+        '''
+        Merges sorted new hits into the sorted held back hits.
+        '''
+        position = np.searchsorted(self._times, times, side='right')
+        position += np.arange(len(times))
+
+        n = len(self._times) + len(times)
+        new = np.zeros(n, dtype=bool)
+        new[position] = True
+
+        merged = []
+
+        for held, added in [(self._times, times), (self._ids, ids),
+                            (self._index, index)]:
+            data = np.empty(n, dtype=np.int64)
+            data[position] = added
+            data[~new] = held
+            merged.append(data)
+
+        return merged
+
+    def add(self, streams, end=None):
+        '''
+        Adds the new timestamps of every stream and returns the
+        coincidences which are complete (see find_coincidences).
+
+        end is the time up to which the readout has covered the streams
+        (scalar or one value per stream): later readouts only contain
+        later hits.
+        '''
+        if len(streams) != self.n_streams:
+            raise ValueError('expected {0} streams'.format(self.n_streams))
+
+        times, ids, index = _merge(streams)
+        index += self.n_hits[ids]
+
+        for k, s in enumerate(streams):
+            self.n_hits[k] += len(s)
+
+            if len(s) > 0:
+                self.horizon[k] = max(self.horizon[k], int(s[-1]))
+
+        if end is not None:
+            end = np.broadcast_to(np.asarray(end, dtype=np.int64),
+                                  (self.n_streams,))
+            self.horizon = np.maximum(self.horizon, end)
+
+        times, ids, index = self._insert(times, ids, index)
+
+        group = np.concatenate([[0], np.cumsum(np.diff(times) >
+                                               self.window)])
+
+        if np.any(self.horizon == _NO_HIT):
+            # a stream without hits yet may join any group
+            done = 0
+        elif len(times) > 0:
+            # groups reaching closer than window to the horizon may
+            # continue
+            limit = self.horizon.min() - self.window
+            group_end = np.maximum.reduceat(times, np.flatnonzero(
+                np.diff(np.concatenate([[-1], group]))))
+            open_groups = np.flatnonzero(group_end >= limit)
+
+            if len(open_groups) > 0:
+                done = np.searchsorted(group, open_groups[0])
+            else:
+                done = len(times)
+        else:
+            done = 0
+
+        self._times = times[done:]
+        self._ids = ids[done:]
+        self._index = index[done:]
+
+        group, table = _groups(times[:done], ids[:done], index[:done],
+                               self.n_streams, self.window,
+                               self.multiplicity)
+
+        return table
+
+    def flush(self):
+        '''
+        Returns the coincidences of all held back hits (end of run).
+        '''
+        group, table = _groups(self._times, self._ids, self._index,
+                               self.n_streams, self.window,
+                               self.multiplicity)
+
+        self._times = self._times[:0]
+        self._ids = self._ids[:0]
+        self._index = self._index[:0]
+
+        return table
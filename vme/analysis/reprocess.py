@@ -0,0 +1,180 @@
+'''
+vme/analysis/reprocess.py
+-------------------------
+
+Process-parallel reprocessing of runs written by RawWriter.
+
+A run is split into event-range chunks which are processed by a pool
+of worker processes. Workers open the data files as memory maps
+themselves, only file names and event ranges are sent to them. The
+results of the chunks are merged in event order, so the outcome does
+not depend on the number of workers or on which chunk finished first.
+
+The processing function gets a batch (dict name -> array, rows are
+events) and the index of its first event in the run. It returns an
+array (e.g. a feature table) or a dict of arrays, see merge_results.
+It has to be picklable, i.e. defined at module level.
+'''
+
+import os
+import glob
+import json
+import multiprocessing
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def open_array(filename):
+    '''
+    Opens a .dat file written by RawWriter read-only as np.memmap.
+    '''
+    with open(filename[:-4] + '.json') as f:
+        header = json.load(f)
+
+    shape = tuple([header['rows']] + header['shape'])
+
+    if header['rows'] == 0:
+        return np.zeros(shape, dtype=header['dtype'])
+
+    return np.memmap(filename, dtype=header['dtype'], mode='r', shape=shape)
+
+
+def find_run(directory, prefix='run'):
+    '''
+    Finds the file sets of a run.
+
+    Returns a list (one entry per file set, in order) of dicts
+    name -> (filename, rows).
+    '''
+    pattern = os.path.join(directory, '{0}_*_[0-9][0-9][0-9][0-9].json'
+                           .format(prefix))
+
+    file_sets = {}
+
+    for sidecar in sorted(glob.glob(pattern)):
+        base = os.path.basename(sidecar)[len(prefix) + 1:-5]
+        name, index = base.rsplit('_', 1)
+
+        with open(sidecar) as f:
+            rows = json.load(f)['rows']
+
+        file_sets.setdefault(int(index), {})[name] = (sidecar[:-5] + '.dat',
+                                                      rows)
+
+    return [file_sets[i] for i in sorted(file_sets)]
+
+
+def make_chunks(file_sets, chunk_size):
+    '''
+    Splits the file sets into chunks of at most chunk_size events.
+
+    Returns a list of (first event, {name: (filename, start, stop)}).
+    All arrays of a file set must have the same number of rows.
+    '''
+    chunks = []
+    first = 0
+
+    for files in file_sets:
+        rows = set(r for filename, r in files.values())
+
+        if len(rows) != 1:
+            msg = 'arrays of {0} differ in length'
+            raise ValueError(msg.format(sorted(files)))
+
+        rows = rows.pop()
+
+        for start in range(0, rows, chunk_size):
+            stop = min(start + chunk_size, rows)
+            chunks.append((first + start,
+                           dict((name, (filename, start, stop))
+                                for name, (filename, r) in files.items())))
+
+        first += rows
+
+    return chunks
+
+
+def _process_chunk(args):
+    function, first, files = args
+
+    batch = dict((name, open_array(filename)[start:stop])
+                 for name, (filename, start, stop) in files.items())
+
+    return function(batch, first)
+
+
+def merge_results(results, sums=()):
+    '''
+    Merges the results of consecutive chunks.
+
+    Arrays are concatenated along the first axis (feature tables), dicts
+    are merged key by key. Keys listed in sums are added up instead
+    (histograms, counters).
+    '''
+    results = [r for r in results if r is not None]
+
+    if not results:
+        return None
+
+    if isinstance(results[0], dict):
+        merged = {}
+
+        for key in results[0]:
+            values = [r[key] for r in results]
+
+            if key in sums:
+                merged[key] = np.sum(values, axis=0)
+            else:
+                merged[key] = np.concatenate(values)
+
+        return merged
+
+    return np.concatenate(results)
+
+
+def reprocess(directory, function, prefix='run', chunk_size=10000,
+              workers=None, sums=()):
+    '''
+    Applies function to all events of a run in parallel.
+
+    Parameters
+    ----------
+    directory, prefix : str
+        Location and prefix of the run (as given to RawWriter).
+    function : callable
+        function(batch, first_event), see module docstring.
+    chunk_size : int
+        Events per chunk. Chunks never span two file sets.
+    workers : int
+        Number of processes (default: number of CPUs). With workers=1
+        the chunks are processed in this process.
+    sums : list
+        Result keys which are summed instead of concatenated.
+
+    Returns
+    -------
+    The merged results (see merge_results).
+    '''
+    chunks = make_chunks(find_run(directory, prefix), chunk_size)
+    tasks = [(function, first, files) for first, files in chunks]
+
+    msg = 'reprocessing {0} chunks of {1}/{2}'
+    logger.info(msg.format(len(tasks), directory, prefix))
+
+    if workers == 1:
+        results = [_process_chunk(t) for t in tasks]
+    else:
+        pool = multiprocessing.Pool(workers)
+
+        try:
+            # map returns the results in chunk order
+            results = pool.map(_process_chunk, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    return merge_results(results, sums)
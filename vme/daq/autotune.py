@@ -0,0 +1,185 @@
+'''
+vme/daq/autotune.py
+-------------------
+
+Adapts the number of events per readout to the trigger rate.
+
+Every readout cycle consists of the time armed until n events have
+arrived (n / rate) and the readout, modeled as a fixed overhead plus
+a time per event: a + b * n. The readout is dead time, so the dead
+time fraction
+
+    (a + b n) / (n / rate + a + b n)
+
+falls with n while the latency of the data (fill time plus readout)
+grows. AutoTuner fits rate, a and b from the cycles of the running
+acquisition and picks the smallest n with a dead time fraction below
+max_dead whose latency stays within the budget (or, if max_dead is out
+of reach, the largest n within the budget).
+
+The page size is not changed: it sets the length of the recorded
+traces, which is an experimental choice, and only limits the number of
+events fitting into the memory.
+'''
+
+import time
+from collections import deque
+
+import numpy as np
+
+from ..modules.sis3302 import MAX_NOF_SAMPLES
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# entries of the event directory (32 kB) of the SIS3302
+MAX_EVENTS = 0x2000
+
+
+def choose_events(rate, overhead, per_event, latency, max_dead, n_max):
+    '''
+    Returns the number of events per readout for the given model.
+
+    rate in Hz, overhead and per_event (readout time) in s, latency
+    budget in s. The result is between 1 and n_max.
+    '''
+    n = np.arange(1, n_max + 1)
+
+    readout = overhead + per_event * n
+    total = n / float(rate) + readout
+
+    dead = readout / total
+    ok = total <= latency
+
+    good = ok & (dead <= max_dead)
+
+    if np.any(good):
+        return int(n[good][0])
+
+    if np.any(ok):
+        return int(n[ok][-1])
+
+    return 1
+
+
+class AutoTuner(object):
+    '''
+    Readout stage which tunes the events per readout of a SIS3302Readout.
+
+    Wraps the readout (use it in its place with RunController). The
+    number of events is adjusted between acquisitions, i.e. while the
+    module is not armed, after every cycle once enough cycles have been
+    observed. Changes smaller than hysteresis (relative) are ignored.
+
+    Parameters
+    ----------
+    readout : SIS3302Readout
+        Readout to tune, its n_events is the starting value.
+    latency : float
+        Maximum time in s from the first event of a readout until its
+        data is read.
+    max_dead : float
+        Target dead time fraction.
+    window : int
+        Number of recent cycles the model is fitted to.
+    '''
+
+    def __init__(self, readout, latency=0.5, max_dead=0.05, window=16,
+                 min_cycles=4, hysteresis=0.2):
+        self.readout = readout
+        self.latency = latency
+        self.max_dead = max_dead
+        self.min_cycles = min_cycles
+        self.hysteresis = hysteresis
+
+        # (n_events, wait time, readout time) of recent cycles
+        self.cycles = deque(maxlen=window)
+        self.history = []
+
+        self._wait = 0.
+
+    def configure(self):
+        self.readout.configure()
+
+    def close(self):
+        self.readout.close()
+
+    @property
+    def n_max(self):
+        n = min(MAX_EVENTS, MAX_NOF_SAMPLES // self.readout.page_size)
+
+        # batches have to fit into the slots of a shared memory ring
+        ring = getattr(self.readout, 'ring', None)
+        if ring is not None:
+            n = min(n, ring.rows)
+
+        return max(n, 1)
+
+    def model(self):
+        '''
+        Returns (rate, overhead, per_event) fitted to the recent cycles.
+        '''
+        n, wait, readout = np.array(self.cycles, dtype=float).T
+
+        rate = n.sum() / max(wait.sum(), 1e-9)
+
+        if len(np.unique(n)) > 1:
+            per_event, overhead = np.polyfit(n, readout, 1)
+            per_event = max(per_event, 0.)
+            overhead = max(overhead, 0.)
+        else:
+            # no lever arm yet: assume half overhead, half data transfer
+            overhead = readout.mean() / 2.
+            per_event = overhead / n[0]
+
+        return rate, overhead, per_event
+
+    def tune(self):
+        '''
+        Updates n_events of the readout from the model.
+        '''
+        if len(self.cycles) < self.min_cycles:
+            return
+
+        rate, overhead, per_event = self.model()
+        current = self.readout.n_events
+
+        n = choose_events(rate, overhead, per_event, self.latency,
+                          self.max_dead, self.n_max)
+
+        self.history.append((time.time(), current, rate, overhead,
+                             per_event))
+
+        if abs(n - current) <= self.hysteresis * current:
+            return
+
+        msg = 'rate {0:.1f} Hz, readout {1:.2e} s + {2:.2e} s/event: ' \
+              '{3} -> {4} events per readout'
+        logger.info(msg.format(rate, overhead, per_event, current, n))
+
+        self.readout.n_events = n
+        self.readout.sis.setMaxNoOfEvents(n)
+
+    def __call__(self):
+        readout = self.readout
+
+        n_events = readout.n_events
+        live_time = readout.live_time
+
+        start = time.time()
+        batch = readout()
+        duration = time.time() - start
+
+        wait = readout.live_time - live_time
+        self._wait += wait
+
+        if batch is None:
+            return None
+
+        self.cycles.append((n_events, self._wait, duration - wait))
+        self._wait = 0.
+
+        self.tune()
+
+        return batch
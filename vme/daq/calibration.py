@@ -0,0 +1,159 @@
+'''
+vme/daq/calibration.py
+----------------------
+
+Offset DAC calibration of the SIS3302.
+
+The offset DACs of all eight adcs are adjusted at the same time by a
+binary search for the requested baselines. Every step sets the DACs,
+takes one software-started acquisition (KEY_START, no input signal
+needed) and takes the mean of each adc's page as its baseline. A
+search over the 16 bit DAC range takes 16 steps plus two to determine
+the direction and range of each channel.
+
+The results can be saved as JSON and applied again with load_offsets.
+'''
+
+import json
+import time
+
+import numpy as np
+
+from ..modules.sis3302 import DAC_MAX
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+ADCS = np.arange(1, 9)
+
+
+def measure_baselines(sis, page_size=1024, timeout=0.1):
+    '''
+    Takes one acquisition and returns the mean of each adc (8 values).
+
+    The module has to be configured for single events of page_size
+    samples (see calibrate_offsets).
+    '''
+    sis.armSamplingLogic()
+    sis.startSampling()
+
+    if sis.waitForEvents(1, timeout) < 1:
+        sis.disarmSamplingLogic()
+        raise IOError('no event within {0} s'.format(timeout))
+
+    data = np.array([sis.readData(adc, page_size, 1)[0] for adc in ADCS])
+
+    return data.mean(axis=1)
+
+
+def calibrate_offsets(sis, target, page_size=1024, settle=0.001,
+                      timeout=0.1):
+    '''
+    Finds the offset DAC values giving baselines closest to target.
+
+    Parameters
+    ----------
+    sis : SIS3302
+        Module to calibrate. Its configuration is restored afterwards,
+        the offset DACs keep the calibrated values.
+    target : array_like
+        Baseline in ADC counts, scalar or one value per adc.
+    page_size : int
+        Samples per baseline measurement.
+    settle : float
+        Time in s to wait after setting the DACs.
+
+    Returns
+    -------
+    dict with the DAC values ('offsets'), the measured 'baselines' and
+    'target' (arrays with one value per adc).
+    '''
+    target = np.asarray(target, dtype=float)
+    if target.ndim == 0:
+        target = np.repeat(target, 8)
+
+    snapshot = sis.readConfiguration()
+
+    def measure(offsets):
+        sis.setOffsetDACs(offsets)
+        time.sleep(settle)
+        return measure_baselines(sis, page_size, timeout)
+
+    try:
+        sis.setPageSize(page_size)
+        sis.setMaxNoOfEvents(1)
+        sis.enableMultiEvent()
+
+        low = np.zeros(8, dtype=np.int64)
+        high = np.repeat(DAC_MAX, 8).astype(np.int64)
+
+        # direction and reachable range of every channel
+        at_low = measure(low)
+        at_high = measure(high)
+        rising = at_high >= at_low
+
+        unreachable = ((target < np.minimum(at_low, at_high)) |
+                       (target > np.maximum(at_low, at_high)))
+        if np.any(unreachable):
+            msg = 'target baseline out of range for adcs {0}'
+            logger.warning(msg.format(ADCS[unreachable].tolist()))
+
+        best = np.where(np.abs(at_low - target) <= np.abs(at_high - target),
+                        low, high)
+        best_baseline = np.where(best == low, at_low, at_high)
+
+        step = 0
+
+        while np.any(low <= high):
+            active = low <= high
+            mid = (low + high) // 2
+
+            # channels which are done stay at their best value
+            baselines = measure(np.where(active, mid, best))
+            step += 1
+
+            closer = active & (np.abs(baselines - target) <
+                               np.abs(best_baseline - target))
+            best = np.where(closer, mid, best)
+            best_baseline = np.where(closer, baselines, best_baseline)
+
+            # move towards the target
+            up = (baselines < target) == rising
+            low = np.where(active & up, mid + 1, low)
+            high = np.where(active & ~up, mid - 1, high)
+
+        baselines = measure(best)
+    finally:
+        sis.writeConfiguration(snapshot)
+
+    msg = 'offsets calibrated in {0} steps, baselines {1}'
+    logger.info(msg.format(step + 3, np.round(baselines, 1).tolist()))
+
+    return {'offsets': best,
+            'baselines': baselines,
+            'target': target}
+
+
+def save_offsets(filename, result):
+    '''
+    Saves the result of calibrate_offsets as JSON.
+    '''
+    with open(filename, 'w') as f:
+        json.dump(dict((key, np.asarray(value).tolist())
+                       for key, value in result.items()), f, indent=4)
+
+
+def load_offsets(filename, sis=None):
+    '''
+    Loads offsets saved with save_offsets and applies them to sis.
+
+    Returns the DAC values.
+    '''
+    with open(filename) as f:
+        offsets = np.array(json.load(f)['offsets'], dtype=np.int64)
+
+    if sis is not None:
+        sis.setOffsetDACs(offsets)
+
+    return offsets
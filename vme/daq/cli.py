@@ -0,0 +1,394 @@
+'''
+vme/daq/cli.py
+--------------
+
+Headless data taking (vme_daq console script).
+
+Configures the modules listed in a JSON file, runs SIS3302 multi-event
+acquisitions through the RunController for a given time or number of
+events and writes the data with RawWriter. Nothing in here imports Qt.
+
+Example configuration:
+
+    {
+        "controller": "v2718",
+        "modules": [
+            {"type": "sis3302", "base_address": "0x10000000",
+             "clock": "100MHz", "page_size": 1024, "n_events": 100,
+             "adcs": [1, 2], "internal_trigger": true},
+            {"type": "v895", "base_address": "0xEE0000",
+             "thresholds": 20, "channels": [0, 1], "width": [10, 10],
+             "majority": 1}
+        ]
+    }
+
+"controller" is one of v2718, remote (with "host"/"port") or simulator.
+With "broadcast_address" (e.g. "0x80000000") several SIS3302 are run as
+one chain: armed by multicast writes and read in one batch. All boards
+of a chain need the same adcs, page_size and n_events, and no roi.
+A SIS3302 entry may have "roi": {"1": [offset, length], ...} to read
+only this window of every event of the given adcs.
+An optional "pulser": {"rate": 1000, "pulser": 0} drives the bridge
+pulser during the run (e.g. as trigger for tests).
+
+With --shared-memory the data is also published to local processes
+through a shared memory ring buffer (see vme.daq.ringbuffer).
+'''
+
+import sys
+import json
+import time
+
+import numpy as np
+
+from ..modules.sis3302 import SIS3302
+from ..modules.caen895 import CAEN895
+from ..modules.chain import SIS3302Chain
+from .runcontrol import (RunController, RawWriter, SIS3302Readout,
+                         ChainReadout)
+from .deadtime import pulser_settings
+from .selftest import SelfTest
+from .autotune import AutoTuner, MAX_EVENTS
+from .ringbuffer import RingBuffer
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def _address(value):
+    if isinstance(value, str):
+        return int(value, 0)
+
+    return value
+
+
+def load_config(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def create_controller(config):
+    '''
+    Creates the bridge described by config.
+    '''
+    controller = config.get('controller', 'v2718')
+
+    if controller == 'v2718':
+        from ..modules.caen2718 import v2718
+        return v2718()
+
+    if controller == 'remote':
+        from ..modules.remote import RemoteBridge, DEFAULT_PORT
+        return RemoteBridge(config.get('host', '127.0.0.1'),
+                            config.get('port', DEFAULT_PORT))
+
+    if controller == 'simulator':
+        from ..modules import simulator
+        vme = simulator.SimulatedBridge()
+
+        for module in config.get('modules', []):
+            if module['type'] == 'sis3302':
+                model = simulator.SimulatedSIS3302()
+            else:
+                model = simulator.SimulatedCAEN895()
+
+            vme.addModule(_address(module['base_address']), model)
+
+        return vme
+
+    raise ValueError('unknown controller {0}'.format(controller))
+
+
+def configure_sis3302(vme, conf):
+    sis = SIS3302(vme, _address(conf['base_address']),
+                  reset=conf.get('reset', True),
+                  snapshot=conf.get('snapshot'))
+
+    if 'clock' in conf:
+        sis.setClockSource(conf['clock'])
+
+    if 'start_delay' in conf:
+        sis.setStartDelay(conf['start_delay'])
+
+    if 'stop_delay' in conf:
+        sis.setStopDelay(conf['stop_delay'])
+
+    if 'internal_trigger' in conf:
+        sis.enableInternalTrigger(conf['internal_trigger'])
+
+    if 'front_panel_start_stop' in conf:
+        sis.enableFrontPanelStartStop(conf['front_panel_start_stop'])
+
+    if 'triggers' in conf:
+        sis.configureTriggers(**conf['triggers'])
+
+    sis.clearTimestamps()
+
+    return sis
+
+
+def configure_caen895(vme, conf):
+    v895 = CAEN895(vme, _address(conf['base_address']))
+
+    if 'thresholds' in conf:
+        thresholds = np.asarray(conf['thresholds'])
+        if thresholds.ndim == 0:
+            thresholds = np.repeat(thresholds, 16)
+        v895.setThresholds(thresholds)
+
+    if 'channels' in conf:
+        v895.enableChannels(conf['channels'])
+
+    if 'width' in conf:
+        v895.setOutputWidth(1, conf['width'][0])
+        v895.setOutputWidth(2, conf['width'][1])
+
+    if 'majority' in conf:
+        v895.setMajority(conf['majority'])
+
+    return v895
+
+
+class CrateReadout(object):
+    '''
+    Reads several SIS3302 into one batch, the array names are prefixed
+    with the board number. Boards which are complete wait for the others.
+    '''
+
+    def __init__(self, readouts):
+        self.readouts = readouts
+        self._pending = [None] * len(readouts)
+
+    def configure(self):
+        for r in self.readouts:
+            r.configure()
+
+    def close(self):
+        for r in self.readouts:
+            r.close()
+
+    def __call__(self):
+        for i, r in enumerate(self.readouts):
+            if self._pending[i] is None:
+                self._pending[i] = r()
+
+        if any(data is None for data in self._pending):
+            return None
+
+        batch = {}
+
+        for i, data in enumerate(self._pending):
+            for name, value in data.items():
+                batch['sis{0}_{1}'.format(i, name)] = value
+
+        self._pending = [None] * len(self.readouts)
+
+        return batch
+
+
+def main():
+    import argparse
+
+    d = """
+    VME DAQ
+    --------------------------------------------------------------------------
+
+    Headless data taking with SIS3302 digitizers.
+    """
+
+    parser = argparse.ArgumentParser(description=d)
+    parser.add_argument('config', help='module configuration (JSON)')
+    parser.add_argument('-o', '--output', default='.',
+                        help='output directory')
+    parser.add_argument('--prefix', default='run',
+                        help='prefix of the output files')
+    parser.add_argument('-t', '--duration', type=float,
+                        help='run duration in s')
+    parser.add_argument('-n', '--events', type=int,
+                        help='number of events to take (summed over the '
+                             'boards unless they run as chain)')
+    parser.add_argument('--max-bytes', type=int, default=1 << 30,
+                        help='size of the output files before rollover')
+    parser.add_argument('--self-test', action='store_true',
+                        help='test memory and transfers of the SIS3302 '
+                             'before the run')
+    parser.add_argument('--full-self-test', action='store_true',
+                        help='self-test reading the whole memory for '
+                             'every page size (slow)')
+    parser.add_argument('--latency', type=float,
+                        help='tune the events per readout to this latency '
+                             'budget in s (single SIS3302)')
+    parser.add_argument('--max-dead', type=float, default=0.05,
+                        help='dead time fraction targeted by --latency')
+    parser.add_argument('--shared-memory', metavar='NAME',
+                        help='publish the data in a shared memory ring '
+                             'buffer of this name for local consumers '
+                             '(single SIS3302, limits --latency to the '
+                             'configured n_events)')
+    parser.add_argument('--slots', type=int, default=16,
+                        help='number of batches in the ring buffer (more '
+                             'than the pipeline depth, 10)')
+    parser.add_argument('--interval', type=float, default=1.,
+                        help='interval of the status output in s')
+    parser.add_argument('-v', '--verbosity',
+                        type=int,
+                        default=30,
+                        choices=[10, 20, 30, 40, 50],
+                        help='set threshold for messages shown on screen (10 everything, 50 only critical messages)')
+
+    args = parser.parse_args()
+
+    fmt = "%(name)s %(levelname)s: %(message)s"
+    level = logging.getLevelName(args.verbosity)
+    logging.basicConfig(format=fmt, level=level)
+
+    if args.duration is None and args.events is None:
+        parser.error('either --duration or --events is required')
+
+    config = load_config(args.config)
+    vme = create_controller(config)
+
+    readouts = []
+
+    for conf in config.get('modules', []):
+        if conf['type'] == 'sis3302':
+            sis = configure_sis3302(vme, conf)
+
+            if args.self_test or args.full_self_test:
+                if args.full_self_test:
+                    test = SelfTest(sis, max_events=MAX_EVENTS,
+                                    max_samples=None)
+                else:
+                    test = SelfTest(sis)
+
+                passed = test.run()
+                print(test.report())
+
+                if not passed:
+                    msg = 'self-test of SIS3302 at {0} failed'
+                    parser.exit(1, msg.format(conf['base_address']) + '\n')
+
+            roi = dict((int(adc), tuple(window))
+                       for adc, window in conf.get('roi', {}).items())
+
+            readouts.append(SIS3302Readout(sis, conf.get('adcs', [1]),
+                                           conf.get('page_size', 1024),
+                                           conf.get('n_events', 1),
+                                           roi=roi))
+        elif conf['type'] == 'v895':
+            configure_caen895(vme, conf)
+        else:
+            parser.error('unknown module type {0}'.format(conf['type']))
+
+    if not readouts:
+        parser.error('no SIS3302 configured')
+
+    ring = None
+
+    if args.shared_memory is not None and len(readouts) > 1:
+        parser.error('--shared-memory needs a single SIS3302')
+
+    if len(readouts) == 1:
+        readout = readouts[0]
+
+        if args.latency is not None:
+            readout = AutoTuner(readout, args.latency, args.max_dead)
+    elif 'broadcast_address' in config:
+        first = readouts[0]
+
+        # the chain is run with the acquisition settings of the first
+        # board, other settings per board would be ignored
+        for r in readouts[1:]:
+            if (r.adcs, r.page_size, r.n_events) != (first.adcs,
+                                                     first.page_size,
+                                                     first.n_events):
+                parser.error('adcs, page_size and n_events have to be the '
+                             'same for all boards of a chain')
+
+        if any(r.roi for r in readouts):
+            parser.error('roi is not supported for a chain')
+
+        chain = SIS3302Chain(vme, [r.sis for r in readouts],
+                             _address(config['broadcast_address']))
+        readout = ChainReadout(chain, first.adcs, first.page_size,
+                               first.n_events)
+        readouts = [readout]
+    else:
+        readout = CrateReadout(readouts)
+
+    writer = RawWriter(args.output, args.prefix, args.max_bytes)
+    controller = RunController(readout, writer=writer)
+
+    if args.shared_memory is not None:
+        # the batches passed on to the writer are views of the slots
+        if args.slots <= controller.depth:
+            parser.error('--slots has to exceed the pipeline depth '
+                         '({0})'.format(controller.depth))
+
+        ring = RingBuffer(readouts[0].layout(), args.slots,
+                          args.shared_memory)
+        readouts[0].ring = ring
+
+    pulser = config.get('pulser')
+
+    if pulser is not None:
+        period, width, time_unit, rate = pulser_settings(pulser['rate'])
+        vme.configurePulser(pulser.get('pulser', 0), period, width,
+                            time_unit, 0, 0, 0)
+        vme.startPulser(pulser.get('pulser', 0))
+        logger.info('pulser running at {0:.0f} Hz'.format(rate))
+
+    start = time.time()
+    controller.start()
+
+    def status():
+        elapsed = time.time() - start
+        events = sum(r.events for r in readouts)
+        live = min(r.live_time for r in readouts) / max(elapsed, 1e-9)
+        written = dict(controller.summary())['writer']
+
+        msg = '{0:8.1f} s {1:10d} events {2:8.1f} Hz {3:8.2f} MB/s ' \
+              'dead {4:5.1%}'
+        return msg.format(elapsed, events, events / max(elapsed, 1e-9),
+                          written['throughput'] / 1e6, 1. - live)
+
+    try:
+        next_status = start + args.interval
+
+        while controller.running():
+            time.sleep(0.05)
+            now = time.time()
+
+            if args.duration is not None and now - start >= args.duration:
+                break
+
+            if args.events is not None and \
+                    sum(r.events for r in readouts) >= args.events:
+                break
+
+            if now >= next_status:
+                print(status())
+                sys.stdout.flush()
+                next_status += args.interval
+    except KeyboardInterrupt:
+        pass
+
+    controller.stop()
+
+    if ring is not None:
+        ring.close()
+
+    if pulser is not None:
+        vme.stopPulser(pulser.get('pulser', 0))
+
+    print(status())
+
+    for name, s in controller.summary():
+        msg = '{0:>10}: {1:6d} batches {2:8.2f} MB/s busy {3:5.1%}'
+        print(msg.format(name, s['batches'], s['throughput'] / 1e6,
+                         s['busy']))
+
+
+if __name__ == '__main__':
+    main()
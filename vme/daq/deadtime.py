@@ -0,0 +1,197 @@
+'''
+vme/daq/deadtime.py
+-------------------
+
+Dead time and maximum rate of the SIS3302 readout chain.
+
+The V2718 pulser drives triggers at increasing rates into a SIS3302
+(pulser output connected to the trigger input of the ADC) while
+multi-event acquisitions run as in data taking. For every cycle the
+time from arming until the events are complete and the readout time
+are recorded. Works with SimulatedBridge as well.
+'''
+
+import time
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# cvTimeUnits of the V2718 pulser: (time unit, tick in s)
+PULSER_TIME_UNITS = [(0, 25e-9), (1, 1.6e-6), (2, 410e-6), (3, 104e-3)]
+
+# period and width are 8 bit values
+MAX_PERIOD = 255
+
+
+def pulser_settings(rate):
+    '''
+    Returns (period, width, time_unit, actual rate) of the pulser
+    setting closest to rate (in Hz), using the finest possible time unit.
+    '''
+    for time_unit, tick in PULSER_TIME_UNITS:
+        period = int(round(1. / (rate * tick)))
+
+        if period <= MAX_PERIOD:
+            period = max(period, 2)
+            return period, max(period // 2, 1), time_unit, 1. / (period *
+                                                                 tick)
+
+    raise ValueError('rate {0} Hz too low for the pulser'.format(rate))
+
+
+class DeadTimeHarness(object):
+    '''
+    Measures live time and dead time of multi-event acquisitions.
+
+    Parameters
+    ----------
+    vme : bridge
+        v2718 or SimulatedBridge.
+    sis : SIS3302
+        Module whose trigger input is driven by the pulser.
+    adcs : list
+        ADCs read out per acquisition.
+    pulser, start_signal, reset_signal : int
+        Pulser and its start/reset source (cvPulserSelect, cvIOSources).
+        The defaults (0) are pulser A started and stopped by software.
+    '''
+
+    def __init__(self, vme, sis, adcs=(1,), pulser=0, start_signal=0,
+                 reset_signal=0):
+        self.vme = vme
+        self.sis = sis
+        self.adcs = list(adcs)
+        self.pulser = pulser
+        self.start_signal = start_signal
+        self.reset_signal = reset_signal
+
+        self.results = []
+
+    def measure(self, rate, page_size, n_events, duration=1.):
+        '''
+        Runs acquisitions for duration seconds at the given trigger rate.
+
+        Returns a dict with the settings, the per-cycle arm-to-ready and
+        readout durations and the derived live time, dead-time fraction
+        and accepted event rate.
+        '''
+        period, width, time_unit, rate = pulser_settings(rate)
+
+        sis = self.sis
+        sis.setPageSize(page_size)
+        sis.setMaxNoOfEvents(n_events)
+        sis.enableMultiEvent()
+
+        self.vme.configurePulser(self.pulser, period, width, time_unit, 0,
+                                 self.start_signal, self.reset_signal)
+        self.vme.startPulser(self.pulser)
+
+        # wait at most 10 expected fill times for a cycle to complete
+        timeout = max(10. * n_events / rate, 0.1)
+
+        arm_to_ready = []
+        readout = []
+        n_total = 0
+
+        start = time.time()
+
+        try:
+            while time.time() - start < duration:
+                t0 = time.time()
+                sis.armSamplingLogic()
+                counter = sis.waitForEvents(n_events, timeout)
+                t1 = time.time()
+
+                if counter < n_events:
+                    sis.disarmSamplingLogic()
+                    logger.warning('timeout at {0:.0f} Hz'.format(rate))
+                    break
+
+                sis.readTimestampDirectory(n_events)
+                for adc in self.adcs:
+                    sis.readData(adc, page_size, n_events)
+                t2 = time.time()
+
+                arm_to_ready.append(t1 - t0)
+                readout.append(t2 - t1)
+                n_total += n_events
+        finally:
+            self.vme.stopPulser(self.pulser)
+
+        elapsed = time.time() - start
+
+        arm_to_ready = np.array(arm_to_ready)
+        readout = np.array(readout)
+
+        live = arm_to_ready.sum() / elapsed
+        accepted = n_total / elapsed
+
+        result = {'rate': rate,
+                  'page_size': page_size,
+                  'n_events': n_events,
+                  'cycles': len(readout),
+                  'events': n_total,
+                  'arm_to_ready': arm_to_ready,
+                  'readout': readout,
+                  'live_time': live,
+                  'dead_fraction': 1. - live,
+                  'accepted_rate': accepted}
+
+        msg = '{0:.0f} Hz, page size {1}, {2} events: dead {3:.1%}, ' \
+              'accepted {4:.0f} Hz'
+        logger.info(msg.format(rate, page_size, n_events, 1. - live,
+                               accepted))
+
+        self.results.append(result)
+
+        return result
+
+    def scan(self, rates, page_sizes, event_counts, duration=1.,
+             max_dead=0.1):
+        '''
+        Measures all combinations of rates, page sizes and event counts.
+
+        Returns a dict (page_size, n_events) -> maximum sustainable rate,
+        i.e. the highest rate with a dead-time fraction up to max_dead
+        (None if no rate qualified).
+        '''
+        max_rates = {}
+
+        for page_size in page_sizes:
+            for n_events in event_counts:
+                best = None
+
+                for rate in sorted(rates):
+                    result = self.measure(rate, page_size, n_events,
+                                          duration)
+
+                    if result['cycles'] > 0 and \
+                            result['dead_fraction'] <= max_dead:
+                        best = result['rate']
+
+                max_rates[(page_size, n_events)] = best
+
+        return max_rates
+
+    def report(self):
+        '''
+        Returns the results as a printable table.
+        '''
+        lines = ['{0:>10} {1:>9} {2:>7} {3:>7} {4:>12} {5:>12} {6:>7} '
+                 '{7:>11}'.format('rate [Hz]', 'page', 'events', 'cycles',
+                                  'arm [ms]', 'readout [ms]', 'dead',
+                                  'accepted')]
+
+        for r in self.results:
+            arm = 1e3 * r['arm_to_ready'].mean() if r['cycles'] else 0.
+            ro = 1e3 * r['readout'].mean() if r['cycles'] else 0.
+            lines.append('{0:>10.0f} {1:>9} {2:>7} {3:>7} {4:>12.3f} '
+                         '{5:>12.3f} {6:>7.1%} {7:>11.0f}'.format(
+                             r['rate'], r['page_size'], r['n_events'],
+                             r['cycles'], arm, ro, r['dead_fraction'],
+                             r['accepted_rate']))
+
+        return '\n'.join(lines)
@@ -0,0 +1,148 @@
+'''
+vme/daq/framing.py
+------------------
+
+Compact binary framing of ndarrays for sockets.
+
+A frame consists of a fixed header, a JSON description and the raw
+array buffers:
+
+    magic (4s) | sequence number (Q) | description length (I) | description
+    | buffer 1 | buffer 2 | ...
+
+The description holds name, dtype and shape of each array plus optional
+user metadata. Arrays are sent straight from their memory and received
+into one buffer which the returned arrays are views of.
+'''
+
+import json
+import socket
+import struct
+
+import numpy as np
+
+MAGIC = b'VMEF'
+
+HEADER = struct.Struct('<4sQI')
+
+
+class FramingError(IOError):
+    pass
+
+
+def _bytes(data):
+    '''
+    Returns a byte-wise memoryview of an array (without copying if it
+    is contiguous).
+    '''
+    data = np.ascontiguousarray(data)
+    return memoryview(data.reshape(-1).view(np.uint8))
+
+
+def encode_frame(seq, arrays, meta=None):
+    '''
+    Encodes a dict of arrays to a list of buffers to be sent.
+
+    The array data is not copied.
+    '''
+    names = sorted(arrays)
+    views = []
+    description = []
+
+    for name in names:
+        data = np.asarray(arrays[name])
+        description.append([name, data.dtype.str, list(data.shape)])
+        views.append(_bytes(data))
+
+    description = json.dumps({'arrays': description, 'meta': meta})
+    description = description.encode('utf-8')
+
+    header = HEADER.pack(MAGIC, seq, len(description))
+
+    return [header + description] + views
+
+
+def send_buffers(sock, buffers):
+    '''
+    Sends a list of buffers, with a single sendmsg call if possible.
+    '''
+    buffers = [memoryview(b) for b in buffers if len(b) > 0]
+
+    if not hasattr(sock, 'sendmsg'):
+        for b in buffers:
+            sock.sendall(b)
+        return
+
+    while buffers:
+        sent = sock.sendmsg(buffers)
+
+        # drop what was sent, continue with the rest
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+
+        if buffers and sent > 0:
+            buffers[0] = buffers[0][sent:]
+
+
+def send_frame(sock, seq, arrays, meta=None):
+    send_buffers(sock, encode_frame(seq, arrays, meta))
+
+
+def recv_exactly(sock, n):
+    '''
+    Receives exactly n bytes into a new bytearray.
+    '''
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = 0
+
+    while pos < n:
+        k = sock.recv_into(view[pos:], n - pos)
+
+        if k == 0:
+            raise socket.error('connection closed')
+
+        pos += k
+
+    return buf
+
+
+def recv_frame(sock):
+    '''
+    Receives one frame.
+
+    Returns sequence number, metadata and a dict of arrays. The arrays
+    are views of the receive buffer.
+    '''
+    magic, seq, length = HEADER.unpack(bytes(recv_exactly(sock,
+                                                          HEADER.size)))
+
+    if magic != MAGIC:
+        raise FramingError('invalid frame header')
+
+    description = json.loads(recv_exactly(sock, length).decode('utf-8'))
+
+    layout = []
+    size = 0
+
+    for name, dtype, shape in description['arrays']:
+        dtype = np.dtype(dtype)
+        nbytes = dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+        layout.append((name, dtype, tuple(shape), size, nbytes))
+        size += nbytes
+
+    payload = recv_exactly(sock, size)
+
+    arrays = {}
+
+    for name, dtype, shape, offset, nbytes in layout:
+        if nbytes == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+            continue
+
+        data = np.frombuffer(payload, dtype=dtype,
+                             count=nbytes // dtype.itemsize, offset=offset)
+        arrays[name] = data.reshape(shape)
+
+    return seq, description['meta'], arrays
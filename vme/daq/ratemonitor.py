@@ -0,0 +1,159 @@
+'''
+vme/daq/ratemonitor.py
+----------------------
+
+Trigger rates from successive timestamp directory readouts.
+'''
+
+import threading
+from collections import deque
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def default_bins():
+    '''
+    Logarithmic bins (in s) for the inter-event time distribution,
+    10 bins per decade from 10 ns to 100 s.
+    '''
+    return np.logspace(-8, 2, 101)
+
+
+class RateMonitor(object):
+    '''
+    Computes trigger rates from the output of readTimestampDirectory.
+
+    Feed every readout to update(), the statistics can be queried at
+    any time (also from another thread). All calculations are done per
+    batch with numpy, there is no per-event Python overhead.
+
+    Parameters
+    ----------
+    clock : float
+        Frequency of the timestamp clock in Hz.
+    window : float
+        Length in s (timestamp time) of the window for the windowed rate.
+    bins : array_like
+        Bin edges in s of the inter-event time histogram.
+    '''
+
+    def __init__(self, clock=100e6, window=10., bins=None):
+        self.clock = float(clock)
+        self.window = window
+
+        if bins is None:
+            bins = default_bins()
+
+        self.bins = np.asarray(bins, dtype=float)
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Clears all statistics.
+        '''
+        with self._lock:
+            self._last = None
+            self._first = None
+            self._batches = deque()
+            self._instantaneous = 0.
+            self._n_mean = 0
+            self.n_events = 0
+            self.counts = np.zeros(len(self.bins) - 1, dtype=np.int64)
+
+    def update(self, timestamps):
+        '''
+        Adds the timestamps (in clock ticks) of one readout.
+        '''
+        ts = np.asarray(timestamps, dtype=np.int64)
+
+        if len(ts) == 0:
+            return
+
+        with self._lock:
+            if self._last is not None and ts[0] < self._last:
+                logger.debug('timestamps were cleared, restart statistics')
+                self._last = None
+                self._first = None
+                self._batches.clear()
+                self._n_mean = 0
+
+            if self._last is None:
+                self._first = ts[0]
+                dt = np.diff(ts)
+                start = ts[0]
+                n = len(ts) - 1
+            else:
+                dt = np.diff(ts, prepend=self._last)
+                start = self._last
+                n = len(ts)
+
+            dt = dt / self.clock
+
+            self.counts += np.histogram(dt, bins=self.bins)[0]
+            self.n_events += len(ts)
+            self._n_mean += len(ts)
+
+            span = (ts[-1] - start) / self.clock
+            if span > 0:
+                self._instantaneous = n / span
+
+            self._last = ts[-1]
+
+            # drop batches which are out of the window
+            self._batches.append((start, ts[-1], n))
+            limit = ts[-1] - self.window * self.clock
+
+            while len(self._batches) > 1 and self._batches[0][1] < limit:
+                self._batches.popleft()
+
+    def instantaneousRate(self):
+        '''
+        Rate in Hz of the last readout.
+        '''
+        with self._lock:
+            return self._instantaneous
+
+    def windowedRate(self):
+        '''
+        Rate in Hz of the readouts in the last window seconds.
+        '''
+        with self._lock:
+            if not self._batches:
+                return 0.
+
+            n = sum(b[2] for b in self._batches)
+            span = (self._batches[-1][1] - self._batches[0][0]) / self.clock
+
+        if span <= 0:
+            return 0.
+
+        return n / span
+
+    def meanRate(self):
+        '''
+        Rate in Hz since the start (or the last timestamp clear).
+        '''
+        with self._lock:
+            if self._last is None:
+                return 0.
+
+            span = (self._last - self._first) / self.clock
+            n = self._n_mean
+
+        if span <= 0:
+            return 0.
+
+        return (n - 1) / span
+
+    def histogram(self):
+        '''
+        Returns counts and bin edges (in s) of the inter-event times.
+        '''
+        with self._lock:
+            return self.counts.copy(), self.bins.copy()
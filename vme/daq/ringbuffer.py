@@ -0,0 +1,412 @@
+'''
+vme/daq/ringbuffer.py
+---------------------
+
+Shared memory ring buffer distributing readout batches to local
+processes (writer, online monitor, histogrammer, ...).
+
+One producer writes batches into a fixed number of slots in a shared
+memory block, any number of consumers attach to the block by name and
+get the batches as ndarray views of the shared memory, i.e. without
+any copy. The producer never waits for consumers: a consumer which
+falls behind by more than the number of slots loses the oldest batches
+(overrun), which is counted, and continues with the oldest batch still
+available.
+
+Layout of the shared memory block:
+
+    magic (4s) | slots (I) | arrays (I) | slot size (Q) | description
+    length (I) | description (JSON) | head (Q) | sequence number per
+    slot (Q) | rows per slot and array (Q) | slot 0 | slot 1 | ...
+
+The description holds name, dtype, shape and offset in the slot of each
+array, the first dimension of the shape is the maximum number of rows.
+head is the number of batches written so far. The sequence number of a
+slot is 0 while it is written and the batch number + 1 afterwards, so a
+consumer can check after using the views whether they have been
+overwritten in the meantime (see RingConsumer.valid). This relies on
+the stores of the producer becoming visible in order (as on x86).
+
+Example consumer:
+
+    ring = RingConsumer('vme_daq')
+
+    for seq, batch in ring:
+        histogram.fill(batch['adc1'])
+
+        if not ring.valid(seq):
+            histogram.discard()
+
+multiprocessing.shared_memory requires Python 3.8.
+'''
+
+import sys
+import json
+import time
+import struct
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+MAGIC = b'VMER'
+
+HEADER = struct.Struct('<4sIIQI')
+
+# alignment of the control block, slots and arrays in bytes
+ALIGNMENT = 64
+
+
+class RingBufferError(IOError):
+    pass
+
+
+def _align(n):
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def _attach(name):
+    '''
+    Attaches to an existing shared memory block without handing it to
+    the resource tracker (which would remove it when the consumer
+    exits).
+    '''
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    from multiprocessing import resource_tracker
+
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _unlink(shm):
+    '''
+    Removes a shared memory block created by this process.
+
+    Consumers forked from the producer share its resource tracker and
+    have unregistered the block (see _attach), so it is registered again
+    before unlink unregisters it.
+    '''
+    if sys.version_info < (3, 13):
+        from multiprocessing import resource_tracker
+        resource_tracker.register(shm._name, 'shared_memory')
+
+    shm.unlink()
+
+
+class _Ring(object):
+    '''
+    Views of the control block and the slots of a shared memory block.
+    '''
+
+    def _map(self, shm, description, offset):
+        self.shm = shm
+        self.description = description
+
+        self.arrays = [(name, np.dtype(dtype), tuple(shape), position)
+                       for name, dtype, shape, position in
+                       description['arrays']]
+        self.names = [a[0] for a in self.arrays]
+        self.n_slots = description['slots']
+        self.slot_size = description['slot_size']
+
+        buf = shm.buf
+        n = self.n_slots
+
+        self._head = np.frombuffer(buf, np.uint64, 1, offset)
+        offset += 8
+        self._seq = np.frombuffer(buf, np.uint64, n, offset)
+        offset += 8 * n
+        self._rows = np.frombuffer(buf, np.uint64, n * len(self.arrays),
+                                   offset).reshape(n, len(self.arrays))
+        offset = _align(offset + self._rows.nbytes)
+
+        self._slots = []
+
+        for i in range(n):
+            start = offset + i * self.slot_size
+            self._slots.append([
+                np.frombuffer(buf, dtype, int(np.prod(shape, dtype=np.int64)),
+                              start + position).reshape(shape)
+                for name, dtype, shape, position in self.arrays])
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def head(self):
+        '''
+        Number of batches written so far.
+        '''
+        return int(self._head[0])
+
+    def views(self, seq):
+        '''
+        Returns the arrays of batch seq as dict of views.
+        '''
+        slot = seq % self.n_slots
+        rows = self._rows[slot]
+
+        return dict((name, data[:int(n)]) for name, data, n in
+                    zip(self.names, self._slots[slot], rows))
+
+    def valid(self, seq):
+        '''
+        True if batch seq is (still) in the buffer.
+        '''
+        return int(self._seq[seq % self.n_slots]) == seq + 1
+
+    def close(self):
+        # drop the views before releasing the mapping
+        self._head = self._seq = self._rows = None
+        self._slots = []
+
+        try:
+            self.shm.close()
+        except BufferError:
+            logger.warning('views of {0} still in use'.format(self.name))
+
+
+class RingBuffer(_Ring):
+    '''
+    Producer side of the ring buffer, creates the shared memory block.
+
+    Batches can be written with write (copied into the next slot) or
+    directly: reserve returns views of the next slot to read the data
+    into, commit publishes them. Calling the buffer writes the batch and
+    passes it on, so it can be used as RunController stage as well.
+
+    Parameters
+    ----------
+    layout : dict
+        name -> (dtype, shape) of the arrays of a batch, the first
+        dimension of shape is the maximum number of rows.
+    n_slots : int
+        Number of batches kept. Also the number of batches a consumer
+        may lag behind before losing data.
+    name : str
+        Name of the shared memory block (random if None).
+    '''
+
+    def __init__(self, layout, n_slots=16, name=None):
+        if shared_memory is None:
+            raise RingBufferError('shared memory needs Python 3.8 or newer')
+
+        arrays = []
+        slot_size = 0
+
+        for array_name in sorted(layout):
+            dtype, shape = layout[array_name]
+            dtype = np.dtype(dtype)
+            shape = [int(s) for s in np.atleast_1d(shape)]
+
+            arrays.append([array_name, dtype.str, shape, slot_size])
+            slot_size = _align(slot_size + dtype.itemsize *
+                               int(np.prod(shape, dtype=np.int64)))
+
+        description = {'slots': n_slots, 'slot_size': slot_size,
+                       'arrays': arrays}
+        encoded = json.dumps(description).encode('utf-8')
+
+        control = _align(HEADER.size + len(encoded))
+        size = (control + _align(8 * (1 + n_slots + n_slots * len(arrays))) +
+                n_slots * slot_size)
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[:HEADER.size] = HEADER.pack(MAGIC, n_slots, len(arrays),
+                                            slot_size, len(encoded))
+        shm.buf[HEADER.size:HEADER.size + len(encoded)] = encoded
+
+        self._map(shm, description, control)
+
+        self._head[0] = 0
+        self._seq[:] = 0
+        self._reserved = False
+
+        # rows every array can hold
+        self.rows = min(a[2][0] for a in self.arrays)
+
+        msg = 'ring buffer {0}: {1} slots of {2} bytes'
+        logger.info(msg.format(self.name, n_slots, slot_size))
+
+    def reserve(self, rows=None):
+        '''
+        Returns the next slot as dict of writable views.
+
+        rows is the number of rows of the batch (int for all arrays or
+        dict name -> rows), all rows if None. The slot becomes invalid
+        for consumers until commit is called.
+        '''
+        slot = self.head % self.n_slots
+
+        if rows is None or not isinstance(rows, dict):
+            rows = dict((name, rows) for name in self.names)
+
+        n = []
+
+        for name, dtype, shape, position in self.arrays:
+            r = rows.get(name)
+            r = shape[0] if r is None else r
+
+            if r > shape[0]:
+                msg = '{0} rows of {1} exceed the slot size ({2})'
+                raise ValueError(msg.format(r, name, shape[0]))
+
+            n.append(r)
+
+        self._seq[slot] = 0
+        self._rows[slot] = n
+        self._reserved = True
+
+        return self.views(self.head)
+
+    def commit(self):
+        '''
+        Publishes the reserved slot, returns its sequence number.
+        '''
+        if not self._reserved:
+            raise RingBufferError('no slot reserved')
+
+        seq = self.head
+
+        self._seq[seq % self.n_slots] = seq + 1
+        self._head[0] = seq + 1
+        self._reserved = False
+
+        return seq
+
+    def write(self, batch):
+        '''
+        Copies batch into the next slot and publishes it.
+
+        All arrays of the layout have to be in batch, with the shape of
+        the layout apart from the number of rows.
+        '''
+        rows = dict((name, len(batch[name])) for name in self.names)
+        views = self.reserve(rows)
+
+        for name in self.names:
+            views[name][...] = batch[name]
+
+        return self.commit()
+
+    def __call__(self, batch):
+        self.write(batch)
+        return batch
+
+    def rollover(self):
+        pass
+
+    def close(self):
+        '''
+        Releases and removes the shared memory block. Attached consumers
+        keep their mapping until they close.
+        '''
+        shm = self.shm
+        super(RingBuffer, self).close()
+        _unlink(shm)
+
+
+class RingConsumer(_Ring):
+    '''
+    Consumer side of the ring buffer, attaches to the block by name.
+
+    get returns the batches in order as views of the shared memory. If
+    the consumer lags behind by more than the number of slots, the
+    batches overwritten in the meantime are skipped and counted in lost.
+
+    Parameters
+    ----------
+    name : str
+        Name of the shared memory block (RingBuffer.name).
+    oldest : bool
+        Start with the oldest batch in the buffer instead of the next
+        one written.
+    poll : float
+        Interval in s to check for new batches while waiting.
+    '''
+
+    def __init__(self, name, oldest=False, poll=0.001):
+        if shared_memory is None:
+            raise RingBufferError('shared memory needs Python 3.8 or newer')
+
+        shm = _attach(name)
+
+        magic, n_slots, n_arrays, slot_size, length = HEADER.unpack(
+            bytes(shm.buf[:HEADER.size]))
+
+        if magic != MAGIC:
+            shm.close()
+            raise RingBufferError('{0} is no ring buffer'.format(name))
+
+        description = json.loads(
+            bytes(shm.buf[HEADER.size:HEADER.size + length]).decode('utf-8'))
+
+        self._map(shm, description, _align(HEADER.size + length))
+
+        self.poll = poll
+        self.lost = 0
+        self.next = max(self.head - self.n_slots, 0) if oldest \
+            else self.head
+
+    @property
+    def lag(self):
+        '''
+        Number of batches written but not yet returned by get.
+        '''
+        return self.head - self.next
+
+    def get(self, timeout=None):
+        '''
+        Returns sequence number and dict of views of the next batch, or
+        None if there is none within timeout.
+
+        The views stay valid until the producer reuses the slot, check
+        with valid(seq) after using them.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            head = self.head
+
+            if head > self.next:
+                # the slot of head - n_slots is intact until the next
+                # reserve, which valid detects
+                oldest = head - self.n_slots
+
+                if self.next < oldest:
+                    msg = 'ring buffer {0}: overrun, lost {1} batches'
+                    logger.warning(msg.format(self.name, oldest - self.next))
+                    self.lost += oldest - self.next
+                    self.next = oldest
+
+                seq = self.next
+                batch = self.views(seq)
+
+                if self.valid(seq):
+                    self.next += 1
+                    return seq, batch
+
+                # overwritten while taking the views, try the next one
+                self.lost += 1
+                self.next += 1
+                continue
+
+            if deadline is not None and time.time() >= deadline:
+                return None
+
+            time.sleep(self.poll)
+
+    def __iter__(self):
+        while True:
+            yield self.get()
@@ -0,0 +1,535 @@
+'''
+vme/daq/runcontrol.py
+---------------------
+
+Pipelined run control: readout, processing and writing run in separate
+threads connected by bounded queues, so the bus is kept busy while
+earlier data is processed and written.
+
+A batch is a dict of name -> ndarray (e.g. 'timestamps', 'adc1', ...).
+'''
+
+import os
+import json
+import time
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# marks the end of the data stream in the queues
+_STOP = None
+
+
+def batch_size(batch):
+    '''
+    Returns the number of bytes of all arrays in batch.
+    '''
+    return sum(np.asarray(a).nbytes for a in batch.values())
+
+
+class SIS3302Readout(object):
+    '''
+    Multi-event readout of a SIS3302 as readout stage.
+
+    Each call arms the sampling logic, waits for n_events events and
+    returns a batch with the timestamps and the data of all adcs.
+    Returns None if no complete readout arrived within timeout.
+
+    The number of events read and the time spent armed (live time)
+    are counted in events and live_time.
+
+    roi maps adcs to an (offset, length) window: only these samples of
+    every event are transferred (see SIS3302.readROI), the adc's array
+    has shape (n_events, length).
+
+    With a ring (RingBuffer created with layout()) the data is read
+    straight into the next slot of the shared memory ring buffer and
+    published to its consumers. The returned batch then consists of
+    views of the slot, which stay valid until the ring wraps around
+    (n_slots readouts later), so the ring needs more slots than the
+    batches the pipeline holds (RunController.depth).
+    '''
+
+    def __init__(self, sis, adcs, page_size, n_events, timeout=0.2,
+                 roi=None, ring=None):
+        self.sis = sis
+        self.adcs = adcs
+        self.page_size = page_size
+        self.n_events = n_events
+        self.timeout = timeout
+        self.roi = roi or {}
+        self.ring = ring
+
+        self.events = 0
+        self.live_time = 0.
+
+        self._armed = False
+
+    def configure(self):
+        self.sis.setPageSize(self.page_size)
+        self.sis.setMaxNoOfEvents(self.n_events)
+        self.sis.enableMultiEvent()
+
+    def layout(self, n_events=None):
+        '''
+        Returns name -> (dtype, shape) of the arrays of a batch of
+        n_events events (default: n_events), see RingBuffer.
+        '''
+        if n_events is None:
+            n_events = self.n_events
+
+        layout = {'timestamps': (np.uint64, (n_events,))}
+
+        for adc in self.adcs:
+            length = self.roi[adc][1] if adc in self.roi else self.page_size
+            layout['adc{0}'.format(adc)] = (np.uint16, (n_events, length))
+
+        return layout
+
+    def __call__(self):
+        sis = self.sis
+
+        if not self._armed:
+            sis.armSamplingLogic()
+            self._armed = True
+
+        start = time.time()
+        counter = sis.waitForEvents(self.n_events, self.timeout)
+        self.live_time += time.time() - start
+
+        if counter < self.n_events:
+            return None
+
+        self._armed = False
+        self.events += self.n_events
+
+        if self.ring is not None:
+            out = self.ring.reserve(self.n_events)
+        else:
+            out = {}
+
+        batch = {'timestamps': sis.readTimestampDirectory(self.n_events)}
+
+        if 'timestamps' in out:
+            out['timestamps'][...] = batch['timestamps']
+            batch['timestamps'] = out['timestamps']
+
+        for adc in self.adcs:
+            name = 'adc{0}'.format(adc)
+
+            if adc in self.roi:
+                offset, length = self.roi[adc]
+                data = sis.readROI(adc, self.page_size, self.n_events,
+                                   offset, length, out=out.get(name))
+            else:
+                data = sis.readData(adc, self.page_size, self.n_events,
+                                    out=out.get(name))
+
+            batch[name] = data
+
+        if self.ring is not None:
+            self.ring.commit()
+
+        return batch
+
+    def close(self):
+        if self._armed:
+            self.sis.disarmSamplingLogic()
+            self._armed = False
+
+
+class ChainReadout(object):
+    '''
+    Multi-event readout of several SIS3302 as one readout stage.
+
+    Like SIS3302Readout, but all boards of an SIS3302Chain are armed
+    with one broadcast write and read in one batch. The array names are
+    prefixed with the board number (sis0_timestamps, sis1_adc1, ...).
+    '''
+
+    def __init__(self, chain, adcs, page_size, n_events, timeout=0.2):
+        self.chain = chain
+        self.adcs = adcs
+        self.page_size = page_size
+        self.n_events = n_events
+        self.timeout = timeout
+
+        self.events = 0
+        self.live_time = 0.
+
+        self._armed = False
+
+    def configure(self):
+        for sis in self.chain.boards:
+            sis.setPageSize(self.page_size)
+            sis.setMaxNoOfEvents(self.n_events)
+            sis.enableMultiEvent()
+
+        self.chain.clearTimestamps()
+
+    def __call__(self):
+        chain = self.chain
+
+        if not self._armed:
+            chain.armSamplingLogic()
+            self._armed = True
+
+        start = time.time()
+        counter = chain.waitForEvents(self.n_events, self.timeout)
+        self.live_time += time.time() - start
+
+        if counter < self.n_events:
+            return None
+
+        self._armed = False
+        self.events += self.n_events
+
+        batch = {}
+
+        timestamps = chain.readTimestampDirectories(self.n_events)
+        for i, ts in enumerate(timestamps):
+            batch['sis{0}_timestamps'.format(i)] = ts
+
+        for adc in self.adcs:
+            data = chain.readData(adc, self.page_size, self.n_events)
+            for i, d in enumerate(data):
+                batch['sis{0}_adc{1}'.format(i, adc)] = d
+
+        return batch
+
+    def close(self):
+        if self._armed:
+            self.chain.disarmSamplingLogic()
+            self._armed = False
+
+
+class RawWriter(object):
+    '''
+    Writes every array of the batches to its own raw binary file.
+
+    Files are named <prefix>_<name>_<index>.dat and rolled over when
+    the current file set exceeds max_bytes. Each data file gets a JSON
+    sidecar (.json) with dtype, shape of one row and number of rows, so
+    it can be opened again with np.memmap (see vme.analysis.reprocess).
+    '''
+
+    def __init__(self, directory, prefix='run', max_bytes=1 << 30):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+
+        self.index = 0
+        self.files = {}
+        self.headers = {}
+        self.n_bytes = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def filename(self, name, index=None):
+        if index is None:
+            index = self.index
+
+        fn = '{0}_{1}_{2:04d}.dat'.format(self.prefix, name, index)
+        return os.path.join(self.directory, fn)
+
+    def write(self, batch):
+        if self.n_bytes > 0 and self.n_bytes + batch_size(batch) > \
+                self.max_bytes:
+            self.rollover()
+
+        for name, data in batch.items():
+            data = np.ascontiguousarray(data)
+
+            if name not in self.files:
+                self.files[name] = open(self.filename(name), 'wb')
+                self.headers[name] = {'dtype': data.dtype.str,
+                                      'shape': list(data.shape[1:]),
+                                      'rows': 0}
+
+            header = self.headers[name]
+
+            if list(data.shape[1:]) != header['shape']:
+                raise ValueError('shape of {0} changed'.format(name))
+
+            self.files[name].write(data.data)
+            header['rows'] += len(data)
+
+        self.n_bytes += batch_size(batch)
+
+    def rollover(self):
+        '''
+        Closes the current files, the next batch starts a new file set.
+        '''
+        logger.debug('rollover after file set {0}'.format(self.index))
+        self.close()
+        self.index += 1
+
+    def close(self):
+        for name, f in self.files.items():
+            f.close()
+
+            with open(self.filename(name)[:-4] + '.json', 'w') as h:
+                json.dump(self.headers[name], h, indent=4)
+
+        self.files = {}
+        self.headers = {}
+        self.n_bytes = 0
+
+
+def _timed(function, batch, submitted):
+    '''
+    Runs a stage function in a pool worker, returns the result, the time
+    the batch waited for a worker and the processing time.
+    '''
+    start = time.time()
+    result = function(batch)
+
+    return result, start - submitted, time.time() - start
+
+
+class StageStatistics(object):
+    '''
+    Throughput counters of one pipeline stage.
+
+    busy is the fraction of the time the workers of the stage spent
+    processing, wait the mean time a batch waited for a free worker.
+    '''
+
+    def __init__(self, name, queue=None, workers=1):
+        self.name = name
+        self.queue = queue
+        self.workers = workers
+        self.batches = 0
+        self.bytes = 0
+        self.busy = 0.
+        self.wait = 0.
+        self.start = time.time()
+
+    def add(self, batch, duration, wait=0.):
+        self.batches += 1
+        self.bytes += batch_size(batch)
+        self.busy += duration
+        self.wait += wait
+
+    def summary(self):
+        elapsed = max(time.time() - self.start, 1e-9)
+
+        summary = {'batches': self.batches,
+                   'bytes': self.bytes,
+                   'batch_rate': self.batches / elapsed,
+                   'throughput': self.bytes / elapsed,
+                   'busy': self.busy / (elapsed * self.workers),
+                   'wait': self.wait / max(self.batches, 1)}
+
+        if self.queue is not None:
+            summary['queue'] = self.queue.qsize()
+            summary['queue_size'] = self.queue.maxsize
+
+        return summary
+
+
+class RunController(object):
+    '''
+    Runs readout, processing stages and writer as a pipeline.
+
+    Parameters
+    ----------
+    readout : callable
+        Returns the next batch or None if there is no data yet. If it has
+        configure/close methods, they are called at start/stop.
+    stages : list
+        Processing stages as (name, function, workers, mode) tuples. The
+        function takes and returns a batch (None drops the batch). mode is
+        'thread' or 'process' (function has to be picklable then). Batches
+        leave each stage in the order they entered it.
+    writer : object
+        Has write(batch), rollover() and close() (e.g. RawWriter).
+    queue_size : int
+        Maximum number of batches waiting in front of each stage. A full
+        queue blocks the stage before it (backpressure), so the readout
+        slows down instead of memory growing without bound.
+    '''
+
+    def __init__(self, readout, stages=(), writer=None, queue_size=8):
+        self.readout = readout
+        self.stages = list(stages)
+        self.writer = writer
+        self.queue_size = queue_size
+
+        self.statistics = []
+        self._threads = []
+        self._pools = []
+        self._running = threading.Event()
+        self._rollover = threading.Event()
+
+    def start(self):
+        logger.info('start run')
+
+        if hasattr(self.readout, 'configure'):
+            self.readout.configure()
+
+        self._running.set()
+        self._threads = []
+        self._pools = []
+
+        out_q = queue.Queue(self.queue_size)
+        stats = StageStatistics('readout')
+        self.statistics = [stats]
+        self._spawn(self._readoutLoop, out_q, stats)
+
+        for name, function, workers, mode in self.stages:
+            in_q = out_q
+            out_q = queue.Queue(self.queue_size)
+
+            if mode == 'process':
+                pool = multiprocessing.Pool(workers)
+            else:
+                pool = ThreadPool(workers)
+
+            self._pools.append(pool)
+
+            stats = StageStatistics(name, in_q, workers)
+            self.statistics.append(stats)
+            self._spawn(self._stageLoop, function, pool, workers, in_q,
+                        out_q, stats)
+
+        stats = StageStatistics('writer', out_q)
+        self.statistics.append(stats)
+        self._spawn(self._writerLoop, out_q, stats)
+
+    def stop(self):
+        '''
+        Stops the readout and waits until all data is written.
+        '''
+        logger.info('stop run')
+        self._running.clear()
+
+        for t in self._threads:
+            t.join()
+
+        for pool in self._pools:
+            pool.close()
+            pool.join()
+
+        if hasattr(self.readout, 'close'):
+            self.readout.close()
+
+        if self.writer is not None:
+            self.writer.close()
+
+    @property
+    def depth(self):
+        '''
+        Maximum number of batches held by the pipeline at the same time:
+        queued, in the stages, in the writer and waiting in the readout.
+        '''
+        return ((len(self.stages) + 1) * self.queue_size + 2 +
+                sum(workers + 1 for name, function, workers, mode in
+                    self.stages))
+
+    def running(self):
+        return self._running.is_set()
+
+    def rollover(self):
+        '''
+        Requests a rollover of the output files before the next batch.
+        '''
+        self._rollover.set()
+
+    def summary(self):
+        '''
+        Returns throughput, busy fraction, worker wait and queue occupancy
+        per stage.
+        '''
+        return [(s.name, s.summary()) for s in self.statistics]
+
+    def _spawn(self, target, *args):
+        t = threading.Thread(target=target, args=args)
+        t.daemon = True
+        t.start()
+        self._threads.append(t)
+
+    def _readoutLoop(self, out_q, stats):
+        try:
+            while self._running.is_set():
+                start = time.time()
+                batch = self.readout()
+
+                if batch is None:
+                    continue
+
+                stats.add(batch, time.time() - start)
+                out_q.put(batch)
+        except Exception:
+            logger.exception('readout failed, stopping run')
+            self._running.clear()
+        finally:
+            out_q.put(_STOP)
+
+    def _stageLoop(self, function, pool, workers, in_q, out_q, stats):
+        pending = deque()
+
+        def flush(n):
+            while len(pending) > n:
+                result = pending.popleft()
+
+                try:
+                    batch, wait, duration = result.get()
+                except Exception:
+                    logger.exception('stage {0} failed'.format(stats.name))
+                    continue
+
+                if batch is not None:
+                    stats.add(batch, duration, wait)
+                    out_q.put(batch)
+
+        while True:
+            batch = in_q.get()
+
+            if batch is _STOP:
+                break
+
+            pending.append(pool.apply_async(_timed, (function, batch,
+                                                     time.time())))
+            flush(workers)
+
+        flush(0)
+        out_q.put(_STOP)
+
+    def _writerLoop(self, in_q, stats):
+        while True:
+            batch = in_q.get()
+
+            if batch is _STOP:
+                break
+
+            if self.writer is None:
+                continue
+
+            if self._rollover.is_set():
+                self._rollover.clear()
+                self.writer.rollover()
+
+            start = time.time()
+
+            try:
+                self.writer.write(batch)
+            except Exception:
+                logger.exception('writing failed, stopping run')
+                self._running.clear()
+                continue
+
+            stats.add(batch, time.time() - start)
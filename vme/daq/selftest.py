@@ -0,0 +1,201 @@
+'''
+vme/daq/selftest.py
+-------------------
+
+Memory and transfer self-test of the SIS3302.
+
+In ADC test data mode the adcs deliver an incrementing 16 bit counter
+instead of the converted signal. The self-test runs acquisitions with
+this pattern for every page size, reads the data back with D16 and D32
+block transfers and checks every event against the pattern. Corrupted
+words point to a bad board, a low transfer rate to a slow link.
+
+By default only the first TEST_SAMPLES samples of each adc are read
+per page size, which keeps the test short enough to run before every
+run. With max_samples=None all events are read completely; with large
+page sizes this covers all memory pages (about 1 GB of transfers per
+board).
+'''
+
+import time
+
+import numpy as np
+
+from ..modules.sis3302 import (MAX_NOF_SAMPLES, MAX_SAMPLES_PER_PAGE,
+                               SIS_PAGE_SIZE)
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# page sizes tested by default
+PAGE_SIZES = sorted(SIS_PAGE_SIZE)
+
+# samples read per adc, transfer mode and page size in the short test
+TEST_SAMPLES = 0x40000
+
+# transfer modes (block read width)
+WIDTHS = [16, 32]
+
+
+def check_pattern(data):
+    '''
+    Counts the words deviating from the incrementing pattern.
+
+    data holds one event per row. The counter value of each event is
+    taken from the median of its rows, so single corrupted words do not
+    shift the reference. Returns the number of corrupted words per event.
+    '''
+    data = np.asarray(data, dtype=np.int64)
+    phase = (data - np.arange(data.shape[1])) & 0xffff
+    reference = np.median(phase, axis=1).astype(np.int64)
+
+    return np.count_nonzero(phase != reference[:, np.newaxis], axis=1)
+
+
+class SelfTest(object):
+    '''
+    Pattern and throughput test of a SIS3302 in test data mode.
+
+    Parameters
+    ----------
+    sis : SIS3302
+        Module to test. Its configuration is restored afterwards.
+    adcs : list
+        ADCs whose memory is checked.
+    max_events : int
+        Upper limit for the events per acquisition.
+    max_samples : int
+        Samples read per adc and page size (None: all events
+        completely).
+    '''
+
+    def __init__(self, sis, adcs=range(1, 9), max_events=64,
+                 max_samples=TEST_SAMPLES):
+        self.sis = sis
+        self.adcs = list(adcs)
+        self.max_events = max_events
+        self.max_samples = max_samples
+
+        self.results = []
+
+    def acquire(self, page_size, n_events, timeout=1.):
+        '''
+        Takes n_events events of page_size samples in test data mode.
+        '''
+        sis = self.sis
+
+        sis.setPageSize(page_size)
+        sis.setMaxNoOfEvents(n_events)
+        sis.armSamplingLogic()
+        sis.startSampling()
+
+        if sis.waitForEvents(n_events, timeout) < n_events:
+            sis.disarmSamplingLogic()
+            msg = 'acquisition of {0} events of {1} samples timed out'
+            raise IOError(msg.format(n_events, page_size))
+
+    def measure(self, page_size, timeout=1.):
+        '''
+        Tests one page size.
+
+        Returns a dict with the number of events, words and corrupted
+        words per adc and the throughput (bytes/s) per transfer mode.
+        '''
+        n_events = max(min(self.max_events, MAX_NOF_SAMPLES // page_size),
+                       1)
+        length = page_size
+
+        if self.max_samples is not None:
+            n_events = max(min(n_events, self.max_samples // page_size), 1)
+            length = min(page_size, self.max_samples)
+
+        self.acquire(page_size, n_events, timeout)
+
+        corrupted = {}
+        n_bytes = dict((w, 0) for w in WIDTHS)
+        duration = dict((w, 0.) for w in WIDTHS)
+
+        for width in WIDTHS:
+            for adc in self.adcs:
+                start = time.time()
+                if length < page_size:
+                    # beginning of a single event
+                    data = self.sis.readSamples(adc, 0, length,
+                                                width)[np.newaxis]
+                else:
+                    data = self.sis.readData(adc, page_size, n_events,
+                                             width)
+                duration[width] += time.time() - start
+                n_bytes[width] += data.nbytes
+
+                errors = int(check_pattern(data).sum())
+                corrupted[(adc, width)] = errors
+
+                if errors:
+                    msg = 'adc {0}, page size {1}, D{2}: {3} corrupted words'
+                    logger.warning(msg.format(adc, page_size, width, errors))
+
+        result = {'page_size': page_size,
+                  'events': n_events,
+                  'pages': -(-length * n_events // MAX_SAMPLES_PER_PAGE),
+                  'words': length * n_events * len(self.adcs),
+                  'corrupted': corrupted,
+                  'throughput': dict((w, n_bytes[w] / max(duration[w], 1e-9))
+                                     for w in WIDTHS)}
+
+        self.results.append(result)
+
+        return result
+
+    def run(self, page_sizes=PAGE_SIZES, start_data=0, timeout=1.):
+        '''
+        Runs the test for all page sizes.
+
+        Returns True if no corrupted word was found.
+        '''
+        sis = self.sis
+        snapshot = sis.readConfiguration()
+
+        try:
+            sis.enableADCTestDataMode()
+            sis.setADCTestStartData(start_data)
+            sis.enablePageWrap(False)
+            sis.enableMultiEvent()
+            sis.enableAutostart()
+
+            for page_size in page_sizes:
+                self.measure(page_size, timeout)
+        finally:
+            sis.writeConfiguration(snapshot)
+
+        errors = sum(sum(r['corrupted'].values()) for r in self.results)
+
+        if errors:
+            logger.error('self-test failed: {0} corrupted words'.format(
+                errors))
+        else:
+            logger.info('self-test passed')
+
+        return errors == 0
+
+    def report(self):
+        '''
+        Returns the results as a printable table.
+        '''
+        header = '{0:>10} {1:>7} {2:>6} {3:>12} {4:>10}'.format(
+            'page size', 'events', 'pages', 'words', 'corrupted')
+        header += ''.join(' {0:>11}'.format('D{0} [MB/s]'.format(w))
+                          for w in WIDTHS)
+
+        lines = [header]
+
+        for r in self.results:
+            line = '{0:>10} {1:>7} {2:>6} {3:>12} {4:>10}'.format(
+                r['page_size'], r['events'], r['pages'], r['words'],
+                sum(r['corrupted'].values()))
+            line += ''.join(' {0:>11.2f}'.format(r['throughput'][w] / 1e6)
+                            for w in WIDTHS)
+            lines.append(line)
+
+        return '\n'.join(lines)
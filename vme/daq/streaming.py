@@ -0,0 +1,218 @@
+'''
+vme/daq/streaming.py
+--------------------
+
+Publishes readout batches to monitor processes over TCP.
+
+The server never blocks the DAQ: every subscriber has a short queue of
+encoded frames and its own sender thread. If a subscriber does not keep
+up, its oldest frames are dropped.
+'''
+
+import socket
+import threading
+from collections import deque
+
+from .framing import encode_frame, send_buffers, recv_frame
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+DEFAULT_PORT = 50302
+
+
+class Subscriber(object):
+    '''
+    Connection of one client to the StreamServer.
+    '''
+
+    def __init__(self, sock, address, queue_size):
+        self.sock = sock
+        self.address = address
+        self.frames = deque(maxlen=queue_size)
+        self.sent = 0
+        self.dropped = 0
+
+        self._condition = threading.Condition()
+        self._running = True
+
+        self._thread = threading.Thread(target=self._sendLoop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def push(self, frame):
+        with self._condition:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+
+            self.frames.append(frame)
+            self._condition.notify()
+
+    def alive(self):
+        return self._running
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+        self._thread.join()
+
+    def _sendLoop(self):
+        try:
+            while True:
+                with self._condition:
+                    while self._running and not self.frames:
+                        self._condition.wait()
+
+                    if not self._running:
+                        break
+
+                    frame = self.frames.popleft()
+
+                send_buffers(self.sock, frame)
+                self.sent += 1
+        except socket.error as e:
+            logger.info('subscriber {0} gone ({1})'.format(self.address, e))
+        finally:
+            self._running = False
+            self.sock.close()
+
+
+class StreamServer(object):
+    '''
+    Publishes batches (dict of name -> ndarray) to all connected clients.
+
+    The server can also be used as a processing stage of the
+    RunController: calling it publishes the batch and passes it on.
+
+    Parameters
+    ----------
+    host : str
+        Interface to listen on (default: local connections only).
+    port : int
+        TCP port.
+    queue_size : int
+        Number of frames buffered per subscriber before dropping.
+    '''
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, queue_size=4):
+        self.queue_size = queue_size
+        self.seq = 0
+
+        self.subscribers = []
+        self._lock = threading.Lock()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(5)
+        self.address = self.sock.getsockname()
+
+        self._running = True
+        self._thread = threading.Thread(target=self._acceptLoop)
+        self._thread.daemon = True
+        self._thread.start()
+
+        logger.info('streaming server listening on {0}'.format(self.address))
+
+    def _acceptLoop(self):
+        while self._running:
+            try:
+                sock, address = self.sock.accept()
+            except socket.error:
+                break
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            logger.info('new subscriber {0}'.format(address))
+
+            with self._lock:
+                self.subscribers.append(Subscriber(sock, address,
+                                                   self.queue_size))
+
+    def publish(self, batch, meta=None):
+        '''
+        Sends batch to all subscribers, never blocks.
+
+        The frame is encoded once and shared by all subscribers, the
+        arrays must not be modified afterwards.
+        '''
+        frame = encode_frame(self.seq, batch, meta)
+        self.seq += 1
+
+        with self._lock:
+            self.subscribers = [s for s in self.subscribers if s.alive()]
+
+            for subscriber in self.subscribers:
+                subscriber.push(frame)
+
+    def __call__(self, batch):
+        self.publish(batch)
+        return batch
+
+    def statistics(self):
+        '''
+        Returns (address, sent, dropped) for all subscribers.
+        '''
+        with self._lock:
+            return [(s.address, s.sent, s.dropped) for s in self.subscribers]
+
+    def close(self):
+        self._running = False
+
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+        self.sock.close()
+
+        with self._lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+
+            self.subscribers = []
+
+
+class StreamClient(object):
+    '''
+    Receives batches published by a StreamServer.
+
+    Frames dropped by the server show up as gaps in the sequence
+    numbers, their number is counted in lost.
+    '''
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.sock = socket.create_connection((host, port))
+        self.last_seq = None
+        self.lost = 0
+
+    def receive(self):
+        '''
+        Returns sequence number, metadata and dict of arrays of the
+        next batch.
+        '''
+        seq, meta, arrays = recv_frame(self.sock)
+
+        if self.last_seq is not None and seq > self.last_seq + 1:
+            self.lost += seq - self.last_seq - 1
+
+        self.last_seq = seq
+
+        return seq, meta, arrays
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.receive()
+            except socket.error:
+                return
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,48 @@
+'''
+vme/modules/bridge.py
+---------------------
+
+Helpers common to all VME bridges (v2718, RemoteBridge, ...).
+'''
+
+import threading
+
+
+def execute(vme, cycles):
+    '''
+    Runs a list of (method, args) bridge cycles and returns the results,
+    in a single request if the bridge supports it (RemoteBridge).
+    '''
+    if hasattr(vme, 'execute'):
+        return vme.execute(cycles)
+
+    return [getattr(vme, method)(*args) for method, args in cycles]
+
+
+class LockedBridge(object):
+    '''
+    Serializes the access of several threads to one bridge.
+
+    Wraps a bridge, every call of a bridge method holds a common lock.
+    Sequences of cycles which must not be interleaved (e.g. memory page
+    select and block read) can hold the (reentrant) lock as well:
+
+        with vme.lock:
+            ...
+    '''
+
+    def __init__(self, vme, lock=None):
+        self.vme = vme
+        self.lock = threading.RLock() if lock is None else lock
+
+    def __getattr__(self, name):
+        attr = getattr(self.vme, name)
+
+        if not callable(attr):
+            return attr
+
+        def locked(*args, **kwargs):
+            with self.lock:
+                return attr(*args, **kwargs)
+
+        return locked
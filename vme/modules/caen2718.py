@@ -7,12 +7,19 @@ Created on Jun 19, 2013
 @author: Christian Strandhagen (strandhagen _at_ pit.physik.uni-tuebingen.de)
 '''
 
+import time
+
 import numpy as np
-import caenvme
 
-from caenvme import (BoardTypes, PulserSelect, TimeUnits,
-                     IOSources, OutputSelect, IOPolarity,
-                     LEDPolarity, IRQLevels, VME_Error)
+try:
+    import caenvme
+
+    from caenvme import (BoardTypes, PulserSelect, TimeUnits,
+                         IOSources, OutputSelect, IOPolarity,
+                         LEDPolarity, IRQLevels, VME_Error)
+except ImportError:
+    # only the ctypes backend is available
+    caenvme = None
 
 import logging
 logger = logging.getLogger(__name__)
@@ -28,6 +35,9 @@ translate_irq_levels = {'\x01': 1,
 
 cvIRQ = [0x0, 0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40]
 
+# maximum size (in bytes) of a single block transfer
+BLOCK_CHUNK_SIZE = 0x100000
+
 
 class v2718(object):
     '''
@@ -40,8 +50,39 @@ class v2718(object):
     '''
     handle = None
 
-    def __init__(self):
-        self.handle = caenvme.Init(BoardTypes.V2718)
+    # blockReadD16/D32 store the data in out if given (see
+    # chunkedBlockRead)
+    READS_INTO_BUFFER = True
+
+    def __init__(self, chunk_size=BLOCK_CHUNK_SIZE, retries=3,
+                 retry_delay=0.001, backend=None):
+        '''
+        Block reads are split into transfers of at most chunk_size
+        bytes. A chunk failing with a bus error is retried up to retries
+        times, the delay (in s) before a retry is doubled each time.
+
+        backend selects the library: None (default) uses the caenvme
+        extension, 'ctypes' libCAENVME through ctypes (releases the GIL
+        during I/O, see vme.modules.caenvme_ctypes). Any object with the
+        caenvme functions (e.g. a CAENVMELib instance) can be given, too.
+        '''
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.errors = {'retries': 0, 'failed': 0}
+
+        if backend is None:
+            if caenvme is None:
+                raise ImportError('caenvme not available, use '
+                                  'backend=\'ctypes\'')
+            backend = caenvme
+        elif backend == 'ctypes':
+            from .caenvme_ctypes import CAENVMELib
+            backend = CAENVMELib()
+
+        self.lib = backend
+
+        self.handle = self.lib.Init(self.lib.BoardTypes.V2718)
         # TODO: self check
         logger.debug('VME bridge initialised ({0})'.format(self.handle))
 
@@ -50,44 +91,163 @@ class v2718(object):
         End VME connection on delete.
         '''
         if self.handle is not None:
-            caenvme.End(self.handle)
+            self.lib.End(self.handle)
             logger.debug('VME bridge disconnected')
 
     def singleReadD32(self, address):
         '''
         Reads a single 32-bit value from address.
         '''
-        return caenvme.SingleReadD32(self.handle, address)
+        return self.lib.SingleReadD32(self.handle, address)
 
     def singleReadD16(self, address):
         '''
         Reads a single 16-bit value from address.
         '''
-        return caenvme.SingleReadD16(self.handle, address)
+        return self.lib.SingleReadD16(self.handle, address)
 
-    def blockReadD32(self, address, nsamples):
+    def blockReadD32(self, address, nsamples, out=None):
         '''
         Reads nsamples 32-bit values from address.
+
+        See also: chunkedBlockRead
         '''
-        return caenvme.BlockReadD32(self.handle, address, nsamples)
+        return self.chunkedBlockRead(self.lib.BlockReadD32, address,
+                                     nsamples, 'uint32', out)
 
-    def blockReadD16(self, address, nsamples):
+    def blockReadD16(self, address, nsamples, out=None):
         '''
         Reads nsamples 16-bit values from address.
+
+        See also: chunkedBlockRead
+        '''
+        return self.chunkedBlockRead(self.lib.BlockReadD16, address,
+                                     nsamples, 'uint16', out)
+
+    def chunkedBlockRead(self, read, address, nsamples, dtype, out=None):
+        '''
+        Performs a block read split into chunks of chunk_size bytes.
+
+        Each chunk is retried on bus errors (see retry), so a transient
+        error only costs the failed chunk and the read is resumed at its
+        offset.
+
+        The data is stored in out (an array of nsamples values) if
+        given. Backends with READS_INTO_BUFFER transfer the data
+        directly into it, otherwise it is copied.
+        '''
+        itemsize = np.dtype(dtype).itemsize
+        chunk = max(self.chunk_size // itemsize, 1)
+        direct = getattr(self.lib, 'READS_INTO_BUFFER', False)
+
+        if out is None:
+            if nsamples <= chunk and not direct:
+                return self.retry(read, self.handle, address, nsamples)
+
+            out = np.empty(nsamples, dtype=dtype)
+
+        for offset in range(0, nsamples, chunk):
+            n = min(chunk, nsamples - offset)
+            a = address + offset * itemsize
+
+            if direct:
+                self.retry(read, self.handle, a, n, out[offset:offset + n])
+            else:
+                out[offset:offset + n] = self.retry(read, self.handle, a, n)
+
+        return out[:nsamples]
+
+    def retry(self, func, *args):
+        '''
+        Calls func(*args) and retries on bus errors with back-off.
+
+        The number of retries and of finally failed calls are counted
+        in errors.
         '''
-        return caenvme.BlockReadD16(self.handle, address, nsamples)
+        delay = self.retry_delay
+
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args)
+            except self.lib.VME_Error as e:
+                if attempt == self.retries:
+                    self.errors['failed'] += 1
+                    raise
+
+                self.errors['retries'] += 1
+
+                msg = 'bus error ({0}), retry in {1} s'
+                logger.warning(msg.format(e, delay))
+
+                time.sleep(delay)
+                delay *= 2
+
+    def resetErrorCounters(self):
+        self.errors = {'retries': 0, 'failed': 0}
 
     def singleWriteD32(self, address, data):
         '''
         Writes a single 32-bit value to address.
         '''
-        caenvme.SingleWriteD32(self.handle, address, data)
+        self.lib.SingleWriteD32(self.handle, address, data)
 
     def singleWriteD16(self, address, data):
         '''
         Writes a single 16-bit value to address.
         '''
-        caenvme.SingleWriteD16(self.handle, address, data)
+        self.lib.SingleWriteD16(self.handle, address, data)
+
+    def multiReadD32(self, addresses, default=None):
+        '''
+        Reads 32-bit values from a list of addresses.
+
+        If default is not None, it is returned for cycles ending with
+        a bus error instead of raising VME_Error.
+
+        The cycles are done one after another here, bridges with
+        a cheaper way to batch cycles override this.
+        '''
+        return self._multiRead(self.lib.SingleReadD32, addresses, default)
+
+    def multiReadD16(self, addresses, default=None):
+        '''
+        Reads 16-bit values from a list of addresses.
+
+        See also: multiReadD32
+        '''
+        return self._multiRead(self.lib.SingleReadD16, addresses, default)
+
+    def _multiRead(self, read, addresses, default):
+        values = []
+
+        for address in addresses:
+            try:
+                values.append(read(self.handle, address))
+            except self.lib.VME_Error:
+                if default is None:
+                    raise
+
+                values.append(default)
+
+        return values
+
+    def multiWriteD32(self, addresses, data):
+        '''
+        Writes a list of 32-bit values to a list of addresses.
+
+        See also: multiReadD32
+        '''
+        for address, value in zip(addresses, data):
+            self.lib.SingleWriteD32(self.handle, address, value)
+
+    def multiWriteD16(self, addresses, data):
+        '''
+        Writes a list of 16-bit values to a list of addresses.
+
+        See also: multiReadD32
+        '''
+        for address, value in zip(addresses, data):
+            self.lib.SingleWriteD16(self.handle, address, value)
 
     def configureOutput(self, output_select,
                         output_polarity, led_polarity, source):
@@ -100,8 +260,8 @@ class v2718(object):
 
         For details refer to the manual.
         '''
-        caenvme.SetOutputConf(self.handle, output_select, output_polarity,
-                              led_polarity, source)
+        self.lib.SetOutputConf(self.handle, output_select, output_polarity,
+                               led_polarity, source)
 
     def enableIRQ(self, mask, enable=True):
         '''
@@ -109,10 +269,10 @@ class v2718(object):
         '''
         if enable:
             logger.debug('enable IRQ with mask {0}'.format(mask))
-            caenvme.IRQEnable(self.handle, mask)
+            self.lib.IRQEnable(self.handle, mask)
         else:
             logger.debug('disable IRQ with mask {0}'.format(mask))
-            caenvme.IRQDisable(self.handle, mask)
+            self.lib.IRQDisable(self.handle, mask)
 
     def checkIRQ(self):
         '''
@@ -121,7 +281,7 @@ class v2718(object):
         See also: waitForIRQ, IACKCycle
         '''
         logger.debug('check IRQ')
-        mask = caenvme.IRQCheck(self.handle)
+        mask = self.lib.IRQCheck(self.handle)
 
         return int(np.log2(mask)) + 1
 
@@ -137,7 +297,7 @@ class v2718(object):
         msg = 'wait for IRQ with mask {0} (timeout {1})'
         logger.debug(msg.format(mask, timeout))
 
-        caenvme.IRQWait(self.handle, mask, timeout)
+        self.lib.IRQWait(self.handle, mask, timeout)
 
     def IACKCycle(self, irq_level):
         '''
@@ -150,7 +310,7 @@ class v2718(object):
         logger.debug('IACK cycle, IRQ level {0}'.format(irq_level))
 
         irq_level = cvIRQ[irq_level]
-        return caenvme.IACKCycle(self.handle, irq_level)
+        return self.lib.IACKCycle(self.handle, irq_level)
 
     def startPulser(self, pulser):
         '''
@@ -161,7 +321,7 @@ class v2718(object):
         See also: configurePulser, stopPulser
         '''
         logger.debug('start pulser')
-        caenvme.StartPulser(self.handle, pulser)
+        self.lib.StartPulser(self.handle, pulser)
 
     def stopPulser(self, pulser):
         '''
@@ -170,7 +330,7 @@ class v2718(object):
         See also: startPulser, configurePulser
         '''
         logger.debug('stop pulser')
-        caenvme.StopPulser(self.handle, pulser)
+        self.lib.StopPulser(self.handle, pulser)
 
     def configurePulser(self, pulser, period, width, time_unit,
                         n_pulses, start_signal, reset_signal):
@@ -182,5 +342,5 @@ class v2718(object):
         See also: startPulser, stopPulser
         '''
 
-        caenvme.SetPulserConf(self.handle, pulser, period, width, time_unit,
-                              n_pulses, start_signal, reset_signal)
+        self.lib.SetPulserConf(self.handle, pulser, period, width, time_unit,
+                               n_pulses, start_signal, reset_signal)
@@ -1,3 +1,5 @@
+import time
+
 import numpy as np
 
 import logging
@@ -5,6 +7,8 @@ logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
 
+N_CHANNELS = 16
+
 THRESHOLD = [0x00, 0x02, 0x04, 0x06, 0x08, 0x0A, 0x0C, 0x0E,
              0x10, 0x12, 0x14, 0x16, 0x18, 0x1A, 0x1C, 0x1E]
 
@@ -21,11 +25,30 @@ FIXED_CODE = 0xFA
 MODULE_TYPE = 0xFC
 VERSION = 0xFE
 
+# content of FIXED_CODE register (all CAEN modules)
+V895_FIXED_CODE = 0xFAF5
+
+# content of MODULE_TYPE register
+V895_MODULE_TYPE = 2132
+
 
 def majority(maj):
     return int(round((maj * 50 - 25) / 4.))
 
 
+def channel_mask(channel_list):
+    '''
+    Converts a list of channel numbers to the bit mask of the
+    inhibit register (channel 0 is the most significant bit).
+    '''
+    channels = np.asarray(channel_list, dtype=int).ravel()
+
+    if np.any((channels < 0) | (channels > N_CHANNELS - 1)):
+        raise ValueError('channel must be between 0 and 15')
+
+    return int(np.bitwise_or.reduce(1 << (N_CHANNELS - 1 - channels)))
+
+
 class CAEN895(object):
     '''
     Implements the functionality of the CAEN895 LED.
@@ -34,10 +57,13 @@ class CAEN895(object):
         self.vme = vme
         self.base_address = base_address
 
+        # last thresholds written to the module (None = unknown)
+        self._thresholds = None
+
         mod_type = self.getModuleType()
         logger.debug('module type is {0}'.format(mod_type))
 
-        if mod_type != 2132:
+        if mod_type != V895_MODULE_TYPE:
             raise RuntimeError('wrong module type')
 
         msg = 'connected to controller {0} at address {1}'
@@ -75,6 +101,143 @@ class CAEN895(object):
         self.vme.singleWriteD16(self.base_address + THRESHOLD[channel],
                                 threshold)
 
+        if self._thresholds is not None:
+            self._thresholds[channel] = threshold
+
+    def setThresholds(self, thresholds, force=False):
+        '''
+        Set thresholds of all channels at once.
+
+        Only channels whose threshold differs from the last value
+        written are updated, unless force is True.
+
+        Parameters
+        ----------
+        thresholds : array_like
+            Thresholds in mV (between 1 and 255) for all 16 channels
+        force : bool
+            Write all thresholds regardless of the current values.
+
+        Returns
+        -------
+        channels : ndarray
+            Channel numbers which have been written.
+        '''
+        thresholds = np.asarray(thresholds, dtype=int)
+
+        if thresholds.shape != (N_CHANNELS,):
+            raise ValueError('thresholds must contain 16 values')
+
+        if np.any((thresholds < 1) | (thresholds > 255)):
+            raise ValueError('threshold must be between 1 and 255')
+
+        if force or self._thresholds is None:
+            channels = np.arange(N_CHANNELS)
+        else:
+            channels = np.flatnonzero(thresholds != self._thresholds)
+
+        msg = 'set thresholds of channels {0}'
+        logger.debug(msg.format(channels.tolist()))
+
+        for channel in channels:
+            self.vme.singleWriteD16(self.base_address + THRESHOLD[channel],
+                                    int(thresholds[channel]))
+
+        self._thresholds = thresholds.copy()
+
+        return channels
+
+    def getThresholds(self):
+        '''
+        Returns the thresholds last written with setThresholds
+        (None if they are unknown).
+
+        The threshold registers are write-only, so the values are
+        not read back from the module.
+        '''
+        if self._thresholds is None:
+            return None
+
+        return self._thresholds.copy()
+
+    def thresholdScan(self, thresholds, counter, channels=None, settle=0.):
+        '''
+        Steps the thresholds and records the counting rate per step.
+
+        All scanned channels are stepped in parallel, the thresholds of
+        the remaining channels are left untouched. The original
+        thresholds are restored afterwards if they are known (i.e. have
+        been set with setThresholds), otherwise the scanned channels stay
+        at the last step.
+
+        Parameters
+        ----------
+        thresholds : array_like
+            Threshold steps in mV. Either 1-D (same value for all
+            scanned channels) or of shape (n_steps, 16).
+        counter : callable
+            Called without arguments after each step, has to return the
+            counting rate (scalar or one value per channel).
+        channels : list
+            Channels to scan (default: all).
+        settle : float
+            Time in s to wait after setting the thresholds before
+            calling counter.
+
+        Returns
+        -------
+        rates : ndarray
+            Counting rates, one row per threshold step.
+        '''
+        thresholds = np.asarray(thresholds, dtype=int)
+
+        if channels is None:
+            channels = np.arange(N_CHANNELS)
+
+        channels = np.asarray(channels, dtype=int)
+
+        if self._thresholds is None:
+            original = None
+            current = np.ones(N_CHANNELS, dtype=int)
+        else:
+            original = self._thresholds.copy()
+            current = original.copy()
+
+        steps = np.repeat(current[np.newaxis], len(thresholds), axis=0)
+
+        if thresholds.ndim == 1:
+            steps[:, channels] = thresholds[:, np.newaxis]
+        else:
+            steps[:, channels] = thresholds[:, channels]
+
+        # validate all steps before touching the module
+        if np.any((steps < 1) | (steps > 255)):
+            raise ValueError('threshold must be between 1 and 255')
+
+        rates = []
+
+        try:
+            for step in steps:
+                if original is None:
+                    # unknown thresholds: write the scanned channels only
+                    for channel in channels:
+                        self.setThreshold(int(channel), int(step[channel]))
+                else:
+                    self.setThresholds(step)
+
+                if settle > 0:
+                    time.sleep(settle)
+
+                rates.append(counter())
+        finally:
+            if original is not None:
+                self.setThresholds(original)
+            else:
+                logger.info('thresholds unknown, scanned channels are left '
+                            'at the last step')
+
+        return np.array(rates)
+
     def enableChannels(self, channel_list):
         '''
         Enable channels specified in channel_list.
@@ -85,15 +248,7 @@ class CAEN895(object):
             List of channel numbers (between 0 and 15) to enable.
             All other channels are disabled.
         '''
-        mask = 16 * [False]
-
-        for channel in channel_list:
-            if (channel < 0) | (channel > 15):
-                raise ValueError('channel must be between 0 and 15')
-
-            mask[channel] = True
-
-        mask = int(''.join([str(int(el)) for el in mask]), 2)
+        mask = channel_mask(channel_list)
 
         self.vme.singleWriteD16(self.base_address + INHIBIT, mask)
 
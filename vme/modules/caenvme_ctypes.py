@@ -0,0 +1,246 @@
+'''
+vme/modules/caenvme_ctypes.py
+-----------------------------
+
+Access to CAENVMElib through ctypes.
+
+CAENVMELib provides the functions of the caenvme extension used by
+v2718 (Init, SingleReadD32, BlockReadD32, IRQWait, ...) on top of the
+CAENVME_* functions of libCAENVME, so it can be passed to v2718 as
+backend. Calls through ctypes.CDLL release the GIL for their whole
+duration, other threads keep running during block transfers and while
+waiting for interrupts. Block reads go directly into numpy arrays,
+optionally owned by the caller (out).
+
+Instead of the shared library any object with the CAENVME_* functions
+can be given, e.g. vme.modules.simulator.SimulatedLibrary.
+'''
+
+import ctypes
+import ctypes.util
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# CVErrorCodes
+cvSuccess = 0
+cvBusError = -1
+cvCommError = -2
+cvGenericError = -3
+cvInvalidParam = -4
+cvTimeoutError = -5
+
+ERROR_NAMES = {cvBusError: 'bus error',
+               cvCommError: 'communication error',
+               cvGenericError: 'generic error',
+               cvInvalidParam: 'invalid parameter',
+               cvTimeoutError: 'timeout'}
+
+# CVDataWidth
+cvD16 = 0x02
+cvD32 = 0x04
+
+# CVAddressModifier
+cvA24_U_DATA = 0x39
+cvA24_U_BLT = 0x3B
+cvA32_U_DATA = 0x09
+cvA32_U_BLT = 0x0B
+
+# end of the A24 address space
+A24_LIMIT = 0x1000000
+
+
+class BoardTypes(object):
+    V1718 = 0
+    V2718 = 1
+
+
+class VME_Error(IOError):
+    '''
+    Raised if a CAENVME function fails, code is the CVErrorCodes value.
+    '''
+    def __init__(self, code, function):
+        msg = '{0} failed: {1}'.format(function,
+                                       ERROR_NAMES.get(code, code))
+        super(VME_Error, self).__init__(msg)
+        self.code = code
+
+
+def load_library(path=None):
+    '''
+    Loads libCAENVME (from path or the default library search path).
+    '''
+    if path is None:
+        path = ctypes.util.find_library('CAENVME') or 'libCAENVME.so'
+
+    logger.debug('loading {0}'.format(path))
+
+    return ctypes.CDLL(path)
+
+
+def _pointer(obj):
+    return ctypes.c_void_p(ctypes.addressof(obj))
+
+
+class CAENVMELib(object):
+    '''
+    caenvme compatible functions calling CAENVMElib through ctypes.
+
+    Addresses below A24_LIMIT are accessed with A24, all others with
+    A32 (non-privileged data/BLT address modifiers).
+
+    Parameters
+    ----------
+    library : CDLL or object
+        libCAENVME (default: load_library()) or a replacement.
+    link, board_number : int
+        Link and board number passed to CAENVME_Init.
+    '''
+    BoardTypes = BoardTypes
+    VME_Error = VME_Error
+
+    # BlockReadD32/D16 take an output array
+    READS_INTO_BUFFER = True
+
+    def __init__(self, library=None, link=0, board_number=0):
+        if library is None:
+            library = load_library()
+
+        self.lib = library
+        self.link = link
+        self.board_number = board_number
+
+    def _call(self, name, *args):
+        code = getattr(self.lib, name)(*args)
+
+        if code != cvSuccess:
+            raise VME_Error(code, name)
+
+    def _modifier(self, address, blt=False):
+        if address < A24_LIMIT:
+            return cvA24_U_BLT if blt else cvA24_U_DATA
+
+        return cvA32_U_BLT if blt else cvA32_U_DATA
+
+    def Init(self, board_type):
+        handle = ctypes.c_int32()
+        self._call('CAENVME_Init', ctypes.c_int(int(board_type)),
+                   ctypes.c_short(self.link),
+                   ctypes.c_short(self.board_number), _pointer(handle))
+
+        return handle.value
+
+    def End(self, handle):
+        self._call('CAENVME_End', ctypes.c_int32(handle))
+
+    def _read(self, handle, address, value, width):
+        self._call('CAENVME_ReadCycle', ctypes.c_int32(handle),
+                   ctypes.c_uint32(address), _pointer(value),
+                   ctypes.c_int(self._modifier(address)),
+                   ctypes.c_int(width))
+
+        return value.value
+
+    def _write(self, handle, address, value, width):
+        self._call('CAENVME_WriteCycle', ctypes.c_int32(handle),
+                   ctypes.c_uint32(address), _pointer(value),
+                   ctypes.c_int(self._modifier(address)),
+                   ctypes.c_int(width))
+
+    def SingleReadD32(self, handle, address):
+        return self._read(handle, address, ctypes.c_uint32(), cvD32)
+
+    def SingleReadD16(self, handle, address):
+        return self._read(handle, address, ctypes.c_uint16(), cvD16)
+
+    def SingleWriteD32(self, handle, address, data):
+        self._write(handle, address, ctypes.c_uint32(data), cvD32)
+
+    def SingleWriteD16(self, handle, address, data):
+        self._write(handle, address, ctypes.c_uint16(data), cvD16)
+
+    def _blockRead(self, handle, address, nsamples, out, dtype, width):
+        if out is None:
+            out = np.empty(nsamples, dtype=dtype)
+        elif out.dtype != dtype or len(out) < nsamples or \
+                not out.flags['C_CONTIGUOUS']:
+            msg = 'out must be a contiguous {0} array of at least {1} values'
+            raise ValueError(msg.format(np.dtype(dtype).name, nsamples))
+
+        size = nsamples * out.itemsize
+        count = ctypes.c_int()
+
+        code = self.lib.CAENVME_BLTReadCycle(
+            ctypes.c_int32(handle), ctypes.c_uint32(address),
+            ctypes.c_void_p(out.ctypes.data), ctypes.c_int(size),
+            ctypes.c_int(self._modifier(address, blt=True)),
+            ctypes.c_int(width), _pointer(count))
+
+        # a bus error terminating a complete transfer is no error
+        if code != cvSuccess and not (code == cvBusError and
+                                      count.value == size):
+            raise VME_Error(code, 'CAENVME_BLTReadCycle')
+
+        return out[:nsamples]
+
+    def BlockReadD32(self, handle, address, nsamples, out=None):
+        return self._blockRead(handle, address, nsamples, out, np.uint32,
+                               cvD32)
+
+    def BlockReadD16(self, handle, address, nsamples, out=None):
+        return self._blockRead(handle, address, nsamples, out, np.uint16,
+                               cvD16)
+
+    def SetOutputConf(self, handle, output_select, output_polarity,
+                      led_polarity, source):
+        self._call('CAENVME_SetOutputConf', ctypes.c_int32(handle),
+                   ctypes.c_int(int(output_select)),
+                   ctypes.c_int(int(output_polarity)),
+                   ctypes.c_int(int(led_polarity)),
+                   ctypes.c_int(int(source)))
+
+    def IRQEnable(self, handle, mask):
+        self._call('CAENVME_IRQEnable', ctypes.c_int32(handle),
+                   ctypes.c_uint32(mask))
+
+    def IRQDisable(self, handle, mask):
+        self._call('CAENVME_IRQDisable', ctypes.c_int32(handle),
+                   ctypes.c_uint32(mask))
+
+    def IRQCheck(self, handle):
+        mask = ctypes.c_ubyte()
+        self._call('CAENVME_IRQCheck', ctypes.c_int32(handle),
+                   _pointer(mask))
+
+        return mask.value
+
+    def IRQWait(self, handle, mask, timeout):
+        self._call('CAENVME_IRQWait', ctypes.c_int32(handle),
+                   ctypes.c_uint32(mask), ctypes.c_uint32(int(timeout)))
+
+    def IACKCycle(self, handle, irq_level):
+        vector = ctypes.c_uint32()
+        self._call('CAENVME_IACKCycle', ctypes.c_int32(handle),
+                   ctypes.c_int(int(irq_level)), _pointer(vector),
+                   ctypes.c_int(cvD32))
+
+        return vector.value
+
+    def StartPulser(self, handle, pulser):
+        self._call('CAENVME_StartPulser', ctypes.c_int32(handle),
+                   ctypes.c_int(int(pulser)))
+
+    def StopPulser(self, handle, pulser):
+        self._call('CAENVME_StopPulser', ctypes.c_int32(handle),
+                   ctypes.c_int(int(pulser)))
+
+    def SetPulserConf(self, handle, pulser, period, width, time_unit,
+                      n_pulses, start_signal, reset_signal):
+        self._call('CAENVME_SetPulserConf', ctypes.c_int32(handle),
+                   ctypes.c_int(int(pulser)), ctypes.c_ubyte(period),
+                   ctypes.c_ubyte(width), ctypes.c_int(int(time_unit)),
+                   ctypes.c_ubyte(n_pulses), ctypes.c_int(int(start_signal)),
+                   ctypes.c_int(int(reset_signal)))
@@ -0,0 +1,186 @@
+'''
+vme/modules/chain.py
+--------------------
+
+Several SIS3302 operated as one.
+
+Control keys (arm, start, timestamp clear, ...) are sent to all boards
+with a single multicast (MCST) write to their common broadcast address,
+so the boards start in the same bus cycle and their timestamps stay
+aligned.
+
+The SIS3302 has no chained block transfer (CBLT) support and the bridge
+functions do not offer CBLT cycles either. The readout of all boards
+is therefore issued as one batch of block reads instead: bridges with
+execute (RemoteBridge) transfer it in a single request, other bridges
+run the reads back to back. The result is split into per-board arrays.
+'''
+
+import time
+
+import numpy as np
+
+from . import sis3302
+from .bridge import execute
+from .sis3302 import (KEY_ARM, KEY_DISARM, KEY_START, KEY_STOP,
+                      KEY_TIMESTAMP_CLR, ADC_OFFSET, ADC_MEMORY_PAGE,
+                      TIMESTAMP_DIRECTORY, MAX_SAMPLES_PER_PAGE,
+                      MAX_NOF_SAMPLES, POLL_INTERVAL_MIN, POLL_INTERVAL_MAX)
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class SIS3302Chain(object):
+    '''
+    Group of SIS3302 sharing a broadcast address.
+
+    Parameters
+    ----------
+    vme : bridge
+        Bridge all boards are connected to.
+    boards : list
+        SIS3302 objects, the first one becomes broadcast master.
+    broadcast_address : int
+        A32 base of the broadcast cycles (multiple of 0x1000000, must
+        not overlap a module).
+    '''
+
+    def __init__(self, vme, boards, broadcast_address):
+        self.vme = vme
+        self.boards = list(boards)
+        self.broadcast_address = broadcast_address
+
+        self._poll_interval = POLL_INTERVAL_MIN
+
+        self.configure()
+
+    def configure(self):
+        for i, board in enumerate(self.boards):
+            board.configureBroadcast(self.broadcast_address, master=(i == 0))
+
+    def release(self):
+        '''
+        Disables broadcast reception on all boards.
+        '''
+        for board in self.boards:
+            board.configureBroadcast(self.broadcast_address, enable=False)
+
+    def broadcast(self, offset, data=1):
+        '''
+        Writes data to register offset of all boards in one MCST cycle.
+        '''
+        logger.debug('broadcast {0:#x} to {1} boards'.format(
+            offset, len(self.boards)))
+        self.vme.singleWriteD32(self.broadcast_address + offset, data)
+
+    def armSamplingLogic(self):
+        self.broadcast(KEY_ARM)
+
+    def disarmSamplingLogic(self):
+        self.broadcast(KEY_DISARM)
+
+    def startSampling(self):
+        self.broadcast(KEY_START)
+
+    def stopSampling(self):
+        self.broadcast(KEY_STOP)
+
+    def clearTimestamps(self):
+        self.broadcast(KEY_TIMESTAMP_CLR)
+
+    def getActualEventCounters(self):
+        '''
+        Reads the event counters of all boards in one batch.
+        '''
+        addresses = [b.base_address + sis3302.ACTUAL_EVENT_COUNTER
+                     for b in self.boards]
+
+        return np.array(self.vme.multiReadD32(addresses))
+
+    def waitForEvents(self, n_events, timeout=None):
+        '''
+        Waits until all boards have n_events events (see
+        SIS3302.waitForEvents). The counters of all boards are read in
+        one batch per poll, timeout (in s) applies to all boards.
+        Returns the smallest event counter.
+        '''
+        start = time.time()
+        interval = self._poll_interval
+        first = True
+
+        while True:
+            counter = int(self.getActualEventCounters().min())
+
+            if counter >= n_events:
+                if first:
+                    interval /= 2.
+                else:
+                    interval /= 4.
+
+                self._poll_interval = max(interval, POLL_INTERVAL_MIN)
+                return counter
+
+            if timeout is not None and time.time() - start > timeout:
+                logger.debug('timeout while waiting for events')
+                self._poll_interval = interval
+                return counter
+
+            time.sleep(interval)
+            interval = min(2 * interval, POLL_INTERVAL_MAX)
+            first = False
+
+    def readTimestampDirectories(self, n=512):
+        '''
+        Returns the timestamps of n events of every board.
+        '''
+        cycles = [('blockReadD32', [b.base_address + TIMESTAMP_DIRECTORY,
+                                    2 * n]) for b in self.boards]
+
+        timestamps = []
+
+        for ts in execute(self.vme, cycles):
+            high = np.asarray(ts[::2]).astype(np.uint64)
+            low = np.asarray(ts[1::2]).astype(np.uint64)
+            timestamps.append((high << np.uint64(32)) | low)
+
+        return timestamps
+
+    def readData(self, adc, page_size, n_events):
+        '''
+        Reads n_events events of adc from every board in one batch.
+
+        Returns a list with one (n_events, page_size) array per board.
+        '''
+        n_samples = page_size * n_events
+
+        if n_samples > MAX_NOF_SAMPLES:
+            raise IndexError('samples out of range of adc memory')
+
+        cycles = []
+        reads = []
+
+        for i, board in enumerate(self.boards):
+            address = board.base_address + ADC_OFFSET[adc]
+
+            for offset in range(0, n_samples, MAX_SAMPLES_PER_PAGE):
+                page = offset // MAX_SAMPLES_PER_PAGE
+                n = min(n_samples - offset, MAX_SAMPLES_PER_PAGE)
+
+                cycles.append(('singleWriteD32',
+                               [board.base_address + ADC_MEMORY_PAGE, page]))
+                cycles.append(('blockReadD16', [address, n]))
+                reads.append((i, len(cycles) - 1))
+
+        msg = 'read {0} events from adc {1} of {2} boards'
+        logger.debug(msg.format(n_events, adc, len(self.boards)))
+
+        results = execute(self.vme, cycles)
+
+        chunks = [[] for b in self.boards]
+        for i, index in reads:
+            chunks[i].append(np.asarray(results[index]))
+
+        return [np.concatenate(c).reshape(n_events, page_size)
+                for c in chunks]
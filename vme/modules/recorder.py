@@ -0,0 +1,471 @@
+'''
+vme/modules/recorder.py
+-----------------------
+
+Recording and replay of VME bridge transactions.
+
+RecordingBridge wraps a bridge (e.g. v2718) and logs every cycle to a
+compact binary file. ReplayBridge reads such a log and answers the same
+sequence of cycles with the recorded responses, either at full speed or
+with the original timing, so module code can be profiled without
+hardware.
+
+Log format: MAGIC followed by records of
+
+    op (B) | width (B) | status (B) | address (I) | count (I)
+    | start (d) | duration (d) | payload
+
+Times are in s relative to the start of the recording. The payload of
+reads and writes are count values of the given width (in bits). Other
+calls (IRQ, pulser, ...) and errors carry a JSON payload of count bytes.
+multiRead/multiWrite are logged as single cycles. A cycle of a multiRead
+answered with the default value is logged as failed; a multiRead or
+multiWrite raising an exception is logged as one failed cycle at its
+first address, so the replay raises at the same call.
+'''
+
+import json
+import time
+import struct
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+MAGIC = b'VMEREC1\n'
+
+RECORD = struct.Struct('<BBBIIdd')
+
+# operations
+SINGLE_READ = 1
+SINGLE_WRITE = 2
+BLOCK_READ = 3
+CALL = 4
+
+OPS = {SINGLE_READ: 'single read',
+       SINGLE_WRITE: 'single write',
+       BLOCK_READ: 'block read',
+       CALL: 'call'}
+
+# status
+OK = 0
+ERROR = 1
+
+DTYPES = {16: np.dtype('<u2'), 32: np.dtype('<u4')}
+
+# default passed to multiRead by the recorder, marks failed cycles
+_FAILED = -1
+
+
+class ReplayError(IOError):
+    '''
+    Raised by ReplayBridge if the cycles differ from the recording.
+    '''
+    pass
+
+
+class ReplayedError(IOError):
+    '''
+    Raised by ReplayBridge where the recorded cycle failed.
+
+    error_type holds the name of the original exception.
+    '''
+    def __init__(self, error_type, msg):
+        super(ReplayedError, self).__init__('{0}: {1}'.format(error_type,
+                                                              msg))
+        self.error_type = error_type
+
+
+class RecordingBridge(object):
+    '''
+    Wraps a bridge and logs all cycles to filename.
+    '''
+
+    def __init__(self, vme, filename):
+        self.vme = vme
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC)
+        self.start = time.time()
+
+        logger.debug('recording bridge cycles to {0}'.format(filename))
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def _write(self, op, width, status, address, start, duration,
+               payload=b''):
+        if isinstance(payload, np.ndarray):
+            count = len(payload)
+            payload = payload.astype(DTYPES[width]).tobytes()
+        else:
+            count = len(payload)
+
+        self.file.write(RECORD.pack(op, width, status, address, count,
+                                    start - self.start, duration))
+        self.file.write(payload)
+
+    def _record(self, op, width, address, func, args, data=None):
+        start = time.time()
+
+        try:
+            result = func(*args)
+        except Exception as e:
+            msg = json.dumps([type(e).__name__, str(e)]).encode('utf-8')
+            self._write(op, width, ERROR, address, start,
+                        time.time() - start, msg)
+            raise
+
+        duration = time.time() - start
+
+        if op == SINGLE_WRITE:
+            payload = np.array([data])
+        elif op == SINGLE_READ:
+            payload = np.array([result])
+        else:
+            payload = np.asarray(result).ravel()
+
+        self._write(op, width, OK, address, start, duration, payload)
+
+        return result
+
+    def _call(self, method, *args):
+        start = time.time()
+        info = {'method': method, 'args': [int(a) for a in args]}
+
+        try:
+            result = getattr(self.vme, method)(*args)
+        except Exception as e:
+            info['error'] = [type(e).__name__, str(e)]
+            self._write(CALL, 0, ERROR, 0, start, time.time() - start,
+                        json.dumps(info).encode('utf-8'))
+            raise
+
+        if result is not None:
+            info['result'] = int(result)
+
+        self._write(CALL, 0, OK, 0, start, time.time() - start,
+                    json.dumps(info).encode('utf-8'))
+
+        return result
+
+    def singleReadD32(self, address):
+        return self._record(SINGLE_READ, 32, address,
+                            self.vme.singleReadD32, (address,))
+
+    def singleReadD16(self, address):
+        return self._record(SINGLE_READ, 16, address,
+                            self.vme.singleReadD16, (address,))
+
+    def singleWriteD32(self, address, data):
+        self._record(SINGLE_WRITE, 32, address, self.vme.singleWriteD32,
+                     (address, data), data)
+
+    def singleWriteD16(self, address, data):
+        self._record(SINGLE_WRITE, 16, address, self.vme.singleWriteD16,
+                     (address, data), data)
+
+    def blockReadD32(self, address, nsamples):
+        return self._record(BLOCK_READ, 32, address, self.vme.blockReadD32,
+                            (address, nsamples))
+
+    def blockReadD16(self, address, nsamples):
+        return self._record(BLOCK_READ, 16, address, self.vme.blockReadD16,
+                            (address, nsamples))
+
+    def _failed(self, op, width, address, start, e):
+        msg = json.dumps([type(e).__name__, str(e)]).encode('utf-8')
+        self._write(op, width, ERROR, address, start, time.time() - start,
+                    msg)
+
+    def _multiRead(self, width, func, addresses, default):
+        start = time.time()
+
+        try:
+            values = func(addresses, None if default is None else _FAILED)
+        except Exception as e:
+            self._failed(SINGLE_READ, width, addresses[0], start, e)
+            raise
+
+        duration = (time.time() - start) / max(len(addresses), 1)
+
+        for i, (address, value) in enumerate(zip(addresses, values)):
+            if value == _FAILED:
+                msg = json.dumps(['BusError', 'bus error at {0:#x}'.format(
+                    address)]).encode('utf-8')
+                self._write(SINGLE_READ, width, ERROR, address,
+                            start + i * duration, duration, msg)
+            else:
+                self._write(SINGLE_READ, width, OK, address,
+                            start + i * duration, duration,
+                            np.array([value]))
+
+        return [default if value == _FAILED else value for value in values]
+
+    def _multiWrite(self, width, func, addresses, data):
+        start = time.time()
+
+        try:
+            func(addresses, data)
+        except Exception as e:
+            self._failed(SINGLE_WRITE, width, addresses[0], start, e)
+            raise
+
+        duration = (time.time() - start) / max(len(addresses), 1)
+
+        for i, (address, value) in enumerate(zip(addresses, data)):
+            self._write(SINGLE_WRITE, width, OK, address,
+                        start + i * duration, duration, np.array([value]))
+
+    def multiReadD32(self, addresses, default=None):
+        return self._multiRead(32, self.vme.multiReadD32, addresses, default)
+
+    def multiReadD16(self, addresses, default=None):
+        return self._multiRead(16, self.vme.multiReadD16, addresses, default)
+
+    def multiWriteD32(self, addresses, data):
+        self._multiWrite(32, self.vme.multiWriteD32, addresses, data)
+
+    def multiWriteD16(self, addresses, data):
+        self._multiWrite(16, self.vme.multiWriteD16, addresses, data)
+
+    def configureOutput(self, output_select,
+                        output_polarity, led_polarity, source):
+        self._call('configureOutput', output_select, output_polarity,
+                   led_polarity, source)
+
+    def enableIRQ(self, mask, enable=True):
+        self._call('enableIRQ', mask, enable)
+
+    def checkIRQ(self):
+        return self._call('checkIRQ')
+
+    def waitForIRQ(self, mask, timeout):
+        self._call('waitForIRQ', mask, timeout)
+
+    def IACKCycle(self, irq_level):
+        return self._call('IACKCycle', irq_level)
+
+    def startPulser(self, pulser):
+        self._call('startPulser', pulser)
+
+    def stopPulser(self, pulser):
+        self._call('stopPulser', pulser)
+
+    def configurePulser(self, pulser, period, width, time_unit,
+                        n_pulses, start_signal, reset_signal):
+        self._call('configurePulser', pulser, period, width, time_unit,
+                   n_pulses, start_signal, reset_signal)
+
+
+def read_log(filename):
+    '''
+    Reads a log written by RecordingBridge.
+
+    Returns a list of (op, width, status, address, start, duration,
+    payload) tuples. Read and write payloads are arrays (views of the
+    file contents), the others decoded JSON.
+    '''
+    with open(filename, 'rb') as f:
+        content = f.read()
+
+    if not content.startswith(MAGIC):
+        raise ReplayError('{0} is not a bridge log'.format(filename))
+
+    records = []
+    pos = len(MAGIC)
+
+    while pos < len(content):
+        op, width, status, address, count, start, duration = \
+            RECORD.unpack_from(content, pos)
+        pos += RECORD.size
+
+        if op == CALL or status == ERROR:
+            payload = json.loads(content[pos:pos + count].decode('utf-8'))
+            pos += count
+        else:
+            dtype = DTYPES[width]
+            payload = np.frombuffer(content, dtype=dtype, count=count,
+                                    offset=pos)
+            pos += count * dtype.itemsize
+
+        records.append((op, width, status, address, start, duration,
+                        payload))
+
+    return records
+
+
+class ReplayBridge(object):
+    '''
+    Answers cycles with the responses of a recorded log.
+
+    The cycles have to come in the recorded order. With strict=True
+    (default) every cycle is checked against the recording and a
+    ReplayError is raised on a difference. With realtime=True each
+    cycle returns no earlier than in the recording (relative to the
+    first cycle), otherwise the log is replayed at full speed.
+    '''
+
+    def __init__(self, filename, realtime=False, strict=True):
+        self.records = read_log(filename)
+        self.realtime = realtime
+        self.strict = strict
+
+        self.position = 0
+        self._start = None
+
+        logger.debug('replaying {0} cycles'.format(len(self.records)))
+
+    def remaining(self):
+        return len(self.records) - self.position
+
+    def summary(self):
+        '''
+        Returns number of cycles, bytes and recorded bus time per op.
+        '''
+        summary = {}
+
+        for op, width, status, address, start, duration, payload in \
+                self.records:
+            n, n_bytes, t = summary.get(OPS[op], (0, 0, 0.))
+            if isinstance(payload, np.ndarray):
+                n_bytes += payload.nbytes
+            summary[OPS[op]] = (n + 1, n_bytes, t + duration)
+
+        return summary
+
+    def _next(self, op, width, address):
+        if self.position >= len(self.records):
+            raise ReplayError('end of recording reached')
+
+        record = self.records[self.position]
+        self.position += 1
+
+        r_op, r_width, status, r_address, start, duration, payload = record
+
+        if self.strict and (r_op, r_width, r_address) != (op, width,
+                                                          address):
+            msg = 'cycle {0}: expected {1} D{2} at {3:#x}, got {4} D{5} ' \
+                  'at {6:#x}'
+            raise ReplayError(msg.format(self.position - 1, OPS[r_op],
+                                         r_width, r_address, OPS[op], width,
+                                         address))
+
+        if self.realtime:
+            if self._start is None:
+                self._start = time.time() - start
+
+            delay = self._start + start + duration - time.time()
+
+            if delay > 0:
+                time.sleep(delay)
+
+        if status == ERROR:
+            if r_op == CALL:
+                raise ReplayedError(*payload['error'])
+
+            raise ReplayedError(*payload)
+
+        return payload
+
+    def _read(self, width, address):
+        return int(self._next(SINGLE_READ, width, address)[0])
+
+    def _writeCycle(self, width, address, data):
+        payload = self._next(SINGLE_WRITE, width, address)
+
+        if self.strict and int(payload[0]) != int(data) & (2**width - 1):
+            msg = 'write to {0:#x}: recorded {1:#x}, got {2:#x}'
+            raise ReplayError(msg.format(address, int(payload[0]), data))
+
+    def _block(self, width, address, nsamples):
+        payload = self._next(BLOCK_READ, width, address)
+
+        if self.strict and len(payload) != nsamples:
+            msg = 'block read at {0:#x}: recorded {1} samples, got {2}'
+            raise ReplayError(msg.format(address, len(payload), nsamples))
+
+        return payload.copy()
+
+    def _call(self, method, *args):
+        payload = self._next(CALL, 0, 0)
+
+        if self.strict and payload['method'] != method:
+            msg = 'expected call {0}, got {1}'
+            raise ReplayError(msg.format(payload['method'], method))
+
+        return payload.get('result')
+
+    def singleReadD32(self, address):
+        return self._read(32, address)
+
+    def singleReadD16(self, address):
+        return self._read(16, address)
+
+    def singleWriteD32(self, address, data):
+        self._writeCycle(32, address, data)
+
+    def singleWriteD16(self, address, data):
+        self._writeCycle(16, address, data)
+
+    def blockReadD32(self, address, nsamples):
+        return self._block(32, address, nsamples)
+
+    def blockReadD16(self, address, nsamples):
+        return self._block(16, address, nsamples)
+
+    def _multiRead(self, width, addresses, default):
+        values = []
+
+        for address in addresses:
+            try:
+                values.append(self._read(width, address))
+            except ReplayedError:
+                if default is None:
+                    raise
+
+                values.append(default)
+
+        return values
+
+    def multiReadD32(self, addresses, default=None):
+        return self._multiRead(32, addresses, default)
+
+    def multiReadD16(self, addresses, default=None):
+        return self._multiRead(16, addresses, default)
+
+    def multiWriteD32(self, addresses, data):
+        for address, value in zip(addresses, data):
+            self._writeCycle(32, address, value)
+
+    def multiWriteD16(self, addresses, data):
+        for address, value in zip(addresses, data):
+            self._writeCycle(16, address, value)
+
+    def configureOutput(self, output_select,
+                        output_polarity, led_polarity, source):
+        self._call('configureOutput')
+
+    def enableIRQ(self, mask, enable=True):
+        self._call('enableIRQ')
+
+    def checkIRQ(self):
+        return self._call('checkIRQ')
+
+    def waitForIRQ(self, mask, timeout):
+        self._call('waitForIRQ')
+
+    def IACKCycle(self, irq_level):
+        return self._call('IACKCycle')
+
+    def startPulser(self, pulser):
+        self._call('startPulser')
+
+    def stopPulser(self, pulser):
+        self._call('stopPulser')
+
+    def configurePulser(self, pulser, period, width, time_unit,
+                        n_pulses, start_signal, reset_signal):
+        self._call('configurePulser')
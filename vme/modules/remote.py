@@ -0,0 +1,311 @@
+'''
+vme/modules/remote.py
+---------------------
+
+Shares one VME bridge among several processes.
+
+BridgeServer owns the bridge (e.g. v2718) and executes the cycles sent
+by its clients one request at a time. RemoteBridge implements the v2718
+interface on top of it and can be passed as vme to SIS3302 or CAEN895.
+
+Every request carries a list of cycles, so the multiRead/multiWrite
+calls cost a single round trip. Block data is returned as raw array
+buffers (see vme.daq.framing). Enum arguments (PulserSelect, ...) are
+transmitted as ints.
+'''
+
+import socket
+import threading
+
+import numpy as np
+
+from ..daq.framing import send_frame, recv_frame
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+DEFAULT_PORT = 50718
+
+# bridge methods which may be called remotely
+METHODS = ['singleReadD32', 'singleReadD16',
+           'singleWriteD32', 'singleWriteD16',
+           'blockReadD32', 'blockReadD16',
+           'multiReadD32', 'multiReadD16',
+           'multiWriteD32', 'multiWriteD16',
+           'configureOutput',
+           'enableIRQ', 'checkIRQ', 'waitForIRQ', 'IACKCycle',
+           'startPulser', 'stopPulser', 'configurePulser']
+
+
+class RemoteError(IOError):
+    '''
+    Raised by RemoteBridge if a cycle failed on the server.
+
+    error_type holds the name of the exception raised on the server
+    (e.g. VME_Error for a bus error).
+    '''
+    def __init__(self, error_type, msg):
+        super(RemoteError, self).__init__('{0}: {1}'.format(error_type, msg))
+        self.error_type = error_type
+
+
+def _plain(value):
+    '''
+    Converts numpy scalars and lists thereof for the JSON description.
+    '''
+    if isinstance(value, np.generic):
+        return value.item()
+
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+
+    return value
+
+
+class BridgeServer(object):
+    '''
+    Executes cycles of RemoteBridge clients on a local bridge.
+
+    Requests of different clients are serialized, the cycles of one
+    request are executed without interruption. Note that waitForIRQ
+    blocks the bridge for all clients until it returns.
+    '''
+
+    def __init__(self, vme, host='127.0.0.1', port=DEFAULT_PORT):
+        self.vme = vme
+        self._lock = threading.Lock()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(5)
+        self.address = self.sock.getsockname()
+
+        logger.info('bridge server listening on {0}'.format(self.address))
+
+    def serve_forever(self):
+        while True:
+            try:
+                sock, address = self.sock.accept()
+            except socket.error:
+                break
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            logger.info('new client {0}'.format(address))
+
+            t = threading.Thread(target=self._serve, args=(sock, address))
+            t.daemon = True
+            t.start()
+
+    def start(self):
+        '''
+        Serves clients in a background thread.
+        '''
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+        self.sock.close()
+
+    def execute(self, cycles):
+        '''
+        Executes a list of (method, args, kwargs) cycles.
+
+        Returns the list of results and the arrays to send. Execution
+        stops at the first failing cycle, the error is returned as
+        (index, exception type, message).
+        '''
+        results = []
+        arrays = {}
+        error = None
+
+        with self._lock:
+            for i, (method, args, kwargs) in enumerate(cycles):
+                if method not in METHODS:
+                    error = (i, 'ValueError',
+                             'unknown method {0}'.format(method))
+                    break
+
+                try:
+                    result = getattr(self.vme, method)(*args, **kwargs)
+                except Exception as e:
+                    error = (i, type(e).__name__, str(e))
+                    break
+
+                if isinstance(result, np.ndarray):
+                    arrays[str(i)] = result
+                    result = None
+
+                results.append(_plain(result))
+
+        return results, arrays, error
+
+    def _serve(self, sock, address):
+        try:
+            while True:
+                seq, meta, arrays = recv_frame(sock)
+                results, arrays, error = self.execute(meta['cycles'])
+                send_frame(sock, seq, arrays, {'results': results,
+                                               'error': error})
+        except socket.error:
+            logger.info('client {0} disconnected'.format(address))
+        finally:
+            sock.close()
+
+
+class RemoteBridge(object):
+    '''
+    Client of a BridgeServer, implements the v2718 interface.
+    '''
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.seq = 0
+        self._lock = threading.Lock()
+
+        logger.debug('connected to bridge server {0}:{1}'.format(host, port))
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def execute(self, cycles):
+        '''
+        Executes a list of (method, args) or (method, args, kwargs)
+        cycles in one request and returns their results.
+
+        Raises RemoteError if one of the cycles failed.
+        '''
+        cycles = [(c[0], _plain(list(c[1])), c[2] if len(c) > 2 else {})
+                  for c in cycles]
+
+        with self._lock:
+            self.seq += 1
+            send_frame(self.sock, self.seq, {}, {'cycles': cycles})
+            seq, meta, arrays = recv_frame(self.sock)
+
+        if meta['error'] is not None:
+            index, error_type, msg = meta['error']
+            raise RemoteError(error_type, msg)
+
+        results = meta['results']
+
+        for key, data in arrays.items():
+            results[int(key)] = data
+
+        return results
+
+    def _call(self, method, *args):
+        return self.execute([(method, args)])[0]
+
+    def singleReadD32(self, address):
+        return self._call('singleReadD32', address)
+
+    def singleReadD16(self, address):
+        return self._call('singleReadD16', address)
+
+    def blockReadD32(self, address, nsamples):
+        return self._call('blockReadD32', address, nsamples)
+
+    def blockReadD16(self, address, nsamples):
+        return self._call('blockReadD16', address, nsamples)
+
+    def singleWriteD32(self, address, data):
+        self._call('singleWriteD32', address, data)
+
+    def singleWriteD16(self, address, data):
+        self._call('singleWriteD16', address, data)
+
+    def multiReadD32(self, addresses, default=None):
+        return self._call('multiReadD32', list(addresses), default)
+
+    def multiReadD16(self, addresses, default=None):
+        return self._call('multiReadD16', list(addresses), default)
+
+    def multiWriteD32(self, addresses, data):
+        self._call('multiWriteD32', list(addresses), list(data))
+
+    def multiWriteD16(self, addresses, data):
+        self._call('multiWriteD16', list(addresses), list(data))
+
+    def configureOutput(self, output_select,
+                        output_polarity, led_polarity, source):
+        self._call('configureOutput', int(output_select),
+                   int(output_polarity), int(led_polarity), int(source))
+
+    def enableIRQ(self, mask, enable=True):
+        self._call('enableIRQ', mask, enable)
+
+    def checkIRQ(self):
+        return self._call('checkIRQ')
+
+    def waitForIRQ(self, mask, timeout):
+        self._call('waitForIRQ', mask, timeout)
+
+    def IACKCycle(self, irq_level):
+        return self._call('IACKCycle', irq_level)
+
+    def startPulser(self, pulser):
+        self._call('startPulser', int(pulser))
+
+    def stopPulser(self, pulser):
+        self._call('stopPulser', int(pulser))
+
+    def configurePulser(self, pulser, period, width, time_unit,
+                        n_pulses, start_signal, reset_signal):
+        self._call('configurePulser', int(pulser), period, width,
+                   int(time_unit), n_pulses, int(start_signal),
+                   int(reset_signal))
+
+
+def main():
+    import argparse
+
+    d = """
+    VME Bridge Server
+    --------------------------------------------------------------------------
+
+    Shares a V2718 bridge with other processes.
+    """
+
+    parser = argparse.ArgumentParser(description=d)
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='interface to listen on')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT,
+                        help='port to listen on')
+    parser.add_argument('-v', '--verbosity',
+                        type=int,
+                        default=20,
+                        choices=[10, 20, 30, 40, 50],
+                        help='set threshold for messages shown on screen (10 everything, 50 only critical messages)')
+
+    args = parser.parse_args()
+
+    fmt = "%(name)s %(levelname)s: %(message)s"
+    level = logging.getLevelName(args.verbosity)
+    logging.basicConfig(format=fmt, level=level)
+
+    from .caen2718 import v2718
+
+    server = BridgeServer(v2718(), args.host, args.port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
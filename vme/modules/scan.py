@@ -0,0 +1,103 @@
+'''
+vme/modules/scan.py
+-------------------
+
+Finds SIS3302 and CAEN895 modules in a crate.
+
+The identification registers of all candidate base addresses are read
+in batches (multiRead), bus errors count as empty slots. The bridge
+functions do not select the address modifier, so the A24 candidates
+are probed as the lower 16 MB of the address space the bridge uses.
+'''
+
+from . import sis3302
+from . import caen895
+from .sis3302 import SIS3302
+from .caen895 import CAEN895
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# returned by multiRead for cycles ending with a bus error
+EMPTY = -1
+
+# the SIS3302 occupies 128 MB of A32
+SIS3302_BASES = list(range(0, 0x100000000, 0x08000000))
+
+# A24 (bits 23-16) and A32 (bits 31-24) base addresses
+CAEN895_BASES = (list(range(0x10000, 0x1000000, 0x10000)) +
+                 list(range(0x1000000, 0x100000000, 0x1000000)))
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def find_sis3302(vme, bases=None, batch=64):
+    '''
+    Returns the base addresses of all SIS3302 among bases.
+    '''
+    if bases is None:
+        bases = SIS3302_BASES
+
+    found = []
+
+    for chunk in _batches(list(bases), batch):
+        modids = vme.multiReadD32([b + sis3302.MODID for b in chunk],
+                                  default=EMPTY)
+
+        for base, modid in zip(chunk, modids):
+            if modid != EMPTY and modid >> 16 == sis3302.MODULE_NUMBER:
+                msg = 'found {0} at {1:#010x}'
+                logger.info(msg.format(sis3302.decode_module_id(modid),
+                                       base))
+                found.append(base)
+
+    return found
+
+
+def find_caen895(vme, bases=None, batch=64):
+    '''
+    Returns the base addresses of all CAEN895 among bases.
+    '''
+    if bases is None:
+        bases = CAEN895_BASES
+
+    found = []
+
+    for chunk in _batches(list(bases), batch):
+        addresses = []
+        for b in chunk:
+            addresses.extend([b + caen895.FIXED_CODE,
+                              b + caen895.MODULE_TYPE])
+
+        values = vme.multiReadD16(addresses, default=EMPTY)
+
+        for base, fixed, mod_type in zip(chunk, values[::2], values[1::2]):
+            if fixed == caen895.V895_FIXED_CODE and \
+                    mod_type == caen895.V895_MODULE_TYPE:
+                logger.info('found CAEN895 at {0:#010x}'.format(base))
+                found.append(base)
+
+    return found
+
+
+def scan_crate(vme, sis3302_bases=None, caen895_bases=None, batch=64):
+    '''
+    Scans the crate and returns driver objects for all modules found.
+
+    The SIS3302 are attached without reset (see SIS3302).
+
+    Returns a list of (base address, module name, driver) tuples.
+    '''
+    modules = []
+
+    for base in find_sis3302(vme, sis3302_bases, batch):
+        modules.append((base, 'sis3302', SIS3302(vme, base, reset=False)))
+
+    for base in find_caen895(vme, caen895_bases, batch):
+        modules.append((base, 'v895', CAEN895(vme, base)))
+
+    return sorted(modules, key=lambda m: m[0])
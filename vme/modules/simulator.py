@@ -0,0 +1,635 @@
+'''
+vme/modules/simulator.py
+------------------------
+
+Simulated VME bridge and modules for testing without hardware.
+
+SimulatedBridge implements the v2718 interface including the pulsers.
+Modules (SimulatedSIS3302, SimulatedCAEN895) are added at a base
+address; cycles to addresses without module raise BusError. The pulser
+output is connected to the trigger input of all simulated SIS3302.
+
+Bus timing can be modeled with a fixed time per cycle and a bandwidth
+for block transfers, both are zero/unlimited by default.
+'''
+
+import time
+import ctypes
+
+import numpy as np
+
+from . import sis3302
+from . import caen895
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# tick (in s) of the cvTimeUnits of the V2718 pulser
+PULSER_TICKS = [25e-9, 1.6e-6, 410e-6, 104e-3]
+
+SIS3302_MODID = 0x33021402
+
+# inverse of SIS_PAGE_SIZE
+PAGE_SIZES = dict((v, k) for k, v in sis3302.SIS_PAGE_SIZE.items())
+
+# offsets of the register blocks of the ADC pairs
+ADC_GROUPS = [0x02000000, 0x02800000, 0x03000000, 0x03800000]
+
+
+class BusError(IOError):
+    '''
+    Raised for cycles to addresses no simulated module responds to.
+    '''
+    pass
+
+
+class Pulser(object):
+    '''
+    Model of one V2718 pulser.
+    '''
+
+    def __init__(self):
+        self.period = None
+        self.n_pulses = 0
+        self.start = None
+
+    def configure(self, period, width, time_unit, n_pulses):
+        self.period = period * PULSER_TICKS[int(time_unit)]
+        self.n_pulses = n_pulses
+
+    def pulses(self, t0, t1):
+        '''
+        Returns the times of the pulses in [t0, t1).
+        '''
+        if self.start is None or not self.period:
+            return np.zeros(0)
+
+        first = max(int(np.ceil((t0 - self.start) / self.period)), 0)
+        last = int(np.ceil((t1 - self.start) / self.period))
+
+        if self.n_pulses > 0:
+            last = min(last, self.n_pulses)
+
+        if last <= first:
+            return np.zeros(0)
+
+        return self.start + self.period * np.arange(first, last)
+
+
+class SimulatedSIS3302(object):
+    '''
+    Register and memory model of a SIS3302.
+
+    Events are triggered by the pulsers of the bridge or by KEY_START
+    while the sampling logic is armed. ADC memory reads return a pulse
+    on top of a baseline with noise (or the incrementing pattern in test
+    data mode), the page of every event is rotated by a random stop
+    address as in wrap page mode.
+
+    The baseline of each adc is shifted by a random channel offset and
+    by dac_gain ADC counts per offset dac step (relative to mid-scale).
+    '''
+    size = 0x08000000
+
+    def __init__(self, baseline=0x2000, amplitude=0x1000, noise=5.,
+                 seed=0, dac_gain=0.5, channel_spread=200.):
+        self.baseline = baseline
+        self.amplitude = amplitude
+        self.noise = noise
+        self.rng = np.random.RandomState(seed)
+
+        self.dac_gain = dac_gain
+        self.dac = np.repeat(sis3302.DAC_MAX // 2 + 1, 8)
+        self.dac_shift_register = 0
+        self.channel_offsets = np.random.RandomState(seed).normal(
+            0, channel_spread, 8)
+
+        self.bridge = None
+        self.reset()
+
+    def reset(self):
+        self.registers = {}
+        self.armed = False
+        self.arm_time = None
+        self.events = np.zeros(0)
+        self.starts = np.zeros(0)
+        self.timestamp_clear = time.time()
+        self.phases = np.zeros(0, dtype=np.int64)
+
+    # helpers
+
+    def _acquisition(self):
+        return self.registers.get(sis3302.ACQUISITION_CONTROL, 0)
+
+    def pageSize(self):
+        config = self.registers.get(sis3302.EVENT_CONFIG[1], 0)
+        return PAGE_SIZES[config & 0xf]
+
+    def maxEvents(self):
+        if self._acquisition() & sis3302.ACQ_ENABLE_MULTIEVENT:
+            return max(self.registers.get(sis3302.MAX_NOF_EVENT, 0), 1)
+
+        return 1
+
+    def update(self):
+        '''
+        Collects the triggers since arming.
+        '''
+        if not self.armed:
+            return
+
+        now = time.time()
+        pulses = [p.pulses(self.arm_time, now) for p in self.bridge.pulsers]
+        pulses.append(self.starts)
+        pulses = np.sort(np.concatenate(pulses))
+
+        self.events = pulses[:self.maxEvents()]
+
+        if len(self.events) == self.maxEvents():
+            self.armed = False
+
+        n = len(self.events)
+        if len(self.phases) < n:
+            page_size = self.pageSize()
+            new = self.rng.randint(0, page_size, n - len(self.phases))
+            self.phases = np.concatenate([self.phases, new])
+
+    def testData(self):
+        return bool(self.registers.get(sis3302.ADC_INPUT_MODE[1], 0) &
+                    0x10000)
+
+    def samples(self, adc, start, n):
+        '''
+        Returns n samples of adc starting at sample address start.
+        '''
+        if self.testData():
+            first = self.registers.get(sis3302.ADC_INPUT_MODE[1], 0) & 0xffff
+            return ((first + start + np.arange(n)) & 0xffff).astype('uint16')
+
+        page_size = self.pageSize()
+        address = start + np.arange(n)
+        event = address // page_size
+
+        phases = np.zeros(n, dtype=np.int64)
+        valid = event < len(self.phases)
+        phases[valid] = self.phases[event[valid]]
+
+        # chronological position in the event, pulse at 1/4 of the page
+        k = (address % page_size - phases) % page_size
+        t = (k - page_size // 4) / max(page_size / 64., 1.)
+        pulse = np.where(t >= 0, np.exp(-np.clip(t, 0, 50)), 0.)
+
+        data = (self.baseline + self.offset(adc) +
+                self.amplitude * pulse * valid +
+                self.rng.normal(0, self.noise, n))
+
+        return np.clip(data, 0, 0xffff).astype('uint16')
+
+    def listens(self, address):
+        '''
+        Returns (listening, master) for a broadcast write to address.
+        '''
+        setup = self.registers.get(sis3302.BROADCAST_SETUP, 0)
+        mask = sis3302.BROADCAST_ADDRESS_MASK
+
+        if not setup & sis3302.BROADCAST_ENABLE or \
+                (address & mask) != (setup & mask):
+            return False, False
+
+        return True, bool(setup & sis3302.BROADCAST_MASTER)
+
+    def offset(self, adc):
+        return (self.channel_offsets[adc - 1] + self.dac_gain *
+                (self.dac[adc - 1] - (sis3302.DAC_MAX // 2 + 1)))
+
+    # bus access
+
+    def read(self, offset, width):
+        self.update()
+
+        if offset == sis3302.MODID:
+            return SIS3302_MODID
+
+        if offset == sis3302.ACTUAL_EVENT_COUNTER:
+            return len(self.events)
+
+        if offset == sis3302.ACQUISITION_CONTROL:
+            status = 0x10000 if self.armed else 0
+            return self._acquisition() | status
+
+        return self.registers.get(offset, 0)
+
+    def write(self, offset, data, width, now=None):
+        # time of the cycle, the same for all modules of a broadcast
+        if now is None:
+            now = time.time()
+
+        if offset == sis3302.KEY_RESET:
+            self.reset()
+        elif offset == sis3302.KEY_ARM:
+            self.armed = True
+            self.arm_time = now
+            self.events = np.zeros(0)
+            self.starts = np.zeros(0)
+            self.phases = np.zeros(0, dtype=np.int64)
+        elif offset == sis3302.KEY_START:
+            if self.armed:
+                # with autostart the following events start by themselves
+                n = 1
+                if self._acquisition() & sis3302.ACQ_ENABLE_AUTOSTART:
+                    n = self.maxEvents() - len(self.starts)
+
+                self.starts = np.append(self.starts, np.repeat(now, n))
+        elif offset == sis3302.KEY_DISARM:
+            self.update()
+            self.armed = False
+        elif offset == sis3302.KEY_TIMESTAMP_CLR:
+            self.timestamp_clear = now
+        elif offset == sis3302.DAC_DATA:
+            self.dac_shift_register = data & sis3302.DAC_MAX
+        elif offset == sis3302.DAC_CONTROL_STATUS:
+            command = data & 0x3
+            dac = (data >> sis3302.DAC_SELECT_SHIFT) & 0x7
+
+            if command == sis3302.DAC_CMD_LOAD_DAC:
+                self.dac[dac] = self.dac_shift_register
+            elif command == sis3302.DAC_CMD_CLEAR:
+                self.dac[:] = 0
+        elif offset in (sis3302.ACQUISITION_CONTROL, sis3302.IRQ_CONTROL):
+            # J/K register
+            value = self.registers.get(offset, 0)
+            value |= data & 0xffff
+            value &= ~(data >> 16) & 0xffff
+            self.registers[offset] = value
+        elif offset >> 24 == 0x01:
+            # broadcast to all ADC groups
+            for group in ADC_GROUPS:
+                self.registers[group + (offset & 0xffffff)] = data
+        else:
+            self.registers[offset] = data
+
+    def blockRead(self, offset, n, width):
+        self.update()
+
+        if sis3302.TIMESTAMP_DIRECTORY <= offset < 0x20000:
+            ticks = ((self.events - self.timestamp_clear) *
+                     100e6).astype(np.uint64)
+            ts = np.zeros(2 * max(len(ticks), n // 2 + 1), dtype=np.uint32)
+            ts[:2 * len(ticks):2] = ticks >> np.uint64(32)
+            ts[1:2 * len(ticks):2] = ticks & np.uint64(0xffffffff)
+
+            first = (offset - sis3302.TIMESTAMP_DIRECTORY) // 4
+            return ts[first:first + n]
+
+        if offset >= sis3302.ADC_OFFSET[1]:
+            adc = (offset - sis3302.ADC_OFFSET[1]) // 0x800000 + 1
+            page = self.registers.get(sis3302.ADC_MEMORY_PAGE, 0)
+            start = (page * sis3302.MAX_SAMPLES_PER_PAGE +
+                     (offset & 0x7fffff) // 2)
+
+            if width == 16:
+                return self.samples(adc, start, n)
+
+            data = self.samples(adc, start, 2 * n).astype(np.uint32)
+            return data[::2] | (data[1::2] << 16)
+
+        for i, address in enumerate(sis3302.EVENT_DIRECTORY):
+            if address <= offset < address + 0x8000:
+                first = (offset - address) // 4
+                page_size = self.pageSize()
+                index = np.arange(first, first + n)
+                valid = index < len(self.events)
+
+                # next sample address after the event, wrap flag
+                entries = np.zeros(n, dtype=np.uint32)
+                stop = index[valid] * page_size + self.phases[index[valid]]
+                entries[valid] = (stop & 0x1ffffff) | (1 << 28)
+                return entries
+
+        return np.zeros(n, dtype='uint{0}'.format(width))
+
+
+class SimulatedCAEN895(object):
+    '''
+    Register model of a CAEN V895.
+    '''
+    size = 0x100
+
+    def __init__(self, version=0x0):
+        self.version = version
+        self.registers = {}
+        self.test_pulses = 0
+
+    def read(self, offset, width):
+        if offset == caen895.FIXED_CODE:
+            return caen895.V895_FIXED_CODE
+
+        if offset == caen895.MODULE_TYPE:
+            return caen895.V895_MODULE_TYPE
+
+        if offset == caen895.VERSION:
+            return self.version
+
+        return self.registers.get(offset, 0)
+
+    def write(self, offset, data, width):
+        if offset == caen895.TEST_PULSE:
+            self.test_pulses += 1
+
+        self.registers[offset] = data
+
+    def blockRead(self, offset, n, width):
+        raise BusError('block transfers not supported')
+
+
+class SimulatedBridge(object):
+    '''
+    Simulated V2718 bridge.
+
+    Parameters
+    ----------
+    cycle_time : float
+        Time in s every cycle takes.
+    bandwidth : float
+        Bandwidth of block transfers in bytes/s (None: unlimited).
+    '''
+
+    def __init__(self, cycle_time=0., bandwidth=None):
+        self.cycle_time = cycle_time
+        self.bandwidth = bandwidth
+
+        self.modules = []
+        self.pulsers = [Pulser(), Pulser()]
+        self.cycles = 0
+
+    def addModule(self, base_address, module):
+        module.bridge = self
+        self.modules.append((base_address, module))
+        self.modules.sort(key=lambda m: m[0])
+
+        return module
+
+    def _find(self, address):
+        for base, module in self.modules:
+            if base <= address < base + module.size:
+                return module, address - base
+
+        raise BusError('bus error at {0:#010x}'.format(address))
+
+    def _wait(self, n_bytes=0):
+        self.cycles += 1
+        delay = self.cycle_time
+
+        if self.bandwidth:
+            delay += float(n_bytes) / self.bandwidth
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def singleReadD32(self, address):
+        self._wait()
+        module, offset = self._find(address)
+        return module.read(offset, 32) & 0xffffffff
+
+    def singleReadD16(self, address):
+        self._wait()
+        module, offset = self._find(address)
+        return module.read(offset, 16) & 0xffff
+
+    def _broadcast(self, address, data):
+        '''
+        Delivers a broadcast write to all listening modules.
+
+        Returns False if no module listens to address.
+        '''
+        listeners = []
+        master = False
+
+        for base, module in self.modules:
+            if hasattr(module, 'listens'):
+                listening, is_master = module.listens(address)
+                if listening:
+                    listeners.append(module)
+                    master |= is_master
+
+        if not listeners:
+            return False
+
+        if not master:
+            msg = 'no broadcast master at {0:#010x}'
+            raise BusError(msg.format(address))
+
+        now = time.time()
+
+        for module in listeners:
+            module.write(address & ~sis3302.BROADCAST_ADDRESS_MASK, data, 32,
+                         now)
+
+        return True
+
+    def singleWriteD32(self, address, data):
+        self._wait()
+
+        if self._broadcast(address, data & 0xffffffff):
+            return
+
+        module, offset = self._find(address)
+        module.write(offset, data & 0xffffffff, 32)
+
+    def singleWriteD16(self, address, data):
+        self._wait()
+        module, offset = self._find(address)
+        module.write(offset, data & 0xffff, 16)
+
+    def blockReadD32(self, address, nsamples):
+        self._wait(4 * nsamples)
+        module, offset = self._find(address)
+        return module.blockRead(offset, nsamples, 32).astype(np.uint32)
+
+    def blockReadD16(self, address, nsamples):
+        self._wait(2 * nsamples)
+        module, offset = self._find(address)
+        return module.blockRead(offset, nsamples, 16).astype(np.uint16)
+
+    def _multiRead(self, read, addresses, default):
+        values = []
+
+        for address in addresses:
+            try:
+                values.append(read(address))
+            except BusError:
+                if default is None:
+                    raise
+
+                values.append(default)
+
+        return values
+
+    def multiReadD32(self, addresses, default=None):
+        return self._multiRead(self.singleReadD32, addresses, default)
+
+    def multiReadD16(self, addresses, default=None):
+        return self._multiRead(self.singleReadD16, addresses, default)
+
+    def multiWriteD32(self, addresses, data):
+        for address, value in zip(addresses, data):
+            self.singleWriteD32(address, value)
+
+    def multiWriteD16(self, addresses, data):
+        for address, value in zip(addresses, data):
+            self.singleWriteD16(address, value)
+
+    def configureOutput(self, output_select,
+                        output_polarity, led_polarity, source):
+        self._wait()
+
+    def enableIRQ(self, mask, enable=True):
+        self._wait()
+
+    def checkIRQ(self):
+        self._wait()
+        return 0
+
+    def waitForIRQ(self, mask, timeout):
+        time.sleep(timeout / 1000.)
+
+    def IACKCycle(self, irq_level):
+        self._wait()
+        return 0
+
+    def startPulser(self, pulser):
+        self._wait()
+        self.pulsers[int(pulser)].start = time.time()
+
+    def stopPulser(self, pulser):
+        self._wait()
+        p = self.pulsers[int(pulser)]
+
+        if p.start is not None and p.period:
+            # keep the pulses already sent
+            n = int((time.time() - p.start) / p.period) + 1
+            p.n_pulses = n if p.n_pulses == 0 else min(n, p.n_pulses)
+
+    def configurePulser(self, pulser, period, width, time_unit,
+                        n_pulses, start_signal, reset_signal):
+        self._wait()
+        self.pulsers[int(pulser)].configure(period, width, time_unit,
+                                            n_pulses)
+
+
+class SimulatedLibrary(object):
+    '''
+    Stand-in for libCAENVME (the CAENVME_* functions) on top of a
+    SimulatedBridge, to run v2718 with the ctypes backend without
+    hardware:
+
+        lib = CAENVMELib(SimulatedLibrary(bridge))
+        vme = v2718(backend=lib)
+
+    Data is passed through the same pointers as with the real library.
+    Unlike the real library, the calls hold the GIL.
+    '''
+
+    def __init__(self, bridge):
+        from . import caenvme_ctypes
+        self.cv = caenvme_ctypes
+        self.bridge = bridge
+
+    def _run(self, func, *args):
+        try:
+            func(*args)
+        except BusError:
+            return self.cv.cvBusError
+
+        return self.cv.cvSuccess
+
+    @staticmethod
+    def _store(pointer, value, ctype):
+        ctypes.cast(pointer, ctypes.POINTER(ctype))[0] = value
+
+    @staticmethod
+    def _load(pointer, ctype):
+        return ctypes.cast(pointer, ctypes.POINTER(ctype))[0]
+
+    def CAENVME_Init(self, board_type, link, board_number, handle):
+        self._store(handle, 0, ctypes.c_int32)
+        return self.cv.cvSuccess
+
+    def CAENVME_End(self, handle):
+        return self.cv.cvSuccess
+
+    def CAENVME_ReadCycle(self, handle, address, data, modifier, width):
+        def read():
+            if width.value == self.cv.cvD32:
+                value = self.bridge.singleReadD32(address.value)
+                self._store(data, value, ctypes.c_uint32)
+            else:
+                value = self.bridge.singleReadD16(address.value)
+                self._store(data, value, ctypes.c_uint16)
+
+        return self._run(read)
+
+    def CAENVME_WriteCycle(self, handle, address, data, modifier, width):
+        def write():
+            if width.value == self.cv.cvD32:
+                self.bridge.singleWriteD32(address.value,
+                                           self._load(data, ctypes.c_uint32))
+            else:
+                self.bridge.singleWriteD16(address.value,
+                                           self._load(data, ctypes.c_uint16))
+
+        return self._run(write)
+
+    def CAENVME_BLTReadCycle(self, handle, address, buffer, size, modifier,
+                             width, count):
+        def read():
+            if width.value == self.cv.cvD32:
+                values = self.bridge.blockReadD32(address.value,
+                                                  size.value // 4)
+            else:
+                values = self.bridge.blockReadD16(address.value,
+                                                  size.value // 2)
+
+            ctypes.memmove(buffer, values.ctypes.data, values.nbytes)
+            self._store(count, values.nbytes, ctypes.c_int)
+
+        return self._run(read)
+
+    def CAENVME_SetOutputConf(self, handle, output_select, output_polarity,
+                              led_polarity, source):
+        return self._run(self.bridge.configureOutput, output_select.value,
+                         output_polarity.value, led_polarity.value,
+                         source.value)
+
+    def CAENVME_IRQEnable(self, handle, mask):
+        return self._run(self.bridge.enableIRQ, mask.value)
+
+    def CAENVME_IRQDisable(self, handle, mask):
+        return self._run(self.bridge.enableIRQ, mask.value, False)
+
+    def CAENVME_IRQCheck(self, handle, mask):
+        self._store(mask, self.bridge.checkIRQ(), ctypes.c_ubyte)
+        return self.cv.cvSuccess
+
+    def CAENVME_IRQWait(self, handle, mask, timeout):
+        self.bridge.waitForIRQ(mask.value, timeout.value)
+        return self.cv.cvTimeoutError
+
+    def CAENVME_IACKCycle(self, handle, irq_level, vector, width):
+        self._store(vector, self.bridge.IACKCycle(irq_level.value),
+                    ctypes.c_uint32)
+        return self.cv.cvSuccess
+
+    def CAENVME_StartPulser(self, handle, pulser):
+        return self._run(self.bridge.startPulser, pulser.value)
+
+    def CAENVME_StopPulser(self, handle, pulser):
+        return self._run(self.bridge.stopPulser, pulser.value)
+
+    def CAENVME_SetPulserConf(self, handle, pulser, period, width, time_unit,
+                              n_pulses, start_signal, reset_signal):
+        return self._run(self.bridge.configurePulser, pulser.value,
+                         period.value, width.value, time_unit.value,
+                         n_pulses.value, start_signal.value,
+                         reset_signal.value)
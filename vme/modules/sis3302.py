@@ -7,8 +7,13 @@ Created on Jun 19, 2013
 @author: Christian Strandhagen (strandhagen _at_ pit.physik.uni-tuebingen.de)
 '''
 
+import time
+import json
+
 import numpy as np
 
+from .bridge import execute
+
 import logging
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -18,6 +23,12 @@ logger.addHandler(logging.NullHandler())
 MAX_NOF_SAMPLES = 0x2000000      # = 32MSample DO NOT CHANGE!
 MAX_SAMPLES_PER_PAGE = 0x400000  # = 4 MSample DO NOT CHANGE!
 
+MODULE_NUMBER = 0x3302           # upper 16 bits of MODID
+
+# polling intervals (in s) of the incremental readout
+POLL_INTERVAL_MIN = 0.0001
+POLL_INTERVAL_MAX = 0.05
+
 # ADDRESSES
 
 CONTROL_STATUS = 0x0
@@ -29,6 +40,7 @@ START_DELAY = 0x14
 STOP_DELAY = 0x18
 MAX_NOF_EVENT = 0x20
 ACTUAL_EVENT_COUNTER = 0x24
+BROADCAST_SETUP = 0x30
 ADC_MEMORY_PAGE = 0x34
 DAC_CONTROL_STATUS = 0x50
 DAC_DATA = 0x54
@@ -94,6 +106,35 @@ SAMPLE_START_ADDRESS_ALL_ADC = 0x01000008
 ADC_INPUT_MODE_ALL_ADC = 0x0100000C
 TRIGGER_FLAG_CLR_CNT_ALL_ADC = 0x0100002C
 
+# PER ADC (index = adc number, the adcs are grouped in pairs)
+
+ADC_GROUP = [None,
+             0x02000000,
+             0x02000000,
+             0x02800000,
+             0x02800000,
+             0x03000000,
+             0x03000000,
+             0x03800000,
+             0x03800000]
+
+# offsets within the group, odd adcs first
+ACTUAL_SAMPLE_ADDRESS_OFFSET = [0x10, 0x14]
+TRIGGER_SETUP_OFFSET = [0x30, 0x38]
+TRIGGER_THRESHOLD_OFFSET = [0x34, 0x3C]
+
+ACTUAL_SAMPLE_ADDRESS = [None] + [
+    ADC_GROUP[adc] + ACTUAL_SAMPLE_ADDRESS_OFFSET[(adc - 1) % 2]
+    for adc in range(1, 9)]
+
+TRIGGER_SETUP = [None] + [
+    ADC_GROUP[adc] + TRIGGER_SETUP_OFFSET[(adc - 1) % 2]
+    for adc in range(1, 9)]
+
+TRIGGER_THRESHOLD = [None] + [
+    ADC_GROUP[adc] + TRIGGER_THRESHOLD_OFFSET[(adc - 1) % 2]
+    for adc in range(1, 9)]
+
 # ADC 1/2
 
 ADC_INPUT_MODE_ADC12 = 0x0200000C
@@ -103,19 +144,17 @@ TRIGGER_FLAG_CLR_CNT_ADC12 = 0x0200002C
 
 # ADC 1
 
-ACTUAL_SAMPLE_ADDRESS_ADC1 = 0x02000010
-TRIGGER_SETUP_ADC1 = 0x02000030
-TRIGGER_THRESHOLD_ADC1 = 0x02000034
+ACTUAL_SAMPLE_ADDRESS_ADC1 = ACTUAL_SAMPLE_ADDRESS[1]
+TRIGGER_SETUP_ADC1 = TRIGGER_SETUP[1]
+TRIGGER_THRESHOLD_ADC1 = TRIGGER_THRESHOLD[1]
 EVENT_DIRECTORY_ADC1 = 0x02010000
 
 # ADC 2
-ACTUAL_SAMPLE_ADDRESS_ADC2 = 0x02000014
-TRIGGER_SETUP_ADC2 = 0x02000038
-TRIGGER_THRESHOLD_ADC2 = 0x0200003C
+ACTUAL_SAMPLE_ADDRESS_ADC2 = ACTUAL_SAMPLE_ADDRESS[2]
+TRIGGER_SETUP_ADC2 = TRIGGER_SETUP[2]
+TRIGGER_THRESHOLD_ADC2 = TRIGGER_THRESHOLD[2]
 EVENT_DIRECTORY_ADC2 = 0x02018000
 
-# TODO: implement other adcs
-
 # ACQUISITION CONTROL
 
 ACQ_SET_CLOCK_TO_100MHZ = 0x70000000
@@ -142,6 +181,11 @@ ACQ_ENABLE_MULTIEVENT = 0x00000020
 ACQ_DISABLE_AUTOSTART = 0x00100000
 ACQ_ENABLE_AUTOSTART = 0x00000010
 
+# EVENT DIRECTORY ENTRIES
+
+EVENT_DIRECTORY_ADDRESS_MASK = 0x1ffffff  # next sample address after event
+EVENT_DIRECTORY_WRAP = 0x10000000         # page wrapped around
+
 # EVENT_CONFIG
 
 EVENT_CONF_ENABLE_SAMPLE_LENGTH_STOP = 0x20
@@ -162,6 +206,38 @@ EVENT_CONF_PAGE_SIZE_256_WRAP = 0x9
 EVENT_CONF_PAGE_SIZE_128_WRAP = 0xA
 EVENT_CONF_PAGE_SIZE_64_WRAP = 0xB
 
+# TRIGGER SETUP
+
+TRIGGER_PEAKING_MASK = 0x1f        # bits 4:0, peaking time P (1-16)
+TRIGGER_GAP_SHIFT = 8              # bits 12:8, gap time G (1-16)
+TRIGGER_GAP_MASK = 0x1f
+TRIGGER_PULSE_LENGTH_SHIFT = 16    # bits 23:16, trigger pulse length
+TRIGGER_PULSE_LENGTH_MASK = 0xff
+
+# TRIGGER THRESHOLD
+
+TRIGGER_THRESHOLD_ZERO = 0x10000   # threshold value of FIR output 0
+TRIGGER_THRESHOLD_MASK = 0x1ffff   # bits 16:0
+TRIGGER_GT = 0x02000000            # trigger on FIR output > threshold
+TRIGGER_DISABLE = 0x04000000
+
+# BROADCAST_SETUP
+
+BROADCAST_ENABLE = 0x10            # module listens to the broadcast address
+BROADCAST_MASTER = 0x20            # module terminates broadcast cycles
+BROADCAST_ADDRESS_SHIFT = 24       # bits 31:24, A32 bits 31:24
+BROADCAST_ADDRESS_MASK = 0xff000000
+
+# DAC_CONTROL_STATUS
+
+DAC_CMD_LOAD_SHIFT_REGISTER = 0x1
+DAC_CMD_LOAD_DAC = 0x2
+DAC_CMD_CLEAR = 0x3
+DAC_SELECT_SHIFT = 4               # bits 6:4, dac (= adc - 1)
+DAC_BUSY = 0x8000
+DAC_MAX = 0xffff
+DAC_TIMEOUT = 0.01                 # s until a busy dac is an error
+
 # IRQ_CONFIG
 
 IRQ_ENABLE = 0x800
@@ -182,6 +258,33 @@ SIS_PAGE_SIZE = {64: 0xB,
                  4194304: 0x1,
                  16777216: 0x0}
 
+# registers saved in a configuration snapshot (name, address)
+CONFIGURATION = [('ACQUISITION_CONTROL', ACQUISITION_CONTROL),
+                 ('START_DELAY', START_DELAY),
+                 ('STOP_DELAY', STOP_DELAY),
+                 ('MAX_NOF_EVENT', MAX_NOF_EVENT),
+                 ('BROADCAST_SETUP', BROADCAST_SETUP),
+                 ('IRQ_CONFIG', IRQ_CONFIG),
+                 ('IRQ_CONTROL', IRQ_CONTROL),
+                 ('EVENT_CONFIG_ADC12', EVENT_CONFIG[1]),
+                 ('EVENT_CONFIG_ADC34', EVENT_CONFIG[3]),
+                 ('EVENT_CONFIG_ADC56', EVENT_CONFIG[5]),
+                 ('EVENT_CONFIG_ADC78', EVENT_CONFIG[7]),
+                 ('ADC_INPUT_MODE_ADC12', ADC_INPUT_MODE[1]),
+                 ('ADC_INPUT_MODE_ADC34', ADC_INPUT_MODE[3]),
+                 ('ADC_INPUT_MODE_ADC56', ADC_INPUT_MODE[5]),
+                 ('ADC_INPUT_MODE_ADC78', ADC_INPUT_MODE[7])]
+
+CONFIGURATION += [('TRIGGER_SETUP_ADC{0}'.format(adc), TRIGGER_SETUP[adc])
+                  for adc in range(1, 9)]
+CONFIGURATION += [('TRIGGER_THRESHOLD_ADC{0}'.format(adc),
+                   TRIGGER_THRESHOLD[adc]) for adc in range(1, 9)]
+
+# J/K registers: bits are set by writing the lower and cleared by
+# writing the upper 16 bits, the lower 16 bits read back the settings
+# (readConfiguration keeps only those)
+JK_REGISTERS = ['ACQUISITION_CONTROL', 'IRQ_CONTROL']
+
 CLK_SRC = {'100MHz': 0x70000000,
            '50MHz': 0x60001000,
            '25MHz': 0x50002000,
@@ -200,7 +303,7 @@ def decode_module_id(modid):
     '''
     msg = ''
 
-    for i in xrange(32, 0, -4):
+    for i in range(32, 0, -4):
         n = (modid & (2**i - 1)) >> (i - 4)
         msg += str(n)
 
@@ -209,14 +312,83 @@ def decode_module_id(modid):
     return msg
 
 
+def roi_segments(directory, page_size, offset, length):
+    '''
+    Computes the memory segments of a window of every event.
+
+    The window holds the samples offset to offset + length - 1 of each
+    event in chronological order. In wrap page mode the oldest sample of
+    an event is at the stop address from the event directory, so the
+    window may wrap around the end of the page; it is then split in two.
+    Segments are also split at the boundaries of the memory pages.
+
+    Returns a list of (sample address, number of samples), in event
+    order.
+    '''
+    if offset < 0 or length < 1 or offset + length > page_size:
+        raise ValueError('window outside of the page')
+
+    directory = np.asarray(directory, dtype=np.int64)
+
+    start = np.arange(len(directory), dtype=np.int64) * page_size
+    stop = directory & EVENT_DIRECTORY_ADDRESS_MASK
+    wrapped = (directory & EVENT_DIRECTORY_WRAP) != 0
+
+    phase = np.where(wrapped, (stop - start) % page_size, 0)
+    first = (phase + offset) % page_size
+    n1 = np.minimum(length, page_size - first)
+
+    segments = []
+
+    for s, f, n in zip(start.tolist(), first.tolist(), n1.tolist()):
+        parts = [(s + f, n)]
+        if n < length:
+            parts.append((s, length - n))
+
+        for address, n in parts:
+            # split at memory page boundaries
+            while n > 0:
+                k = min(n, MAX_SAMPLES_PER_PAGE -
+                        address % MAX_SAMPLES_PER_PAGE)
+                segments.append((address, k))
+                address += k
+                n -= k
+
+    return segments
+
+
+def load_configuration(filename):
+    '''
+    Loads a configuration snapshot saved with saveConfiguration.
+    '''
+    with open(filename) as f:
+        return json.load(f)
+
+
 class SIS3302(object):
     '''
     Implements the functionality of the SIS3302 FADC.
+
+    By default the module is reset on construction. If a configuration
+    snapshot (dict or file name) is given instead, the module is attached
+    without reset and only reconfigured if its registers differ from the
+    snapshot (see attach). With reset=False the module is used as is.
     '''
-    def __init__(self, vme, base_address):
+    def __init__(self, vme, base_address, reset=True, snapshot=None):
         self.vme = vme
         self.base_address = base_address
-        self.reset()
+
+        # read position (in events) of the incremental readout
+        self._read_position = {}
+        self._poll_interval = POLL_INTERVAL_MIN
+
+        # last values written to the offset dacs
+        self.dac_offsets = None
+
+        if snapshot is not None:
+            self.attach(snapshot)
+        elif reset:
+            self.reset()
 
     def getModuleID(self):
         '''
@@ -234,6 +406,118 @@ class SIS3302(object):
         logger.debug('reset')
         self.vme.singleWriteD32(self.base_address + KEY_RESET, 1)
 
+    def readConfiguration(self):
+        '''
+        Reads all registers of the configuration snapshot in one batch.
+
+        Returns a dict of register name -> value.
+        '''
+        logger.debug('read configuration')
+        addresses = [self.base_address + address
+                     for name, address in CONFIGURATION]
+        values = self.vme.multiReadD32(addresses)
+
+        config = {}
+
+        for (name, address), value in zip(CONFIGURATION, values):
+            if name in JK_REGISTERS:
+                value &= 0xffff
+
+            config[name] = int(value)
+
+        return config
+
+    def writeConfiguration(self, config):
+        '''
+        Writes the registers of a configuration snapshot in one batch.
+        '''
+        logger.debug('write configuration')
+        addresses = []
+        data = []
+
+        for name, address in CONFIGURATION:
+            if name not in config:
+                continue
+
+            value = config[name]
+
+            if name in JK_REGISTERS:
+                value = (value & 0xffff) | ((~value & 0xffff) << 16)
+
+            addresses.append(self.base_address + address)
+            data.append(value)
+
+        self.vme.multiWriteD32(addresses, data)
+
+    def saveConfiguration(self, filename):
+        '''
+        Saves the current configuration of the module as snapshot.
+
+        See also: load_configuration, attach
+        '''
+        logger.debug('save configuration to {0}'.format(filename))
+        config = self.readConfiguration()
+
+        with open(filename, 'w') as f:
+            json.dump(config, f, indent=4, sort_keys=True)
+
+        return config
+
+    def attach(self, snapshot):
+        '''
+        Attaches to an already configured module without reset.
+
+        The configuration registers are read back in one batch and
+        compared to snapshot (dict or file name). The configuration is
+        only rewritten if they differ.
+
+        Returns True if the module already matched the snapshot.
+        '''
+        if not isinstance(snapshot, dict):
+            snapshot = load_configuration(snapshot)
+
+        current = self.readConfiguration()
+
+        differing = sorted(name for name in snapshot
+                           if current.get(name) != snapshot[name])
+
+        if not differing:
+            logger.debug('attached to configured module')
+            return True
+
+        msg = 'configuration differs ({0}), rewrite configuration'
+        logger.info(msg.format(', '.join(differing)))
+
+        self.writeConfiguration(snapshot)
+
+        return False
+
+    def configureBroadcast(self, address, enable=True, master=False):
+        '''
+        Sets up the module to take writes to the broadcast (MCST)
+        address.
+
+        address is the A32 broadcast base (bits 31:24 used). Exactly one
+        module of a broadcast group has to be master, it terminates the
+        broadcast cycles on the bus.
+        '''
+        if address & ~BROADCAST_ADDRESS_MASK:
+            raise ValueError('broadcast address must be a multiple of '
+                             '0x1000000')
+
+        data = address & BROADCAST_ADDRESS_MASK
+
+        if enable:
+            data |= BROADCAST_ENABLE
+
+        if master:
+            data |= BROADCAST_MASTER
+
+        msg = 'configure broadcast address {0:#010x} ({1:#x})'
+        logger.debug(msg.format(address, data))
+
+        self.vme.singleWriteD32(self.base_address + BROADCAST_SETUP, data)
+
     def clearTimestamps(self):
         logger.debug('clear timestamps')
         self.vme.singleWriteD32(self.base_address + KEY_TIMESTAMP_CLR, 1)
@@ -306,6 +590,10 @@ class SIS3302(object):
         logger.debug('get max number of events')
         return self.vme.singleReadD32(self.base_address + MAX_NOF_EVENT)
 
+    def getActualEventCounter(self):
+        logger.debug('get actual event counter')
+        return self.vme.singleReadD32(self.base_address + ACTUAL_EVENT_COUNTER)
+
     def enablePageWrap(self, enable=True):
         data = self.readEventConfiguration(1)
 
@@ -463,10 +751,144 @@ class SIS3302(object):
 
         # ts = np.array([(high<<32)+low for high,low in zip(ts[::2],ts[1::2])])
 
-        high = ts[::2]
-        low = ts[1::2]
+        high = ts[::2].astype(np.uint64)
+        low = ts[1::2].astype(np.uint64)
+
+        return (high << np.uint64(32)) | low
+
+    def configureTriggers(self, thresholds, peaking, gap, pulse_length=0,
+                          enable=True, gt=True):
+        '''
+        Configures the triggers of all eight adcs in one batch.
+
+        All parameters are either scalars (same value for all adcs) or
+        arrays with one value per adc.
+
+        Parameters
+        ----------
+        thresholds : array_like
+            Threshold of the trapezoidal FIR output (-65536 to 65535).
+        peaking : array_like
+            Peaking time P in samples (1 to 16).
+        gap : array_like
+            Gap time G in samples (1 to 16).
+        pulse_length : array_like
+            Length of the trigger output pulse (0 to 255).
+        enable : array_like
+            Enable the trigger of the adc.
+        gt : array_like
+            Trigger if the FIR output is greater than the threshold
+            (otherwise when it crosses the threshold).
+        '''
+        def per_adc(value, name):
+            value = np.asarray(value, dtype=np.int64)
+            if value.ndim == 0:
+                value = np.repeat(value, 8)
+            if value.shape != (8,):
+                raise ValueError('{0} needs 8 values'.format(name))
+            return value
+
+        thresholds = per_adc(thresholds, 'thresholds')
+        peaking = per_adc(peaking, 'peaking')
+        gap = per_adc(gap, 'gap')
+        pulse_length = per_adc(pulse_length, 'pulse_length')
+        enable = per_adc(enable, 'enable').astype(bool)
+        gt = per_adc(gt, 'gt').astype(bool)
+
+        if np.any((thresholds < -TRIGGER_THRESHOLD_ZERO) |
+                  (thresholds >= TRIGGER_THRESHOLD_ZERO)):
+            raise ValueError('thresholds must be between -65536 and 65535')
+
+        if np.any((peaking < 1) | (peaking > 16)):
+            raise ValueError('peaking time must be between 1 and 16')
+
+        if np.any((gap < 1) | (gap > 16)):
+            raise ValueError('gap time must be between 1 and 16')
 
-        return high * 2**32 + low
+        if np.any((pulse_length < 0) | (pulse_length > 255)):
+            raise ValueError('pulse length must be between 0 and 255')
+
+        setup = (peaking | (gap << TRIGGER_GAP_SHIFT) |
+                 (pulse_length << TRIGGER_PULSE_LENGTH_SHIFT))
+
+        threshold = (thresholds + TRIGGER_THRESHOLD_ZERO)
+        threshold |= np.where(gt, TRIGGER_GT, 0)
+        threshold |= np.where(enable, 0, TRIGGER_DISABLE)
+
+        logger.debug('configure triggers of all adcs')
+
+        addresses = [self.base_address + address
+                     for address in TRIGGER_SETUP[1:] + TRIGGER_THRESHOLD[1:]]
+        data = [int(d) for d in np.concatenate([setup, threshold])]
+
+        self.vme.multiWriteD32(addresses, data)
+
+    def readTriggerConfiguration(self):
+        '''
+        Reads the trigger settings of all adcs in one batch.
+
+        Returns a dict of arrays (one value per adc) with the keys of
+        configureTriggers' parameters.
+        '''
+        logger.debug('read trigger configuration')
+
+        addresses = [self.base_address + address
+                     for address in TRIGGER_SETUP[1:] + TRIGGER_THRESHOLD[1:]]
+        values = np.array(self.vme.multiReadD32(addresses), dtype=np.int64)
+
+        setup = values[:8]
+        threshold = values[8:]
+
+        return {'thresholds': ((threshold & TRIGGER_THRESHOLD_MASK) -
+                               TRIGGER_THRESHOLD_ZERO),
+                'peaking': setup & TRIGGER_PEAKING_MASK,
+                'gap': (setup >> TRIGGER_GAP_SHIFT) & TRIGGER_GAP_MASK,
+                'pulse_length': ((setup >> TRIGGER_PULSE_LENGTH_SHIFT) &
+                                 TRIGGER_PULSE_LENGTH_MASK),
+                'enable': (threshold & TRIGGER_DISABLE) == 0,
+                'gt': (threshold & TRIGGER_GT) != 0}
+
+    def _waitDAC(self):
+        address = self.base_address + DAC_CONTROL_STATUS
+        start = time.time()
+
+        while self.vme.singleReadD32(address) & DAC_BUSY:
+            if time.time() - start > DAC_TIMEOUT:
+                raise IOError('offset dac busy')
+
+    def setOffsetDACs(self, offsets):
+        '''
+        Sets the offset dacs (baseline offsets) of all eight adcs.
+
+        offsets is a scalar (same value for all adcs) or an array with
+        one value per adc (0 to 65535). The values are kept in
+        dac_offsets, the dacs can not be read back.
+        '''
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if offsets.ndim == 0:
+            offsets = np.repeat(offsets, 8)
+
+        if offsets.shape != (8,):
+            raise ValueError('offsets needs 8 values')
+
+        if np.any((offsets < 0) | (offsets > DAC_MAX)):
+            raise ValueError('offsets must be between 0 and 65535')
+
+        logger.debug('set offset dacs to {0}'.format(list(offsets)))
+
+        control = self.base_address + DAC_CONTROL_STATUS
+
+        for i, offset in enumerate(offsets):
+            select = i << DAC_SELECT_SHIFT
+
+            self.vme.multiWriteD32([self.base_address + DAC_DATA, control],
+                                   [int(offset),
+                                    DAC_CMD_LOAD_SHIFT_REGISTER | select])
+            self._waitDAC()
+            self.vme.singleWriteD32(control, DAC_CMD_LOAD_DAC | select)
+            self._waitDAC()
+
+        self.dac_offsets = offsets
 
     def readADCInputModeRegister(self, adc):
         if adc < 1 or adc > 8:
@@ -506,34 +928,273 @@ class SIS3302(object):
         address = self.base_address + ADC_INPUT_MODE[0]
         self.vme.singleWriteD32(address, data)
 
-    def readData(self, adc, page_size, n_events):
+    def readData(self, adc, page_size, n_events, width=16, out=None):
         msg = 'read {0} events from adc {1} with page size {2}'
         logger.debug(msg.format(n_events, adc, page_size))
 
-        samples_per_page = 0x400000
+        if out is not None:
+            # contiguous (n_events, page_size) array, reshape gives a view
+            out = out.reshape(-1)
+
+        data = self.readSamples(adc, 0, page_size * n_events, width, out)
+
+        return data.reshape(n_events, page_size)
+
+    def readSamples(self, adc, offset, n_samples, width=16, out=None):
+        '''
+        Reads n_samples samples of adc starting at sample offset.
+
+        The ADC memory is only visible through a window of 4 MSamples,
+        reads crossing the boundary of a memory page are split up and
+        the pages are selected accordingly.
+
+        With width=32 the samples are transferred in pairs by D32 block
+        reads (offset and n_samples have to be even).
+
+        If out (uint16, n_samples) is given, the samples are stored in it
+        and out is returned. Bridges with READS_INTO_BUFFER (v2718) read
+        directly into out, otherwise each page is copied.
+        '''
+        if offset < 0 or offset + n_samples > MAX_NOF_SAMPLES:
+            raise IndexError('samples out of range of adc memory')
+
+        if width == 32 and (offset % 2 or n_samples % 2):
+            raise ValueError('D32 reads need an even offset and length')
 
         address = self.base_address + ADC_OFFSET[adc]
-        n_samples = page_size * n_events
+        direct = (out is not None and out.flags.c_contiguous and
+                  getattr(self.vme, 'READS_INTO_BUFFER', False))
 
-        # check if more than 4MSamples are requested at once
-        if n_samples > samples_per_page:
-            n_pages = n_samples / samples_per_page
-            logger.debug('splitting into {0} pages'.format(n_pages))
+        chunks = []
+        position = 0
 
-            samples = [samples_per_page for i in xrange(n_pages)]
-            rest = n_samples - (n_pages * samples_per_page)
+        while n_samples > 0:
+            page, page_offset = divmod(offset, MAX_SAMPLES_PER_PAGE)
+            n = min(n_samples, MAX_SAMPLES_PER_PAGE - page_offset)
 
-            if rest > 0:
-                samples.append(rest)
+            self.selectMemoryPage(page)
 
-            data = np.array([], dtype='uint16')
+            if direct:
+                view = out[position:position + n]
+
+                if width == 32:
+                    self.vme.blockReadD32(address + 2 * page_offset, n // 2,
+                                          out=view.view(np.uint32))
+                else:
+                    self.vme.blockReadD16(address + 2 * page_offset, n,
+                                          out=view)
+            else:
+                if width == 32:
+                    data = self.vme.blockReadD32(address + 2 * page_offset,
+                                                 n // 2)
+                    data = data.view(np.uint16)
+                else:
+                    data = self.vme.blockReadD16(address + 2 * page_offset,
+                                                 n)
+
+                if out is not None:
+                    out[position:position + n] = data
+                else:
+                    chunks.append(data)
+
+            position += n
+            offset += n
+            n_samples -= n
+
+        if out is not None:
+            return out
+
+        if len(chunks) == 1:
+            return chunks[0]
+
+        logger.debug('read split into {0} pages'.format(len(chunks)))
+
+        return np.concatenate(chunks)
+
+    def readROI(self, adc, page_size, n_events, offset, length,
+                directory=None, out=None):
+        '''
+        Reads a window of length samples starting at sample offset of
+        every event (in chronological order, see roi_segments).
+
+        Only the windows are transferred, as a batch of short block reads
+        (a single request on bridges with execute). The event directory
+        of adc is read unless given.
+
+        Returns an (n_events, length) array (out if given). Bridges with
+        READS_INTO_BUFFER read the windows directly into out.
+        '''
+        if directory is None:
+            directory = self.readEventDirectory(adc, n_events)
+
+        segments = roi_segments(directory[:n_events], page_size, offset,
+                                length)
+
+        base = self.base_address + ADC_OFFSET[adc]
+
+        # results of execute are copies, a request cannot read into out
+        direct = (out is not None and out.flags.c_contiguous and
+                  getattr(self.vme, 'READS_INTO_BUFFER', False) and
+                  not hasattr(self.vme, 'execute'))
+
+        if direct:
+            flat = out.reshape(-1)
+
+        cycles = []
+        reads = []
+        page = None
+        position = 0
+
+        for address, n in segments:
+            if address // MAX_SAMPLES_PER_PAGE != page:
+                page = address // MAX_SAMPLES_PER_PAGE
+                cycles.append(('singleWriteD32',
+                               [self.base_address + ADC_MEMORY_PAGE, page]))
+
+            args = [base + 2 * (address % MAX_SAMPLES_PER_PAGE), n]
+
+            if direct:
+                args.append(flat[position:position + n])
+
+            cycles.append(('blockReadD16', args))
+            reads.append(len(cycles) - 1)
+            position += n
+
+        msg = 'read window {0}+{1} of {2} events from adc {3} in {4} cycles'
+        logger.debug(msg.format(offset, length, n_events, adc, len(cycles)))
+
+        results = execute(self.vme, cycles)
 
-            for i, n in enumerate(samples):
-                self.selectMemoryPage(i)
-                readout = self.vme.blockReadD16(address, n)
-                data = np.concatenate([data, readout])
+        if direct:
+            return out
+
+        chunks = [np.asarray(results[i], dtype=np.uint16) for i in reads]
+
+        if out is not None:
+            np.concatenate(chunks, out=out.reshape(-1))
+            return out
+
+        return np.concatenate(chunks).reshape(n_events, length)
+
+    def resetReadPosition(self, adc=None):
+        '''
+        Resets the read position of the incremental readout.
+
+        If adc is None the read positions of all adcs are reset.
+
+        See also: readNewEvents
+        '''
+        if adc is None:
+            logger.debug('reset read positions')
+            self._read_position.clear()
         else:
-            data = self.vme.blockReadD16(address, n_samples)
+            logger.debug('reset read position of adc {0}'.format(adc))
+            self._read_position.pop(adc, None)
+
+    def getReadPosition(self, adc):
+        '''
+        Returns the number of events already read from adc by
+        the incremental readout.
+        '''
+        return self._read_position.get(adc, 0)
+
+    def waitForEvents(self, n_events, timeout=None):
+        '''
+        Polls the actual event counter until it reaches n_events.
+
+        The polling interval is doubled on each unsuccessful poll (up to
+        POLL_INTERVAL_MAX). The next call starts at a quarter of the
+        last interval (half if the events were already there), so the
+        polling adapts to the trigger rate.
+
+        Returns the actual event counter, which is smaller than n_events
+        if the timeout (in s) expired.
+        '''
+        start = time.time()
+        interval = self._poll_interval
+        first = True
+
+        while True:
+            counter = self.getActualEventCounter()
+
+            if counter >= n_events:
+                if first:
+                    interval /= 2.
+                else:
+                    interval /= 4.
+
+                self._poll_interval = max(interval, POLL_INTERVAL_MIN)
+                return counter
+
+            if timeout is not None and time.time() - start > timeout:
+                logger.debug('timeout while waiting for events')
+                self._poll_interval = interval
+                return counter
+
+            time.sleep(interval)
+            interval = min(2 * interval, POLL_INTERVAL_MAX)
+            first = False
+
+    def readNewEvents(self, adc, page_size, timeout=None, max_events=None):
+        '''
+        Reads the events of adc completed since the last call.
+
+        Intended for multi-event mode: instead of waiting for the maximum
+        number of events, the actual event counter is polled (see
+        waitForEvents) and only the new events are transferred. The read
+        position is kept across calls and reset when the event counter
+        drops below it (i.e. the sampling logic was re-armed).
+
+        Parameters
+        ----------
+        adc : int
+            ADC number (between 1 and 8)
+        page_size : int
+            Page size (samples per event) as set with setPageSize
+        timeout : float
+            Time in s to wait for at least one new event. None waits
+            forever, 0 returns immediately.
+        max_events : int
+            Maximum number of events to read in one call.
+
+        Returns
+        -------
+        data : ndarray
+            Array of shape (n_new_events, page_size), n_new_events may
+            be 0 if the timeout expired.
+        '''
+        position = self._read_position.get(adc, 0)
+
+        # check for a re-arm first, the counter may never pass position
+        counter = self.getActualEventCounter()
+
+        if counter < position:
+            logger.debug('event counter was reset, start from first event')
+            position = 0
+
+        if counter <= position:
+            counter = self.waitForEvents(position + 1, timeout)
+
+            if counter < position:
+                logger.debug('event counter was reset, start from first '
+                             'event')
+                position = 0
+
+        n_events = counter - position
+
+        if max_events is not None:
+            n_events = min(n_events, max_events)
+
+        msg = 'read {0} new events from adc {1} (position {2})'
+        logger.debug(msg.format(n_events, adc, position))
+
+        if n_events > 0:
+            data = self.readSamples(adc, position * page_size,
+                                    n_events * page_size)
+        else:
+            data = np.array([], dtype='uint16')
+
+        self._read_position[adc] = position + n_events
 
         return data.reshape(n_events, page_size)
 
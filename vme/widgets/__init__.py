@@ -2,24 +2,43 @@ from PyQt4 import QtGui, QtCore
 
 from ..modules.caen895 import CAEN895
 from ..modules.caen2718 import v2718
+from ..modules.sis3302 import SIS3302
+from ..modules.remote import RemoteBridge
+from ..modules.bridge import LockedBridge
+from ..modules.scan import find_sis3302, find_caen895
 
 from .caen895 import CAEN_895_Widget
+from .sis3302 import SIS3302_Widget
+from .crate import CrateView
 
 import logging
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
-CONTROLLERS = {'v2718': v2718}
+CONTROLLERS = {'v2718': v2718,
+               'remote': RemoteBridge}
 
-MODULES = {'v895': CAEN895}
+MODULES = {'v895': CAEN895,
+           'sis3302': SIS3302}
 
-WIDGETS = {'v895': CAEN_895_Widget}
+WIDGETS = {'v895': CAEN_895_Widget,
+           'sis3302': SIS3302_Widget}
+
+SCANNERS = {'v895': find_caen895,
+            'sis3302': find_sis3302}
+
+# options to attach to a module found in the crate without changing it
+ATTACH = {'sis3302': {'reset': False},
+          'v895': {}}
 
 
 class BaseaddressDialog(QtGui.QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, controller=None, module=None):
         super(BaseaddressDialog, self).__init__(parent)
 
+        self.controller = controller
+        self.module = module
+
         layout = QtGui.QVBoxLayout(self)
 
         self.baseSpin = HexSpinBox()
@@ -28,6 +47,22 @@ class BaseaddressDialog(QtGui.QDialog):
         self.baseSpin.setValue(0x00010000)
         layout.addWidget(self.baseSpin)
 
+        # scan crate for modules of the selected type
+        if controller is not None and module in SCANNERS:
+            self.foundCombo = QtGui.QComboBox()
+            self.foundCombo.setToolTip('modules found in the crate')
+            self.foundCombo.activated[str].connect(self.foundSelected)
+
+            scanButton = QtGui.QPushButton('Scan')
+            scanButton.setToolTip('search crate for {0} modules'.format(
+                module))
+            scanButton.clicked.connect(self.scan)
+
+            lo = QtGui.QHBoxLayout()
+            lo.addWidget(self.foundCombo, 1)
+            lo.addWidget(scanButton)
+            layout.addLayout(lo)
+
         # OK and Cancel buttons
         buttons = QtGui.QDialogButtonBox(
             QtGui.QDialogButtonBox.Ok | QtGui.QDialogButtonBox.Cancel,
@@ -36,14 +71,27 @@ class BaseaddressDialog(QtGui.QDialog):
         buttons.rejected.connect(self.reject)
         layout.addWidget(buttons)
 
+    def scan(self):
+        found = SCANNERS[self.module](self.controller)
+        logger.debug('found {0} at {1}'.format(self.module, found))
+
+        self.foundCombo.clear()
+        self.foundCombo.addItems(['{0:X}'.format(b) for b in found])
+
+        if found:
+            self.baseSpin.setValue(found[0])
+
+    def foundSelected(self, text):
+        self.baseSpin.setValue(int(str(text), 16))
+
     # get current base address from the dialog
     def baseaddress(self):
         return int(self.baseSpin.value())
 
     # static method to create the dialog and return (baseaddress, accepted)
     @staticmethod
-    def getBaseaddress(parent=None):
-        dialog = BaseaddressDialog(parent)
+    def getBaseaddress(parent=None, controller=None, module=None):
+        dialog = BaseaddressDialog(parent, controller, module)
         result = dialog.exec_()
         base_address = dialog.baseaddress()
         return (base_address, result == QtGui.QDialog.Accepted)
@@ -169,6 +217,7 @@ class VMESuite(QtGui.QApplication):
     def __init__(self, args):
         self.controller = None
         self.module = None
+        self.crateView = None
 
         super(VMESuite, self).__init__(args)
         self.mainWindow = MainWindow()
@@ -185,21 +234,58 @@ class VMESuite(QtGui.QApplication):
         logger.debug('init controller ({0})'.format(controller))
 
         del self.controller
-        self.controller = CONTROLLERS[controller]()
+
+        # shared by the register writers, readout and poller threads
+        self.controller = LockedBridge(CONTROLLERS[controller]())
+
+        # modules of the crate are shown side by side from now on
+        self.crateView = CrateView(self.controller, MODULES.keys())
+        self.crateView.addRequested.connect(
+            lambda module: self.initModule(str(module)))
+        self.crateView.scanRequested.connect(self.scanCrate)
+        self.mainWindow.replaceWidget(self.crateView)
 
     def initModule(self, module):
         logger.debug('init module ({0})'.format(module))
-        base_address, ok = BaseaddressDialog.getBaseaddress()
+        base_address, ok = BaseaddressDialog.getBaseaddress(
+            controller=self.controller, module=module)
 
         logger.debug('base address selected: ({0})'.format(base_address))
 
         if ok:
-            self.module = MODULES[module](self.controller, base_address)
-            widget = WIDGETS[module](self.module)
-            self.mainWindow.replaceWidget(widget)
+            self.addModule(module, base_address)
         else:
             logger.warning('base address not set correctly')
 
+    def addModule(self, module, base_address, attach=False):
+        '''
+        Creates driver and widget of a module and adds it to the crate
+        view. Modules which are shown already are not touched (no new
+        driver, no reset). With attach the module is used as is.
+        '''
+        if self.crateView.showWidget(module, base_address):
+            msg = '{0} at {1:#010x} is already shown'
+            self.updateStatus(msg.format(module, base_address))
+            return
+
+        options = ATTACH.get(module, {}) if attach else {}
+        self.module = MODULES[module](self.controller, base_address,
+                                      **options)
+
+        self.crateView.addWidget(module, base_address,
+                                 WIDGETS[module](self.module))
+
+    def scanCrate(self):
+        logger.debug('scan crate')
+
+        found = [(module, base_address)
+                 for module, scanner in SCANNERS.items()
+                 for base_address in scanner(self.controller)]
+        self.updateStatus('found {0} modules'.format(len(found)))
+
+        for module, base_address in sorted(found, key=lambda m: m[1]):
+            self.addModule(module, base_address, attach=True)
+
 
 def main():
     import argparse
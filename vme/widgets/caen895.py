@@ -1,5 +1,10 @@
 from PyQt4 import QtGui
 
+import numpy as np
+
+from ..modules.caen895 import MODULE_TYPE, VERSION, V895_MODULE_TYPE
+from .worker import RegisterWriter
+
 import logging
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -19,6 +24,14 @@ class CAEN_895_Widget(QtGui.QWidget):
 
         self.v895 = v895
 
+        # settings which differ from the module (all unknown at start)
+        self.dirty = set(['thresholds', 'channels', 'width1', 'width2',
+                          'majority'])
+
+        self.writer = RegisterWriter(self)
+        self.writer.failed.connect(self.writeFailed)
+        self.writer.start()
+
         self.initUI()
 
     def initUI(self):
@@ -34,10 +47,14 @@ class CAEN_895_Widget(QtGui.QWidget):
             thrBox.setRange(1, 255)
             thrBox.setValue(1)
             thrBox.setToolTip('threshold value in mV (1-255)')
+            thrBox.valueChanged.connect(
+                lambda value: self.markDirty('thresholds'))
             self.thresholdBoxes.append(thrBox)
 
             enBox = QtGui.QCheckBox()
             enBox.setToolTip('check to enable channel')
+            enBox.stateChanged.connect(
+                lambda state: self.markDirty('channels'))
             self.enableBoxes.append(enBox)
 
             lo = QtGui.QHBoxLayout()
@@ -58,6 +75,10 @@ class CAEN_895_Widget(QtGui.QWidget):
         self.width2Spin = QtGui.QSpinBox()
         self.width2Spin.setRange(0, 255)
         self.width2Spin.setToolTip('width of output pulse for channels 8-15')
+        self.width1Spin.valueChanged.connect(
+            lambda value: self.markDirty('width1'))
+        self.width2Spin.valueChanged.connect(
+            lambda value: self.markDirty('width2'))
 
         widthForm.addRow('Channels 0-7', self.width1Spin)
         widthForm.addRow('Channels 8-15', self.width2Spin)
@@ -71,10 +92,15 @@ class CAEN_895_Widget(QtGui.QWidget):
         self.majSpin = QtGui.QSpinBox()
         self.majSpin.setRange(0, 20)
         self.majSpin.setToolTip('number of channels which have to trigger simultaneously to generate output on "Majority Out"')
+        self.majSpin.valueChanged.connect(
+            lambda value: self.markDirty('majority'))
         majForm.addRow('Majority', self.majSpin)
 
         majGroup.setLayout(majForm)
 
+        self.statusLabel = QtGui.QLabel('-')
+        self.statusLabel.setToolTip('module type and version read back')
+
         self.testButton = QtGui.QPushButton('Send')
         self.testButton.setToolTip('generate test pulse on all outputs')
         self.testButton.clicked.connect(self.sendTestpulse)
@@ -91,6 +117,7 @@ class CAEN_895_Widget(QtGui.QWidget):
         lo_right.addWidget(widthGroup)
         lo_right.addWidget(majGroup)
         lo_right.addStretch()
+        lo_right.addWidget(self.statusLabel)
         lo_right.addWidget(self.testButton)
         lo_right.addWidget(self.okButton)
 
@@ -99,31 +126,86 @@ class CAEN_895_Widget(QtGui.QWidget):
 
         self.setLayout(layout)
 
+    def pollRegisters(self):
+        '''
+        Registers shown in the status label as (name, width, address),
+        read by a RegisterPoller.
+        '''
+        base = self.v895.base_address
+        return [('type', 16, base + MODULE_TYPE),
+                ('version', 16, base + VERSION)]
+
+    def updateRegisters(self, values):
+        if values['type'] is None:
+            self.statusLabel.setText('no response')
+        elif values['type'] != V895_MODULE_TYPE:
+            self.statusLabel.setText('unexpected module type')
+        else:
+            self.statusLabel.setText('v895 version {0:#x}'.format(
+                values['version']))
+
+    def markDirty(self, field):
+        self.dirty.add(field)
+
+    def writeFailed(self, field, msg):
+        logger.warning('writing {0} failed: {1}'.format(field, msg))
+        field = str(field)
+
+        # the test pulse is not a setting which has to be pushed again
+        if field != 'testpulse':
+            self.dirty.add(field)
+
+    def teardown(self):
+        '''
+        Stops the writer thread, called by CrateView before the widget
+        is removed.
+        '''
+        self.writer.stop()
+
+    def closeEvent(self, event):
+        self.teardown()
+        super(CAEN_895_Widget, self).closeEvent(event)
+
     def sendTestpulse(self):
         logger.debug('sending test pulse')
-        self.v895.sendTestpulse()
+        self.writer.queue('testpulse', self.v895.sendTestpulse)
 
     def pushSettings(self):
-        channelList = []
-
-        for i, z in enumerate(zip(self.thresholdBoxes, self.enableBoxes)):
-            if z[1].isChecked():
-                channelList.append(i)
-                thr = z[0].value()
-                msg = 'channel {0} is enabled, threshold: {1}'
-                logger.debug(msg.format(i, thr))
-                self.v895.setThreshold(i, thr)
-
-        self.v895.enableChannels(channelList)
-
-        width = self.width1Spin.value()
-        logger.debug('width group 1 is {0}'.format(width))
-        self.v895.setOutputWidth(1, width)
-
-        width = self.width2Spin.value()
-        logger.debug('width group 2 is {0}'.format(width))
-        self.v895.setOutputWidth(2, width)
+        '''
+        Queues writes of all settings changed since the last push.
 
-        maj = self.majSpin.value()
-        logger.debug('set majority to {0}'.format(maj))
-        self.v895.setMajority(maj)
+        The writes are done by a background thread, pending writes of
+        the same setting are replaced by the new value.
+        '''
+        dirty = self.dirty
+        self.dirty = set()
+
+        logger.debug('push settings {0}'.format(sorted(dirty)))
+
+        if 'thresholds' in dirty:
+            thresholds = np.array([box.value() for box in self.thresholdBoxes])
+            logger.debug('thresholds: {0}'.format(thresholds.tolist()))
+            self.writer.queue('thresholds', self.v895.setThresholds,
+                              thresholds)
+
+        if 'channels' in dirty:
+            channelList = [i for i, box in enumerate(self.enableBoxes)
+                           if box.isChecked()]
+            logger.debug('enabled channels: {0}'.format(channelList))
+            self.writer.queue('channels', self.v895.enableChannels,
+                              channelList)
+
+        if 'width1' in dirty:
+            width = self.width1Spin.value()
+            logger.debug('width group 1 is {0}'.format(width))
+            self.writer.queue('width1', self.v895.setOutputWidth, 1, width)
+
+        if 'width2' in dirty:
+            width = self.width2Spin.value()
+            logger.debug('width group 2 is {0}'.format(width))
+            self.writer.queue('width2', self.v895.setOutputWidth, 2, width)
+
+        if 'majority' in dirty:
+            maj = self.majSpin.value()
+            logger.debug('set majority to {0}'.format(maj))
+            self.writer.queue('majority', self.v895.setMajority, maj)
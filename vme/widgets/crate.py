@@ -0,0 +1,142 @@
+from PyQt4 import QtGui, QtCore
+
+from .worker import RegisterPoller
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class CrateView(QtGui.QWidget):
+    '''
+    Hosts the widgets of all modules of a crate in tabs.
+
+    The registers shown by the widgets (pollRegisters/updateRegisters)
+    are refreshed by one RegisterPoller, i.e. one batched read per
+    interval for the whole crate instead of reads by every widget.
+    Widgets with threads stop them in teardown, which is called when
+    the widget is removed or the view is closed.
+    '''
+    addRequested = QtCore.pyqtSignal(str)
+    scanRequested = QtCore.pyqtSignal()
+
+    def __init__(self, vme, modules, interval=1000, parent=None):
+        super(CrateView, self).__init__(parent)
+
+        self.vme = vme
+        self.widgets = {}
+
+        self.poller = RegisterPoller(vme, interval, self)
+        self.poller.polled.connect(self.updateRegisters)
+        self.poller.failed.connect(self.pollFailed)
+        self.poller.start()
+
+        self.initUI(modules)
+
+    def initUI(self, modules):
+        self.tabs = QtGui.QTabWidget()
+        self.tabs.setTabsClosable(True)
+        self.tabs.tabCloseRequested.connect(self.closeTab)
+
+        self.moduleCombo = QtGui.QComboBox()
+        self.moduleCombo.addItems(modules)
+
+        addButton = QtGui.QPushButton('Add')
+        addButton.setToolTip('add a module of the selected type')
+        addButton.clicked.connect(
+            lambda: self.addRequested.emit(self.moduleCombo.currentText()))
+
+        scanButton = QtGui.QPushButton('Scan crate')
+        scanButton.setToolTip('add all modules found in the crate')
+        scanButton.clicked.connect(self.scanRequested.emit)
+
+        lo = QtGui.QHBoxLayout()
+        lo.addWidget(self.moduleCombo)
+        lo.addWidget(addButton)
+        lo.addStretch()
+        lo.addWidget(scanButton)
+
+        layout = QtGui.QVBoxLayout()
+        layout.addLayout(lo)
+        layout.addWidget(self.tabs, 1)
+
+        self.setLayout(layout)
+
+    def key(self, name, base_address):
+        return '{0}@{1:08X}'.format(name, base_address)
+
+    def showWidget(self, name, base_address):
+        '''
+        Shows the widget of module name at base_address.
+
+        Returns False if there is no widget for this module.
+        '''
+        widget = self.widgets.get(self.key(name, base_address))
+
+        if widget is None:
+            return False
+
+        self.tabs.setCurrentWidget(widget)
+        return True
+
+    def addWidget(self, name, base_address, widget):
+        '''
+        Adds the widget of module name at base_address.
+
+        Returns False if there is a widget for this module already.
+        '''
+        key = self.key(name, base_address)
+
+        if key in self.widgets:
+            logger.warning('{0} is already shown'.format(key))
+            self.tabs.setCurrentWidget(self.widgets[key])
+            return False
+
+        logger.debug('add widget {0}'.format(key))
+
+        self.widgets[key] = widget
+        self.tabs.addTab(widget, key)
+        self.tabs.setCurrentWidget(widget)
+
+        if hasattr(widget, 'pollRegisters'):
+            self.poller.register(key, widget.pollRegisters())
+
+        return True
+
+    def closeTab(self, index):
+        widget = self.tabs.widget(index)
+        key = str(self.tabs.tabText(index))
+
+        logger.debug('remove widget {0}'.format(key))
+
+        self.poller.unregister(key)
+        del self.widgets[key]
+
+        self.tabs.removeTab(index)
+        self.teardown(widget)
+        widget.close()
+        widget.deleteLater()
+
+    def teardown(self, widget):
+        # the threads of the widget must finish before it is deleted
+        if hasattr(widget, 'teardown'):
+            widget.teardown()
+
+    def updateRegisters(self, values):
+        for key, registers in values.items():
+            widget = self.widgets.get(key)
+
+            if widget is not None:
+                widget.updateRegisters(registers)
+
+    def pollFailed(self, msg):
+        logger.warning('register poll failed: {0}'.format(msg))
+
+    def closeEvent(self, event):
+        self.poller.stop()
+
+        for widget in self.widgets.values():
+            self.teardown(widget)
+            widget.close()
+
+        super(CrateView, self).closeEvent(event)
@@ -0,0 +1,103 @@
+from PyQt4 import QtGui, QtCore
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class HistogramPlot(QtGui.QWidget):
+    '''
+    Draws the inter-event time histogram as bars (log scale in x).
+    '''
+
+    def __init__(self, parent=None):
+        super(HistogramPlot, self).__init__(parent)
+
+        self.counts = np.zeros(0)
+        self.setMinimumSize(300, 150)
+
+    def setCounts(self, counts):
+        self.counts = counts
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtCore.Qt.white)
+
+        if len(self.counts) == 0 or self.counts.max() == 0:
+            return
+
+        width = self.width()
+        height = self.height()
+
+        bar_width = float(width) / len(self.counts)
+        heights = (height - 1) * self.counts / float(self.counts.max())
+
+        for i, h in enumerate(heights):
+            if h > 0:
+                painter.fillRect(QtCore.QRectF(i * bar_width, height - h,
+                                               bar_width, h),
+                                 QtCore.Qt.darkBlue)
+
+
+class RateMonitorWidget(QtGui.QWidget):
+    '''
+    Shows the rates and the inter-event time distribution of a
+    RateMonitor, refreshed by a timer.
+    '''
+
+    def __init__(self, monitor, interval=500, parent=None):
+        super(RateMonitorWidget, self).__init__(parent)
+        self.setWindowTitle('Trigger Rate')
+
+        self.monitor = monitor
+
+        self.initUI()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start()
+
+    def initUI(self):
+        form = QtGui.QFormLayout()
+
+        self.instantLabel = QtGui.QLabel('-')
+        self.instantLabel.setToolTip('rate of the last readout')
+        form.addRow('Instantaneous', self.instantLabel)
+
+        self.windowLabel = QtGui.QLabel('-')
+        msg = 'rate of the last {0} s'.format(self.monitor.window)
+        self.windowLabel.setToolTip(msg)
+        form.addRow('Windowed', self.windowLabel)
+
+        self.meanLabel = QtGui.QLabel('-')
+        self.meanLabel.setToolTip('rate since start of run')
+        form.addRow('Mean', self.meanLabel)
+
+        self.eventLabel = QtGui.QLabel('0')
+        form.addRow('Events', self.eventLabel)
+
+        self.histogram = HistogramPlot()
+        self.histogram.setToolTip('inter-event time distribution '
+                                  '(10 ns - 100 s, log scale)')
+
+        layout = QtGui.QVBoxLayout()
+        layout.addLayout(form)
+        layout.addWidget(self.histogram, 1)
+
+        self.setLayout(layout)
+
+    def refresh(self):
+        monitor = self.monitor
+
+        self.instantLabel.setText(
+            '{0:.1f} Hz'.format(monitor.instantaneousRate()))
+        self.windowLabel.setText('{0:.1f} Hz'.format(monitor.windowedRate()))
+        self.meanLabel.setText('{0:.1f} Hz'.format(monitor.meanRate()))
+        self.eventLabel.setText(str(monitor.n_events))
+
+        counts, bins = monitor.histogram()
+        self.histogram.setCounts(counts)
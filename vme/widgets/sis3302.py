@@ -0,0 +1,358 @@
+from PyQt4 import QtGui, QtCore
+
+import time
+from collections import deque
+
+import numpy as np
+
+from ..modules.sis3302 import (SIS_PAGE_SIZE, ACQUISITION_CONTROL,
+                               ACTUAL_EVENT_COUNTER)
+from ..daq.ratemonitor import RateMonitor
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+COLORS = [QtCore.Qt.blue, QtCore.Qt.red, QtCore.Qt.darkGreen,
+          QtCore.Qt.magenta, QtCore.Qt.darkCyan, QtCore.Qt.darkYellow,
+          QtCore.Qt.black, QtCore.Qt.gray]
+
+
+def decimate_minmax(data, n_bins):
+    '''
+    Reduces data to the minimum and maximum of n_bins bins.
+
+    Returns x (sample index) and y arrays with 2 * n_bins points,
+    minimum and maximum of each bin alternating, so a line through the
+    points covers the full range of the original trace. Data shorter
+    than 2 * n_bins is returned unchanged.
+    '''
+    data = np.asarray(data)
+    n = len(data)
+
+    if n <= 2 * n_bins:
+        return np.arange(n), data
+
+    bin_size = n // n_bins
+    binned = data[:n_bins * bin_size].reshape(n_bins, bin_size)
+
+    y = np.empty(2 * n_bins, dtype=data.dtype)
+    y[::2] = binned.min(axis=1)
+    y[1::2] = binned.max(axis=1)
+
+    x = np.repeat(np.arange(n_bins) * bin_size, 2)
+    x[1::2] += bin_size - 1
+
+    return x, y
+
+
+def polyline(x, y):
+    '''
+    Returns a QPolygonF of the points x, y.
+
+    The coordinates are written into the point array of the polygon
+    (pairs of qreal, i.e. double) through a numpy view instead of
+    creating a QPointF per point.
+    '''
+    n = len(x)
+    polygon = QtGui.QPolygonF(n)
+
+    pointer = polygon.data()
+    pointer.setsize(2 * n * np.dtype(np.float64).itemsize)
+
+    points = np.frombuffer(pointer, dtype=np.float64).reshape(n, 2)
+    points[:, 0] = x
+    points[:, 1] = y
+
+    return polygon
+
+
+class ReadoutThread(QtCore.QThread):
+    '''
+    Runs SIS3302 multi-event acquisitions in the background.
+
+    The readouts are stored in a bounded buffer, old readouts are
+    dropped if the GUI does not keep up. An error ends the thread and
+    is reported by failed.
+    '''
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, sis, adcs, page_size, n_events, maxlen=4,
+                 monitor=None, parent=None):
+        super(ReadoutThread, self).__init__(parent)
+
+        self.sis = sis
+        self.adcs = adcs
+        self.page_size = page_size
+        self.n_events = n_events
+        self.monitor = monitor
+
+        self.buffer = deque(maxlen=maxlen)
+        self._running = False
+
+    def stop(self):
+        self._running = False
+        self.wait()
+
+    def run(self):
+        logger.debug('start readout thread')
+        self._running = True
+
+        try:
+            self.acquire()
+        except Exception as e:
+            logger.exception('readout failed')
+            self.failed.emit(str(e))
+
+        logger.debug('readout thread stopped')
+
+    def acquire(self):
+        sis = self.sis
+        sis.setPageSize(self.page_size)
+        sis.setMaxNoOfEvents(self.n_events)
+        sis.enableMultiEvent()
+
+        while self._running:
+            sis.armSamplingLogic()
+
+            counter = 0
+            while self._running and counter < self.n_events:
+                counter = sis.waitForEvents(self.n_events, timeout=0.2)
+
+            if counter < self.n_events:
+                sis.disarmSamplingLogic()
+                break
+
+            timestamps = sis.readTimestampDirectory(self.n_events)
+
+            if self.monitor is not None:
+                self.monitor.update(timestamps)
+
+            data = dict((adc, sis.readData(adc, self.page_size,
+                                           self.n_events))
+                        for adc in self.adcs)
+
+            self.buffer.append((time.time(), timestamps, data))
+
+
+class WaveformPlot(QtGui.QWidget):
+    '''
+    Draws waveforms decimated to the width of the widget.
+    '''
+
+    def __init__(self, parent=None):
+        super(WaveformPlot, self).__init__(parent)
+
+        self.traces = {}
+        self.setMinimumSize(400, 250)
+
+    def setTraces(self, traces):
+        '''
+        Sets the traces to draw as dict of adc -> 1-D array.
+        '''
+        self.traces = traces
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtCore.Qt.white)
+
+        width = self.width()
+        height = self.height()
+
+        for adc, trace in sorted(self.traces.items()):
+            if len(trace) < 2:
+                continue
+
+            x, y = decimate_minmax(trace, width)
+
+            x = x * (width - 1.) / (len(trace) - 1)
+            y = (height - 1) * (1. - y / 65535.)
+
+            painter.setPen(COLORS[(adc - 1) % len(COLORS)])
+            painter.drawPolyline(polyline(x, y))
+
+
+class SIS3302_Widget(QtGui.QWidget):
+    '''
+    Live view of the latest SIS3302 waveforms and the trigger rate.
+    '''
+
+    def __init__(self, sis, clock=100e6, parent=None):
+        super(SIS3302_Widget, self).__init__(parent)
+        self.setWindowTitle('SIS3302 - 8 Channel FADC')
+
+        self.sis = sis
+        self.monitor = RateMonitor(clock)
+        self.readout = None
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(40)
+        self.timer.timeout.connect(self.refresh)
+
+        self.initUI()
+
+    def initUI(self):
+        self.plot = WaveformPlot()
+
+        adcGroup = QtGui.QGroupBox('ADCs')
+        adcLayout = QtGui.QVBoxLayout()
+
+        self.adcBoxes = []
+
+        for adc in range(1, 9):
+            box = QtGui.QCheckBox('ADC {0}'.format(adc))
+            box.setChecked(adc == 1)
+            self.adcBoxes.append(box)
+            adcLayout.addWidget(box)
+
+        adcGroup.setLayout(adcLayout)
+
+        acqGroup = QtGui.QGroupBox('Acquisition')
+        acqForm = QtGui.QFormLayout()
+
+        self.pageCombo = QtGui.QComboBox()
+        for page_size in sorted(SIS_PAGE_SIZE):
+            self.pageCombo.addItem(str(page_size))
+        self.pageCombo.setCurrentIndex(self.pageCombo.findText('1024'))
+        self.pageCombo.setToolTip('samples per event')
+        acqForm.addRow('Page size', self.pageCombo)
+
+        self.eventSpin = QtGui.QSpinBox()
+        self.eventSpin.setRange(1, 0xfffff)
+        self.eventSpin.setValue(1)
+        self.eventSpin.setToolTip('events per readout')
+        acqForm.addRow('Events', self.eventSpin)
+
+        self.rateLabel = QtGui.QLabel('-')
+        self.rateLabel.setToolTip('trigger rate from timestamps')
+        acqForm.addRow('Rate', self.rateLabel)
+
+        acqGroup.setLayout(acqForm)
+
+        statusGroup = QtGui.QGroupBox('Status')
+        statusForm = QtGui.QFormLayout()
+
+        self.armedLabel = QtGui.QLabel('-')
+        self.armedLabel.setToolTip('state of the sampling logic')
+        statusForm.addRow('Sampling', self.armedLabel)
+
+        self.counterLabel = QtGui.QLabel('-')
+        self.counterLabel.setToolTip('actual event counter')
+        statusForm.addRow('Events', self.counterLabel)
+
+        self.readoutLabel = QtGui.QLabel('-')
+        self.readoutLabel.setToolTip('state of the readout thread')
+        statusForm.addRow('Readout', self.readoutLabel)
+
+        statusGroup.setLayout(statusForm)
+
+        self.startButton = QtGui.QPushButton('Start')
+        self.startButton.setCheckable(True)
+        self.startButton.toggled.connect(self.toggleAcquisition)
+
+        lo_right = QtGui.QVBoxLayout()
+        lo_right.addWidget(adcGroup)
+        lo_right.addWidget(acqGroup)
+        lo_right.addWidget(statusGroup)
+        lo_right.addStretch()
+        lo_right.addWidget(self.startButton)
+
+        layout = QtGui.QHBoxLayout()
+        layout.addWidget(self.plot, 1)
+        layout.addLayout(lo_right)
+
+        self.setLayout(layout)
+
+    def pollRegisters(self):
+        '''
+        Registers shown in the status group as (name, width, address),
+        read by a RegisterPoller.
+        '''
+        base = self.sis.base_address
+        return [('acquisition', 32, base + ACQUISITION_CONTROL),
+                ('counter', 32, base + ACTUAL_EVENT_COUNTER)]
+
+    def updateRegisters(self, values):
+        if values['acquisition'] is None:
+            self.armedLabel.setText('no response')
+            self.counterLabel.setText('-')
+            return
+
+        armed = values['acquisition'] & 0x10000
+        self.armedLabel.setText('armed' if armed else 'idle')
+        self.counterLabel.setText(str(values['counter']))
+
+    def toggleAcquisition(self, start):
+        if start:
+            self.startAcquisition()
+        else:
+            self.stopAcquisition()
+
+    def startAcquisition(self):
+        adcs = [i + 1 for i, box in enumerate(self.adcBoxes)
+                if box.isChecked()]
+
+        page_size = int(self.pageCombo.currentText())
+        n_events = self.eventSpin.value()
+
+        msg = 'start acquisition (adcs {0}, page size {1}, {2} events)'
+        logger.debug(msg.format(adcs, page_size, n_events))
+
+        self.monitor.reset()
+        self.readout = ReadoutThread(self.sis, adcs, page_size, n_events,
+                                     monitor=self.monitor, parent=self)
+        self.readout.failed.connect(self.readoutFailed)
+        self.readout.start()
+        self.readoutLabel.setText('running')
+        self.timer.start()
+
+        self.startButton.setText('Stop')
+
+    def stopAcquisition(self):
+        logger.debug('stop acquisition')
+        self.timer.stop()
+
+        if self.readout is not None:
+            self.readout.stop()
+            self.readout = None
+
+            if self.readoutLabel.text() == 'running':
+                self.readoutLabel.setText('stopped')
+
+        self.startButton.setText('Start')
+
+    def readoutFailed(self, msg):
+        self.readoutLabel.setText('error: {0}'.format(msg))
+        self.startButton.setChecked(False)
+
+    def teardown(self):
+        '''
+        Stops the readout thread, called by CrateView before the widget
+        is removed.
+        '''
+        self.stopAcquisition()
+
+    def closeEvent(self, event):
+        self.teardown()
+        super(SIS3302_Widget, self).closeEvent(event)
+
+    def refresh(self):
+        '''
+        Shows the latest readout, older ones are discarded.
+        '''
+        if self.readout is None:
+            return
+
+        try:
+            readout_time, timestamps, data = self.readout.buffer.pop()
+        except IndexError:
+            return
+
+        self.readout.buffer.clear()
+
+        # last event of each adc
+        self.plot.setTraces(dict((adc, d[-1]) for adc, d in data.items()))
+
+        rate = self.monitor.windowedRate()
+        self.rateLabel.setText('{0:.1f} Hz'.format(rate))
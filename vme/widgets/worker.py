@@ -0,0 +1,163 @@
+from PyQt4 import QtCore
+
+import threading
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class RegisterWriter(QtCore.QThread):
+    '''
+    Performs module writes in a background thread.
+
+    Writes are queued under a key (usually the register name). A write
+    queued while another one with the same key is still pending replaces
+    it, so rapid edits end up as a single bus access.
+    '''
+    failed = QtCore.pyqtSignal(str, str)
+
+    def __init__(self, parent=None):
+        super(RegisterWriter, self).__init__(parent)
+
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        self._running = True
+
+    def queue(self, key, func, *args):
+        '''
+        Queue call of func(*args) under key.
+        '''
+        with self._condition:
+            if key in self._pending:
+                logger.debug('coalescing write {0}'.format(key))
+                del self._pending[key]
+
+            self._pending[key] = (func, args)
+            self._condition.notify()
+
+    def pending(self):
+        '''
+        Returns the number of queued writes.
+        '''
+        with self._condition:
+            return len(self._pending)
+
+    def stop(self):
+        '''
+        Finish the pending writes and stop the thread.
+        '''
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+
+                if not self._pending:
+                    return
+
+                key, (func, args) = self._pending.popitem(last=False)
+
+            logger.debug('write {0}'.format(key))
+
+            try:
+                func(*args)
+            except Exception as e:
+                logger.exception('write {0} failed'.format(key))
+                self.failed.emit(key, str(e))
+
+
+class RegisterPoller(QtCore.QThread):
+    '''
+    Reads the registers shown by several widgets in a background thread.
+
+    Widgets register a list of (name, width, address) under a key. Every
+    interval (in ms) all registers are read in one batch, one multiRead
+    per data width, or a single request on bridges which can execute
+    several cycles at once (RemoteBridge). The values are delivered with
+    the polled signal as dict key -> {name: value}. Registers not
+    responding read as None.
+    '''
+    polled = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, vme, interval=1000, parent=None):
+        super(RegisterPoller, self).__init__(parent)
+
+        self.vme = vme
+        self.interval = interval
+
+        self._registers = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def register(self, key, registers):
+        with self._lock:
+            self._registers[key] = list(registers)
+
+    def unregister(self, key):
+        with self._lock:
+            self._registers.pop(key, None)
+
+    def stop(self):
+        self._stop.set()
+        self.wait()
+
+    def poll(self):
+        '''
+        Reads all registered registers once and returns the values.
+        '''
+        with self._lock:
+            registers = [(key, name, width, address)
+                         for key, regs in self._registers.items()
+                         for name, width, address in regs]
+
+        if not registers:
+            return {}
+
+        by_width = OrderedDict()
+        for i, (key, name, width, address) in enumerate(registers):
+            by_width.setdefault(width, []).append((i, address))
+
+        # -1 marks registers without response
+        methods = dict((w, 'multiReadD{0}'.format(w)) for w in by_width)
+
+        if hasattr(self.vme, 'execute'):
+            cycles = [(methods[w], [[a for i, a in regs], -1])
+                      for w, regs in by_width.items()]
+            results = self.vme.execute(cycles)
+        else:
+            results = [getattr(self.vme, methods[w])([a for i, a in regs], -1)
+                       for w, regs in by_width.items()]
+
+        values = [None] * len(registers)
+        for regs, result in zip(by_width.values(), results):
+            for (i, address), value in zip(regs, result):
+                values[i] = None if value == -1 else value
+
+        polled = OrderedDict()
+        for (key, name, width, address), value in zip(registers, values):
+            polled.setdefault(key, {})[name] = value
+
+        return polled
+
+    def run(self):
+        self._stop.clear()
+
+        while not self._stop.wait(self.interval / 1000.):
+            try:
+                values = self.poll()
+            except Exception as e:
+                logger.exception('polling registers failed')
+                self.failed.emit(str(e))
+                continue
+
+            if values:
+                self.polled.emit(values)